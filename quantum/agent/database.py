@@ -0,0 +1,113 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Access to the plugin's database from the agents.
+
+Agents poll the database for as long as they run, so connections are
+pooled, and a connection which has not been used for a while is pinged
+before being handed out again. A connection closed by the server, e.g.
+after a restart or a wait_timeout, is then replaced transparently instead
+of failing the agent's next query.
+
+The Linux bridge agent runs its plain SQL queries through an AgentDB.
+The OVS and Ryu agents use a SqlSoup bound to the same kind of engine,
+for the tables they write, such as vif_locations.
+"""
+
+import logging
+import time
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy import orm
+from sqlalchemy import sql
+
+
+LOG = logging.getLogger(__name__)
+
+# Connections kept open by an agent, which runs one query at a time.
+POOL_SIZE = 2
+# Seconds after which a connection is replaced, below MySQL's wait_timeout.
+POOL_RECYCLE = 3600
+# Seconds a pooled connection may stay unused before it is pinged.
+IDLE_PING_INTERVAL = 10
+
+
+def _on_checkin(dbapi_conn, connection_record):
+    connection_record.info["checked_in"] = time.time()
+
+
+def _on_checkout(dbapi_conn, connection_record, connection_proxy):
+    checked_in = connection_record.info.get("checked_in")
+    if checked_in is None or time.time() - checked_in < IDLE_PING_INTERVAL:
+        return
+    try:
+        cursor = dbapi_conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+    except Exception, e:
+        LOG.warn("Reconnecting to the database: %s" % e)
+        # the pool discards the connection and checks out another one
+        raise exc.DisconnectionError(str(e))
+
+
+def get_engine(sql_connection, **kwargs):
+    """Return a pooled engine which pings idle connections before use.
+
+    kwargs are passed to sqlalchemy.create_engine().
+    """
+    if not sql_connection.startswith("sqlite"):
+        kwargs.setdefault("pool_size", POOL_SIZE)
+        kwargs.setdefault("pool_recycle", POOL_RECYCLE)
+    engine = sqlalchemy.create_engine(sql_connection, **kwargs)
+    event.listen(engine, "checkin", _on_checkin)
+    event.listen(engine, "checkout", _on_checkout)
+    return engine
+
+
+class AgentDB(object):
+    """A database session running plain SQL with named parameters.
+
+    It has the execute(), commit() and rollback() methods of a SqlSoup, so
+    that it can be given to a status.StatusReporter. The connection goes
+    back to the pool whenever the transaction ends.
+    """
+
+    def __init__(self, engine):
+        self.bind = engine
+        self.session = orm.sessionmaker(bind=engine)()
+
+    def execute(self, statement, **params):
+        return self.session.execute(sql.text(statement), params)
+
+    def fetch(self, statement, **params):
+        """Return the rows of a query, whose columns are keys."""
+        return self.execute(statement, **params).fetchall()
+
+    def commit(self):
+        self.session.commit()
+
+    def rollback(self):
+        """Roll back the transaction, even if the connection is gone."""
+        try:
+            self.session.rollback()
+        except exc.SQLAlchemyError, e:
+            LOG.warn("Unable to roll back the transaction: %s" % e)
+
+    def close(self):
+        self.session.close()
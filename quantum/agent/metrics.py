@@ -0,0 +1,267 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Convergence metrics of the agents.
+
+Agents record timings, counters and gauges in a process wide registry:
+
+    iteration      duration of each pass of the daemon loop
+    command        latency of each command run as root
+    db             time spent querying and updating the quantum database
+    plug_to_up     time from an agent first reading a port binding to
+                   writing op_status UP for it (to binding the port, for
+                   the tunnel agent, which does not report op_status)
+    command_errors commands which exited with a non-zero status
+    ports_added    ports bound to a network
+    ports_removed  ports unbound or gone
+    tunnels        current number of tunnels (tunnel agent)
+
+Once configure() was called, a StatsServer returns them as JSON to anyone
+connecting to a local Unix socket, and a summary line is logged
+periodically.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+# Default seconds between two summary lines in the agent's log.
+DEFAULT_STATS_INTERVAL = 60
+
+
+class Timer(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def to_dict(self):
+        avg = 0.0
+        if self.count:
+            avg = self.total / self.count
+        return {"count": self.count, "total": self.total, "max": self.max,
+                "avg": avg}
+
+
+class Registry(object):
+    """Thread safe set of named timers, counters and gauges."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._timers = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        self._lock.acquire()
+        try:
+            self._timers.setdefault(name, Timer()).observe(seconds)
+        finally:
+            self._lock.release()
+
+    def incr(self, name, value=1):
+        self._lock.acquire()
+        try:
+            self._counters[name] = self._counters.get(name, 0) + value
+        finally:
+            self._lock.release()
+
+    def gauge(self, name, value):
+        self._lock.acquire()
+        try:
+            self._gauges[name] = value
+        finally:
+            self._lock.release()
+
+    def snapshot(self):
+        self._lock.acquire()
+        try:
+            timers = dict((name, timer.to_dict())
+                          for name, timer in self._timers.items())
+            return {"uptime": time.time() - self.started,
+                    "timers": timers,
+                    "counters": dict(self._counters),
+                    "gauges": dict(self._gauges)}
+        finally:
+            self._lock.release()
+
+    def summary(self):
+        """Return the snapshot as a single line of text."""
+        snapshot = self.snapshot()
+        fields = []
+        for name, timer in sorted(snapshot["timers"].items()):
+            fields.append("%s=%d avg=%.1fms max=%.1fms"
+                          % (name, timer["count"], timer["avg"] * 1000,
+                             timer["max"] * 1000))
+        for name, value in sorted(snapshot["counters"].items()):
+            fields.append("%s=%s" % (name, value))
+        for name, value in sorted(snapshot["gauges"].items()):
+            fields.append("%s=%s" % (name, value))
+        return ", ".join(fields)
+
+
+_registry = Registry()
+
+
+def get_registry():
+    return _registry
+
+
+def observe(name, seconds):
+    _registry.observe(name, seconds)
+
+
+def incr(name, value=1):
+    _registry.incr(name, value)
+
+
+def gauge(name, value):
+    _registry.gauge(name, value)
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Time the body of a with statement."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        _registry.observe(name, time.time() - start)
+
+
+class LatencyTracker(object):
+    """Measures the time between two events concerning the same key.
+
+    start() only records the first time a key is seen, until stop() or
+    discard() is called for it.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._started = {}
+
+    def start(self, key):
+        if key not in self._started:
+            self._started[key] = time.time()
+
+    def stop(self, key):
+        started = self._started.pop(key, None)
+        if started is not None:
+            observe(self.name, time.time() - started)
+
+    def discard(self, key):
+        self._started.pop(key, None)
+
+    def retain(self, keys):
+        """Forget the keys which are not in keys, e.g. deleted ports."""
+        for key in self._started.keys():
+            if key not in keys:
+                del self._started[key]
+
+
+class SummaryLogger(object):
+    """Logs the registry summary every interval seconds at most."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._next = time.time() + interval
+
+    def tick(self):
+        if not self.interval or time.time() < self._next:
+            return
+        self._next = time.time() + self.interval
+        LOG.info("Agent stats: %s" % _registry.summary())
+
+
+class StatsServer(object):
+    """Writes a JSON snapshot of the registry to every client of a socket.
+
+    e.g. "socat - UNIX-CONNECT:/var/run/quantum/ovs-agent-stats.sock".
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(socket_path)
+        self._sock.listen(4)
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.error:
+                if self._closed:
+                    return
+                continue
+            try:
+                conn.sendall(json.dumps(_registry.snapshot()) + "\n")
+            except socket.error, e:
+                LOG.debug("Unable to send stats: %s" % e)
+            conn.close()
+
+    def close(self):
+        self._closed = True
+        self._sock.shutdown(socket.SHUT_RDWR)
+        self._sock.close()
+
+
+_summary = SummaryLogger(0)
+
+
+def configure(stats_socket=None, stats_interval=DEFAULT_STATS_INTERVAL):
+    """Set up the reporting of an agent's metrics.
+
+    :param stats_socket: path of the Unix socket to serve them on, if any.
+    :param stats_interval: seconds between summary log lines, 0 for none.
+    """
+    global _summary
+    if stats_interval:
+        # agents only log warnings unless verbose
+        LOG.setLevel(logging.INFO)
+    if stats_socket:
+        try:
+            StatsServer(stats_socket)
+        except socket.error, e:
+            LOG.error("Unable to serve stats on %s: %s" % (stats_socket, e))
+    _summary = SummaryLogger(stats_interval)
+
+
+def iteration_done(started):
+    """Record a pass of a daemon loop which began at time started."""
+    observe("iteration", time.time() - started)
+    _summary.tick()
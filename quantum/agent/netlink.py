@@ -0,0 +1,213 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Helpers for agents watching the network devices of the host."""
+
+import errno
+import logging
+import socket
+import struct
+import threading
+import time
+
+from quantum.agent import notifier
+
+
+LOG = logging.getLogger(__name__)
+
+# Events dispatched by a LinkMonitor
+LINK_ADD = "link.add"
+LINK_DELETE = "link.delete"
+
+# From linux/netlink.h and linux/rtnetlink.h
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 1
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+NLM_F_REQUEST = 1
+NLM_F_DUMP = 0x300
+IFLA_IFNAME = 3
+
+# struct nlmsghdr, struct ifinfomsg and struct rtattr
+NLMSGHDR = struct.Struct("=IHHII")
+IFINFOMSG = struct.Struct("=BxHiII")
+RTATTR = struct.Struct("=HH")
+
+RECV_BUFFER = 65536
+# Events are lost once the socket buffer is full
+SOCKET_BUFFER = 1024 * 1024
+
+
+def _align(length):
+    return (length + 3) & ~3
+
+
+def parse_link_messages(data):
+    """Parse the rtnetlink messages received in one datagram.
+
+    :returns: a list of (message type, address family, interface index,
+        interface name) tuples, with None as family, interface index and
+        name for the messages which are not about a link.
+    """
+    messages = []
+    offset = 0
+    while offset + NLMSGHDR.size <= len(data):
+        length, msg_type, flags, seq, pid = NLMSGHDR.unpack_from(data, offset)
+        if length < NLMSGHDR.size:
+            break
+        family = index = name = None
+        if msg_type in (RTM_NEWLINK, RTM_DELLINK):
+            start = offset + NLMSGHDR.size
+            family, if_type, index, if_flags, change = \
+                IFINFOMSG.unpack_from(data, start)
+            attr = start + IFINFOMSG.size
+            while attr + RTATTR.size <= offset + length:
+                attr_len, attr_type = RTATTR.unpack_from(data, attr)
+                if attr_len < RTATTR.size:
+                    break
+                if attr_type == IFLA_IFNAME:
+                    value = data[attr + RTATTR.size:attr + attr_len]
+                    name = value.split("\0", 1)[0]
+                attr += _align(attr_len)
+        messages.append((msg_type, family, index, name))
+        offset += _align(length)
+    return messages
+
+
+class LinkMonitor(object):
+    """Reports the network devices created and deleted on the host.
+
+    Listens to the rtnetlink link events of the kernel in a background
+    thread, so agents learn about a new tap device as soon as it exists
+    instead of on their next polling cycle. on_event is called from the
+    monitor thread with {"event": LINK_ADD or LINK_DELETE, "device": name}
+    events, and with a notifier.RESYNC event every time the monitor
+    (re)starts since changes may have been missed in the meantime. If the
+    socket fails, the monitor is marked inactive and restarted after
+    respawn_interval seconds.
+    """
+
+    def __init__(self, on_event=None, respawn_interval=5):
+        self.on_event = on_event
+        self.respawn_interval = respawn_interval
+        self.active = False
+        # interface index -> name
+        self._links = {}
+        self._sock = None
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        if not hasattr(socket, "AF_NETLINK"):
+            LOG.warn("Netlink is not available, not monitoring links")
+            return
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        sock = self._sock
+        if sock:
+            sock.close()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self._sock = self._connect()
+                self._links = {}
+                self._dump_links()
+                self.active = True
+                self._notify({"event": notifier.RESYNC})
+                self._read_events()
+            except (socket.error, OSError), e:
+                if e.args and e.args[0] == errno.ENOBUFS:
+                    LOG.warn("Link events were lost, monitoring again")
+                elif not self._stopped:
+                    LOG.error("Unable to monitor links: %s" % e)
+            if self._sock:
+                self._sock.close()
+                self._sock = None
+            if self.active:
+                self.active = False
+                self._notify({"event": notifier.RESYNC})
+            if not self._stopped:
+                time.sleep(self.respawn_interval)
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             NETLINK_ROUTE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+        sock.bind((0, RTMGRP_LINK))
+        return sock
+
+    def _dump_links(self):
+        """Learn the existing links, without reporting them."""
+        request = IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0)
+        self._sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(request),
+                                      RTM_GETLINK,
+                                      NLM_F_REQUEST | NLM_F_DUMP, 1, 0) +
+                        request)
+        while True:
+            messages = parse_link_messages(self._sock.recv(RECV_BUFFER))
+            for msg_type, family, index, name in messages:
+                if msg_type == NLMSG_ERROR:
+                    raise socket.error("Link dump failed")
+                if msg_type == NLMSG_DONE:
+                    return
+                self.apply_message(msg_type, family, index, name, False)
+
+    def _read_events(self):
+        while not self._stopped:
+            data = self._sock.recv(RECV_BUFFER)
+            if not data:
+                return
+            for msg_type, family, index, name in parse_link_messages(data):
+                self.apply_message(msg_type, family, index, name)
+
+    def apply_message(self, msg_type, family, index, name, notify=True):
+        """Apply one message to the known links.
+
+        A RTM_NEWLINK message is sent for every change of a link, it is
+        only reported as a new link the first time its index is seen.
+        Messages of other families than AF_UNSPEC are ignored: the bridge
+        sends AF_BRIDGE RTM_NEWLINK and RTM_DELLINK messages when a port
+        is added to or removed from it, while the link itself remains.
+        """
+        if family != socket.AF_UNSPEC:
+            return
+        old_name = self._links.get(index)
+        if msg_type == RTM_NEWLINK and name:
+            if old_name == name:
+                return
+            self._links[index] = name
+            if notify and old_name:
+                self._notify({"event": LINK_DELETE, "device": old_name})
+            if notify:
+                self._notify({"event": LINK_ADD, "device": name})
+        elif msg_type == RTM_DELLINK and index in self._links:
+            del self._links[index]
+            if notify:
+                self._notify({"event": LINK_DELETE,
+                              "device": name or old_name})
+
+    def _notify(self, event):
+        if self.on_event:
+            self.on_event(event)
@@ -0,0 +1,292 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Push notification channel between quantum plugins and their agents.
+
+The plugin side runs a NotificationPublisher inside quantum-server which
+accepts plain TCP connections from agents and writes one JSON document per
+line for every network, port and attachment change. Agents run a
+NotificationSubscriber which keeps a connection open in a background thread
+and wakes the agent's daemon loop as soon as an event arrives. No message
+broker is involved; agents keep polling at their usual interval whenever
+the channel is unavailable.
+"""
+
+import json
+import logging
+import socket
+import threading
+import time
+
+import eventlet
+from eventlet import queue
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_PORT = 9697
+
+# Event types
+NETWORK_CREATE = "network.create"
+NETWORK_DELETE = "network.delete"
+PORT_CREATE = "port.create"
+PORT_UPDATE = "port.update"
+PORT_DELETE = "port.delete"
+PORT_PLUG = "port.plug"
+PORT_UNPLUG = "port.unplug"
+# Generated locally by a subscriber every time it (re)connects, since any
+# event published while it was disconnected has been lost.
+RESYNC = "resync"
+
+# Seconds a publisher waits on a subscriber before dropping it.
+SEND_TIMEOUT = 2
+
+
+def event_targets(events, local_events=()):
+    """Return what a batch of events asks an agent to reconcile.
+
+    Ports are only created without an attachment and deleted once
+    unplugged, and networks are only deleted once their ports are, so
+    these events need no local change.
+
+    :param local_events: the kinds of events the agent dispatches itself,
+        e.g. from an interface monitor, which are skipped here.
+    :returns: an (interface ids, network ids) tuple with the attachments
+        plugged, unplugged or updated and the networks created, or None if
+        the events call for a full sync: when there are none, i.e. the
+        agent was woken up to poll, or when one of them is a RESYNC.
+    """
+    if not events:
+        return None
+    interface_ids = set()
+    network_ids = set()
+    for event in events:
+        kind = event.get("event")
+        if kind in (PORT_PLUG, PORT_UNPLUG, PORT_UPDATE):
+            if event.get("interface_id"):
+                interface_ids.add(event["interface_id"])
+        elif kind == NETWORK_CREATE:
+            network_ids.add(event["network_id"])
+        elif kind not in (PORT_CREATE, PORT_DELETE, NETWORK_DELETE) and \
+                kind not in local_events:
+            return None
+    return interface_ids, network_ids
+
+
+def parse_address(address):
+    """Split a "host:port" string into a (host, port) tuple."""
+    host, sep, port = address.strip().rpartition(":")
+    if not sep:
+        return (port, DEFAULT_PORT)
+    return (host, int(port))
+
+
+class NullPublisher(object):
+    """Publisher used when no notification address is configured."""
+
+    def publish(self, event, **payload):
+        pass
+
+    def close(self):
+        pass
+
+
+class NotificationPublisher(object):
+    """Fans events out to every connected agent.
+
+    Runs in green threads, so it must live in an eventlet based process
+    such as quantum-server. publish() never blocks the caller: messages
+    are queued and written by a dedicated sender thread, and subscribers
+    which stop reading are disconnected.
+    """
+
+    def __init__(self, address):
+        self._listener = eventlet.listen(parse_address(address))
+        self.address = self._listener.getsockname()
+        self._subscribers = set()
+        self._queue = queue.LightQueue()
+        self._closed = False
+        self._accept_thread = eventlet.spawn(self._accept_loop)
+        self._send_thread = eventlet.spawn(self._send_loop)
+        LOG.info("Publishing agent notifications on %s:%s" % self.address)
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn, peer = self._listener.accept()
+            except (socket.error, IOError), e:
+                if not self._closed:
+                    LOG.error("Notification listener failed: %s" % e)
+                return
+            LOG.debug("Agent %s:%s subscribed to notifications" % peer[:2])
+            conn.settimeout(SEND_TIMEOUT)
+            self._subscribers.add(conn)
+
+    def _send_loop(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                return
+            for conn in list(self._subscribers):
+                try:
+                    conn.sendall(msg)
+                except (socket.error, socket.timeout), e:
+                    LOG.debug("Dropping notification subscriber: %s" % e)
+                    self._subscribers.discard(conn)
+                    conn.close()
+
+    def publish(self, event, **payload):
+        """Queue an event for delivery to all subscribers."""
+        payload["event"] = event
+        payload["timestamp"] = time.time()
+        self._queue.put(json.dumps(payload) + "\n")
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._listener.close()
+        for conn in self._subscribers:
+            conn.close()
+        self._subscribers.clear()
+
+
+_PUBLISHERS = {}
+
+
+def get_publisher(address):
+    """Return the publisher bound to address, creating it on first use.
+
+    Several plugin instances may be created in a single process, but only
+    one of them can listen on a given address.
+
+    :param address: "host:port" to listen on. If empty, notifications are
+        disabled and a NullPublisher is returned.
+    """
+    if not address:
+        return NullPublisher()
+    if address not in _PUBLISHERS:
+        _PUBLISHERS[address] = NotificationPublisher(address)
+    return _PUBLISHERS[address]
+
+
+class NullSubscriber(object):
+    """Subscriber used when no notification address is configured.
+
+    It only receives the events dispatched from within the agent itself,
+    so wait() normally just sleeps, which gives agents their plain polling
+    behaviour.
+    """
+
+    connected = False
+
+    def __init__(self):
+        self._events = []
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+
+    def dispatch(self, event):
+        """Queue an event and wake up any pending wait()."""
+        self._lock.acquire()
+        try:
+            self._events.append(event)
+            self._changed.set()
+        finally:
+            self._lock.release()
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for events.
+
+        :returns: the list of events received since the previous call, which
+            is empty if the timeout expired first.
+        """
+        self._changed.wait(timeout)
+        self._lock.acquire()
+        try:
+            events = self._events
+            self._events = []
+            self._changed.clear()
+        finally:
+            self._lock.release()
+        return events
+
+    def close(self):
+        pass
+
+
+class NotificationSubscriber(NullSubscriber):
+    """Receives plugin events on behalf of an agent.
+
+    A daemon thread keeps a connection to the publisher open, reconnecting
+    every retry_interval seconds on failure. Agents call wait() in place of
+    sleeping between iterations of their daemon loop.
+    """
+
+    def __init__(self, address, retry_interval=5):
+        super(NotificationSubscriber, self).__init__()
+        self.address = parse_address(address)
+        self.retry_interval = retry_interval
+        self.connected = False
+        self._stopped = False
+        self._sock = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self._sock = socket.create_connection(self.address)
+                self.connected = True
+                LOG.info("Subscribed to notifications from %s:%s" %
+                         self.address)
+                self.dispatch({"event": RESYNC})
+                self._read_events(self._sock.makefile("r"))
+            except (socket.error, IOError), e:
+                LOG.debug("Notification channel to %s:%s unavailable: %s"
+                          % (self.address + (e,)))
+            if self._sock:
+                self._sock.close()
+                self._sock = None
+            if self.connected:
+                self.connected = False
+                LOG.warn("Lost notification channel, falling back to "
+                         "polling")
+            if not self._stopped:
+                time.sleep(self.retry_interval)
+
+    def _read_events(self, stream):
+        for line in iter(stream.readline, ""):
+            try:
+                self.dispatch(json.loads(line))
+            except ValueError:
+                LOG.warn("Ignoring malformed notification: %r" % line)
+
+    def close(self):
+        self._stopped = True
+        sock = self._sock
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+def get_subscriber(address, retry_interval=5):
+    """Return a subscriber for address, or a NullSubscriber if it is empty."""
+    if not address:
+        return NullSubscriber()
+    return NotificationSubscriber(address, retry_interval)
@@ -0,0 +1,225 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Helpers for agents reading the local Open vSwitch database."""
+
+import json
+import logging
+import shlex
+import subprocess
+import threading
+import time
+
+
+LOG = logging.getLogger(__name__)
+
+INTERFACE_COLUMNS = ["name", "ofport", "external_ids"]
+
+# Seconds between two iterations of an agent daemon loop when changes may
+# not all be reported through events.
+REFRESH_INTERVAL = 2
+
+# Kind of the events agents dispatch to their subscriber on every change
+# seen by an InterfaceMonitor.
+INTERFACE_EVENT = "ovsdb"
+
+
+def json_to_python(value):
+    """Convert a value from ovs-vsctl or ovsdb-client --format=json output.
+
+    OVSDB encodes maps as ["map", [[key, value], ...]], sets with other
+    than exactly one element as ["set", [...]] and UUIDs as
+    ["uuid", "..."]. Maps become dicts, sets become lists and atoms are
+    returned as is.
+    """
+    if isinstance(value, list) and len(value) == 2:
+        kind, data = value
+        if kind == "map":
+            return dict((json_to_python(k), json_to_python(v))
+                        for k, v in data)
+        if kind == "set":
+            return [json_to_python(v) for v in data]
+        if kind in ("uuid", "named-uuid"):
+            return data
+    return value
+
+
+def db_list(run_vsctl, table, columns, record=None):
+    """Fetch columns of table in a single ovs-vsctl call.
+
+    run_vsctl is called with the ovs-vsctl arguments and returns its
+    output. Returns a list with a dict of column -> value per record,
+    decoded by json_to_python. If record is given, only that record is
+    listed.
+    """
+    args = ["--format=json", "--columns=%s" % ",".join(columns),
+            "list", table]
+    if record:
+        args.append(record)
+    res = run_vsctl(args)
+    if not res:
+        return []
+    try:
+        data = json.loads(res)
+    except ValueError:
+        LOG.error("Unable to parse ovs-vsctl output: %s" % res)
+        return []
+    headings = data["headings"]
+    return [dict(zip(headings, [json_to_python(v) for v in row]))
+            for row in data["data"]]
+
+
+def db_get_map(run_vsctl, table, record, column):
+    """Return a map column of a record as a dict."""
+    rows = db_list(run_vsctl, table, [column], record)
+    if not rows:
+        return {}
+    return rows[0][column] or {}
+
+
+def scan_vif_ports(bridge, monitor, full_resync):
+    """Return the VIF ports of bridge, from the monitor replica if active."""
+    if monitor and monitor.active and not full_resync:
+        return bridge.get_vif_ports(monitor.get_interfaces())
+    return bridge.get_vif_ports()
+
+
+def wait_for_changes(subscriber, monitor, resync_deadline):
+    """Block until the next iteration of an agent daemon loop is due.
+
+    As long as both the InterfaceMonitor and the plugin notification
+    channel are up, every change is reported through the subscriber, so
+    the loop only needs to run when an event arrives or when
+    resync_deadline is reached. Otherwise this returns after
+    REFRESH_INTERVAL at most.
+
+    :returns: the events received, if any.
+    """
+    while True:
+        events = subscriber.wait(REFRESH_INTERVAL)
+        if events:
+            return events
+        if not (monitor and monitor.active and subscriber.connected):
+            return events
+        if time.time() >= resync_deadline:
+            return events
+
+
+class InterfaceMonitor(object):
+    """In-memory replica of the Interface table.
+
+    Runs "ovsdb-client monitor" in a background thread and applies the
+    insert, delete and modify events it reports, so agents can look at
+    local interfaces without spawning ovs-vsctl. on_change is called from
+    the monitor thread every time the replica changes. If ovsdb-client
+    exits, the replica is marked inactive and the monitor is restarted
+    after respawn_interval seconds.
+    """
+
+    def __init__(self, root_helper, on_change=None, respawn_interval=5):
+        self.root_helper = root_helper
+        self.on_change = on_change
+        self.respawn_interval = respawn_interval
+        self.active = False
+        self._interfaces = {}
+        self._lock = threading.Lock()
+        self._process = None
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        process = self._process
+        if process:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def get_interfaces(self):
+        """Return a list of dicts with the monitored interface columns."""
+        self._lock.acquire()
+        try:
+            return self._interfaces.values()
+        finally:
+            self._lock.release()
+
+    def _command(self):
+        return (shlex.split(self.root_helper) +
+                ["ovsdb-client", "--format=json", "monitor", "Interface",
+                 ",".join(INTERFACE_COLUMNS)])
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                self._process = subprocess.Popen(self._command(),
+                                                 stdout=subprocess.PIPE)
+                self._read_updates(self._process.stdout)
+                self._process.wait()
+            except OSError, e:
+                LOG.error("Unable to run ovsdb-client: %s" % e)
+            self._process = None
+            if self.active:
+                self.active = False
+                LOG.warn("ovsdb-client monitor exited, falling back to "
+                         "polling")
+                self._notify()
+            if not self._stopped:
+                time.sleep(self.respawn_interval)
+
+    def _read_updates(self, stream):
+        for line in iter(stream.readline, ""):
+            try:
+                update = json.loads(line)
+            except ValueError:
+                LOG.warn("Ignoring unexpected ovsdb-client output: %r" % line)
+                continue
+            self.apply_update(update)
+
+    def apply_update(self, update):
+        """Apply one table update printed by ovsdb-client monitor.
+
+        Each row carries the row uuid and an action: "initial" and "insert"
+        rows hold the full record, "delete" rows the deleted one, and a
+        modification is reported as an "old" row with the changed columns
+        followed by a "new" row with the full record.
+        """
+        headings = update["headings"]
+        self._lock.acquire()
+        try:
+            for row in update["data"]:
+                record = dict(zip(headings,
+                                  [json_to_python(v) for v in row]))
+                uuid = record.pop("row")
+                action = record.pop("action")
+                if action == "delete":
+                    self._interfaces.pop(uuid, None)
+                elif action in ("initial", "insert", "new"):
+                    self._interfaces[uuid] = record
+            self.active = True
+        finally:
+            self._lock.release()
+        self._notify()
+
+    def _notify(self):
+        if self.on_change:
+            self.on_change()
@@ -0,0 +1,224 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Running commands as root from the agents.
+
+By default every command is run through the configured root_helper, e.g.
+"sudo quantum-rootwrap". Once configure_daemon() has been called, commands
+are sent instead to a "quantum-rootwrap --daemon" process started once
+through the root_helper, over a small pool of Unix socket connections.
+Commands go back to the root_helper for a while whenever the daemon
+cannot be reached.
+"""
+
+import errno
+import logging
+import shlex
+import socket
+import subprocess
+import threading
+import time
+
+from quantum.agent import metrics
+from quantum.rootwrap import daemon
+
+
+LOG = logging.getLogger(__name__)
+
+# Seconds to wait for a newly started daemon to create its socket.
+START_TIMEOUT = 10
+# Seconds to run commands through the root_helper after the daemon could
+# not be reached.
+RETRY_INTERVAL = 60
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonClient(object):
+    """Sends commands to a rootwrap daemon, starting it when needed.
+
+    Up to pool_size idle connections are kept open and shared by all the
+    threads of the agent.
+    """
+
+    def __init__(self, socket_path, start_command, pool_size=4):
+        self.socket_path = socket_path
+        self.start_command = start_command
+        self.pool_size = pool_size
+        self._pool = []
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error:
+            sock.close()
+            raise
+        return sock, sock.makefile("rb")
+
+    def _start_daemon(self):
+        self._start_lock.acquire()
+        try:
+            # another thread may have started it in the meantime
+            try:
+                return self._connect()
+            except socket.error:
+                pass
+            LOG.info("Starting rootwrap daemon: %s"
+                     % " ".join(self.start_command))
+            try:
+                process = subprocess.Popen(self.start_command, close_fds=True)
+            except OSError, e:
+                raise DaemonError("Unable to start rootwrap daemon: %s" % e)
+            deadline = time.time() + START_TIMEOUT
+            while time.time() < deadline:
+                try:
+                    return self._connect()
+                except socket.error:
+                    if process.poll() is not None:
+                        raise DaemonError("rootwrap daemon exited with %s"
+                                          % process.returncode)
+                    time.sleep(0.05)
+            raise DaemonError("Timed out waiting for rootwrap daemon on %s"
+                              % self.socket_path)
+        finally:
+            self._start_lock.release()
+
+    def _get_connection(self):
+        """Return a (pooled, connection) tuple."""
+        self._lock.acquire()
+        try:
+            if self._pool:
+                return True, self._pool.pop()
+        finally:
+            self._lock.release()
+        try:
+            return False, self._connect()
+        except socket.error, e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise DaemonError("Unable to reach rootwrap daemon: %s" % e)
+        return False, self._start_daemon()
+
+    def _put_connection(self, conn):
+        self._lock.acquire()
+        try:
+            if len(self._pool) < self.pool_size:
+                self._pool.append(conn)
+                return
+        finally:
+            self._lock.release()
+        self._close(conn)
+
+    def _close(self, conn):
+        sock, stream = conn
+        stream.close()
+        sock.close()
+
+    def execute(self, args, process_input=None):
+        """Run a command through the daemon.
+
+        :returns: a (returncode, stdout, stderr) tuple.
+        :raises: DaemonError if the daemon could not run the command.
+        """
+        payloads = ()
+        if process_input is not None:
+            payloads = (process_input,)
+        while True:
+            pooled, conn = self._get_connection()
+            try:
+                daemon.send_message(conn[0], {"args": args}, payloads)
+            except socket.error, e:
+                self._close(conn)
+                # pooled connections go stale when the daemon restarts
+                if pooled:
+                    continue
+                raise DaemonError("Unable to send command: %s" % e)
+            try:
+                header, payloads = daemon.recv_message(conn[1])
+            except (socket.error, ValueError), e:
+                self._close(conn)
+                raise DaemonError("Unable to read command result: %s" % e)
+            if header is None:
+                self._close(conn)
+                raise DaemonError("rootwrap daemon closed the connection")
+            self._put_connection(conn)
+            return header["returncode"], payloads[0], payloads[1]
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            pool = self._pool
+            self._pool = []
+        finally:
+            self._lock.release()
+        for conn in pool:
+            self._close(conn)
+
+
+_daemon = None
+_retry_time = 0
+
+
+def configure_daemon(root_helper, use_daemon, pool_size=4,
+                     socket_path=daemon.SOCKET_PATH):
+    """Send the commands of execute() to a rootwrap daemon.
+
+    :param root_helper: the agent's root_helper, which must run
+        quantum-rootwrap.
+    :param use_daemon: if false, commands are run through the root_helper.
+    """
+    global _daemon, _retry_time
+    if _daemon:
+        _daemon.close()
+    _daemon = None
+    _retry_time = 0
+    if use_daemon:
+        start_command = shlex.split(root_helper) + ["--daemon"]
+        _daemon = DaemonClient(socket_path, start_command, pool_size)
+
+
+def execute(root_helper, args, process_input=None):
+    """Run a command as root.
+
+    :returns: a (returncode, stdout, stderr) tuple.
+    """
+    start = time.time()
+    result = _execute(root_helper, args, process_input)
+    metrics.observe("command", time.time() - start)
+    if result[0]:
+        metrics.incr("command_errors")
+    return result
+
+
+def _execute(root_helper, args, process_input):
+    global _retry_time
+    if _daemon and time.time() >= _retry_time:
+        try:
+            return _daemon.execute(args, process_input)
+        except DaemonError, e:
+            LOG.warn("%s, running commands through %s for %s seconds"
+                     % (e, root_helper, RETRY_INTERVAL))
+            _retry_time = time.time() + RETRY_INTERVAL
+    cmd = shlex.split(root_helper) + args
+    p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    stdout, stderr = p.communicate(process_input)
+    return p.returncode, stdout, stderr
@@ -0,0 +1,160 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Writing the op_status of ports back to the quantum database.
+
+Agents tell a StatusReporter the status of every port they handle, as
+often as they like. Only the statuses which differ from the last ones
+reported, or from the ones read from the database, are written, with a
+single parameterized "UPDATE ports SET op_status = ... WHERE uuid IN
+(...)" per status value. The database load of the agents is thus
+proportional to the actual changes.
+"""
+
+import logging
+import time
+
+from sqlalchemy import sql
+
+from quantum.agent import metrics
+
+
+LOG = logging.getLogger(__name__)
+
+# Most ports updated by a single statement, below the 999 bound parameters
+# SQLite allows.
+MAX_PORTS_PER_STATEMENT = 500
+# MySQL lock wait timeout and deadlock errors.
+DEADLOCK_ERRORS = (1205, 1213)
+# Attempts of a transaction which ran into a deadlock.
+DEADLOCK_RETRIES = 3
+# Seconds to wait before the first retry, doubled for each one.
+RETRY_DELAY = 0.1
+
+
+def is_deadlock(error):
+    """Whether a database error is a deadlock worth retrying after.
+
+    error may be raised by SQLAlchemy or directly by a DB-API driver.
+    """
+    # SQLAlchemy wraps the driver's exception
+    error = getattr(error, "orig", error)
+    args = getattr(error, "args", ())
+    if args and args[0] in DEADLOCK_ERRORS:
+        return True
+    message = str(error).lower()
+    return "deadlock" in message or "database is locked" in message
+
+
+class StatusReporter(object):
+    """Writes the op_status of ports through a SqlSoup or an AgentDB.
+
+    Ports are identified by their uuid in the ports table.
+    """
+
+    def __init__(self):
+        # port uuid -> op_status last written or read from the database
+        self._reported = {}
+        # port uuid -> op_status to write
+        self._pending = {}
+
+    def update(self, port_id, status, current=None):
+        """Set the status of a port.
+
+        :param current: the op_status of the port read from the database,
+            if known.
+        """
+        if current is not None:
+            self._reported[port_id] = current
+        if self._reported.get(port_id) == status:
+            self._pending.pop(port_id, None)
+        else:
+            self._pending[port_id] = status
+
+    def retain(self, port_ids):
+        """Forget the ports which are not in port_ids, e.g. deleted ones."""
+        for port_id in self._reported.keys():
+            if port_id not in port_ids:
+                del self._reported[port_id]
+        for port_id in self._pending.keys():
+            if port_id not in port_ids:
+                del self._pending[port_id]
+
+    def statements(self):
+        """Return the (statement, params) tuples writing the changes."""
+        by_status = {}
+        for port_id, status in self._pending.items():
+            by_status.setdefault(status, []).append(port_id)
+        statements = []
+        for status in sorted(by_status):
+            # a consistent order makes deadlocks between agents less likely
+            port_ids = sorted(by_status[status])
+            for i in range(0, len(port_ids), MAX_PORTS_PER_STATEMENT):
+                statements.append(self._statement(
+                    status, port_ids[i:i + MAX_PORTS_PER_STATEMENT]))
+        return statements
+
+    def _statement(self, status, port_ids):
+        markers = [":p%d" % i for i in range(len(port_ids))]
+        params = dict(("p%d" % i, port_id)
+                      for i, port_id in enumerate(port_ids))
+        params["status"] = status
+        statement = ("UPDATE ports SET op_status = :status WHERE uuid IN (%s)"
+                     % ", ".join(markers))
+        return statement, params
+
+    def flush(self, db):
+        """Write the pending changes and commit the transaction.
+
+        The transaction is committed even if there is nothing to write, so
+        that the agent's next reads see the latest data. A transaction
+        which ran into a deadlock is retried; if it still fails, the
+        changes are kept for the next flush.
+
+        :returns: a dict of port uuid -> op_status written.
+        """
+        statements = self.statements()
+        delay = RETRY_DELAY
+        for attempt in range(DEADLOCK_RETRIES):
+            try:
+                start = time.time()
+                for statement, params in statements:
+                    self.execute(db, statement, params)
+                db.commit()
+                metrics.observe("db", time.time() - start)
+                break
+            except Exception, e:
+                db.rollback()
+                if is_deadlock(e) and attempt + 1 < DEADLOCK_RETRIES:
+                    LOG.info("Deadlock writing port status, retrying: %s"
+                             % e)
+                    time.sleep(delay)
+                    delay *= 2
+                    continue
+                LOG.error("Unable to write port status: %s" % e)
+                return {}
+        written = self._pending
+        self._pending = {}
+        self._reported.update(written)
+        if written:
+            LOG.debug("Wrote the status of %d ports in %d statements"
+                      % (len(written), len(statements)))
+        return written
+
+    def execute(self, db, statement, params):
+        # SqlSoup.execute() does not pass the parameters to the statement
+        db.session.execute(sql.text(statement, bind=db.bind), params)
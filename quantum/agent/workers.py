@@ -0,0 +1,149 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Bounded concurrency for independent agent actions.
+
+Agents submit the actions of an iteration of their daemon loop, such as
+plugging each port, to a WorkerPool and then wait for all of them. Actions
+with the same key, e.g. the same port, run one after the other in the
+order they were submitted, while actions with different keys run on up to
+size threads at once.
+"""
+
+import logging
+import Queue
+import threading
+import traceback
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Task(object):
+    """An action submitted to a WorkerPool, and its outcome."""
+
+    def __init__(self, key, func, args, kwargs):
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+        except Exception, e:
+            self.error = e
+            LOG.debug("Action for %s failed: %s"
+                      % (self.key, traceback.format_exc()))
+
+
+class WorkerPool(object):
+    """Runs actions on a bounded number of threads.
+
+    With a size of 1, actions simply run in the caller's thread as they are
+    submitted. submit() and wait() are meant to be called from a single
+    thread, typically the agent's daemon loop.
+    """
+
+    def __init__(self, size=1):
+        self.size = max(1, int(size))
+        self._queues = []
+        self._submitted = []
+        self._outstanding = 0
+        self._done = threading.Condition()
+
+    def _start(self):
+        for i in range(self.size):
+            queue = Queue.Queue()
+            thread = threading.Thread(target=self._work, args=(queue,))
+            thread.setDaemon(True)
+            thread.start()
+            self._queues.append(queue)
+
+    def _work(self, queue):
+        while True:
+            task = queue.get()
+            task.run()
+            self._done.acquire()
+            try:
+                self._outstanding -= 1
+                if not self._outstanding:
+                    self._done.notifyAll()
+            finally:
+                self._done.release()
+
+    def submit(self, key, func, *args, **kwargs):
+        """Schedule func(*args, **kwargs).
+
+        :param key: actions with equal keys run in submission order.
+        :returns: the Task, whose result or error is set once wait()
+            returned.
+        """
+        task = Task(key, func, args, kwargs)
+        self._submitted.append(task)
+        if self.size == 1:
+            task.run()
+            return task
+        if not self._queues:
+            self._start()
+        self._done.acquire()
+        try:
+            self._outstanding += 1
+        finally:
+            self._done.release()
+        self._queues[hash(key) % self.size].put(task)
+        return task
+
+    def wait(self):
+        """Wait for every action submitted since the previous wait().
+
+        Failures are logged together, and the caller finds each one in
+        the error of its task.
+
+        :returns: the list of tasks, in submission order.
+        """
+        self._done.acquire()
+        try:
+            while self._outstanding:
+                self._done.wait()
+        finally:
+            self._done.release()
+        tasks = self._submitted
+        self._submitted = []
+        failed = [task for task in tasks if task.error]
+        if failed:
+            LOG.error("%d of %d actions failed: %s"
+                      % (len(failed), len(tasks),
+                         "; ".join("%s: %s" % (task.key, task.error)
+                                   for task in failed)))
+        return tasks
+
+
+_pool = WorkerPool()
+
+
+def configure(size):
+    """Set the number of threads of the pool returned by get_pool()."""
+    global _pool
+    _pool = WorkerPool(size)
+
+
+def get_pool():
+    """Return the agent's shared WorkerPool."""
+    return _pool
@@ -73,7 +73,7 @@ class Port(BASE, QuantumBase):
                         nullable=False)
     interface_id = Column(String(255), nullable=True)
     # Port state - Hardcoding string value at the moment
-    state = Column(String(8))
+    state = Column(String(8), index=True)
     op_status = Column(String(16))
 
     def __init__(self, network_id,
@@ -19,6 +19,7 @@
 
 import logging
 
+from quantum.agent import notifier
 from quantum.api.api_common import OperationalStatus
 from quantum.common import exceptions as exc
 from quantum.db import api as db
@@ -42,6 +43,7 @@ class LinuxBridgePlugin(QuantumPluginBase):
 
     def __init__(self, configfile=None):
         cdb.initialize()
+        self.notifier = notifier.get_publisher(conf.NOTIFICATION_ADDRESS)
         LOG.debug("Linux Bridge Plugin initialization done successfully")
 
     def _get_vlan_for_tenant(self, tenant_id, **kwargs):
@@ -111,6 +113,8 @@ class LinuxBridgePlugin(QuantumPluginBase):
         new_net_id = new_network[const.UUID]
         vlan_id = self._get_vlan_for_tenant(tenant_id)
         cdb.add_vlan_binding(vlan_id, new_net_id)
+        self.notifier.publish(notifier.NETWORK_CREATE, network_id=new_net_id,
+                              vlan_id=vlan_id)
         new_net_dict = {const.NET_ID: new_net_id,
                         const.NET_NAME: net_name,
                         const.NET_PORTS: [],
@@ -145,6 +149,7 @@ class LinuxBridgePlugin(QuantumPluginBase):
                 db.network_update(net_id, tenant_id, {const.OPSTATUS:
                                                       OperationalStatus.DOWN})
             db.network_destroy(net_id)
+            self.notifier.publish(notifier.NETWORK_DELETE, network_id=net_id)
             return net_dict
         # Network not found
         raise exc.NetworkNotFound(net_id=net_id)
@@ -199,6 +204,8 @@ class LinuxBridgePlugin(QuantumPluginBase):
         port = db.port_create(net_id, port_state,
                                 op_status=OperationalStatus.DOWN)
         unique_port_id_string = port[const.UUID]
+        self.notifier.publish(notifier.PORT_CREATE, network_id=net_id,
+                              port_id=unique_port_id_string)
         new_port_dict = cutil.make_port_dict(port)
         return new_port_dict
 
@@ -211,6 +218,9 @@ class LinuxBridgePlugin(QuantumPluginBase):
         network = db.network_get(net_id)
         self._validate_port_state(kwargs["state"])
         port = db.port_update(port_id, net_id, **kwargs)
+        self.notifier.publish(notifier.PORT_UPDATE, network_id=net_id,
+                              port_id=port_id,
+                              interface_id=port[const.INTERFACEID])
 
         new_port_dict = cutil.make_port_dict(port)
         return new_port_dict
@@ -229,6 +239,8 @@ class LinuxBridgePlugin(QuantumPluginBase):
         attachment_id = port[const.INTERFACEID]
         if not attachment_id:
             db.port_destroy(port_id, net_id)
+            self.notifier.publish(notifier.PORT_DELETE, network_id=net_id,
+                                  port_id=port_id)
             new_port_dict = cutil.make_port_dict(port)
             return new_port_dict
         else:
@@ -249,6 +261,9 @@ class LinuxBridgePlugin(QuantumPluginBase):
             raise exc.PortInUse(port_id=port_id, net_id=net_id,
                                 att_id=attachment_id)
         db.port_set_attachment(port_id, net_id, remote_interface_id)
+        self.notifier.publish(notifier.PORT_PLUG, network_id=net_id,
+                              port_id=port_id,
+                              interface_id=remote_interface_id)
 
     def unplug_interface(self, tenant_id, net_id, port_id):
         """
@@ -265,3 +280,5 @@ class LinuxBridgePlugin(QuantumPluginBase):
                                     att_id=remote_interface_id)
         db.port_unset_attachment(port_id, net_id)
         db.port_update(port_id, net_id, op_status=OperationalStatus.DOWN)
+        self.notifier.publish(notifier.PORT_UNPLUG, network_id=net_id,
+                              port_id=port_id, interface_id=attachment_id)
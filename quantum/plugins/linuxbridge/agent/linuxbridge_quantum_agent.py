@@ -24,33 +24,188 @@
 #
 
 from optparse import OptionParser
-from subprocess import *
 
 import ConfigParser
 import logging as LOG
-import MySQLdb
 import os
-import shlex
+import re
 import signal
-import sqlite3
 import sys
+import threading
 import time
 
+from sqlalchemy import exc
+
+from quantum.agent import database
+from quantum.agent import metrics
+from quantum.agent import netlink
+from quantum.agent import notifier
+from quantum.agent import rootwrap
+from quantum.agent import status
+from quantum.agent import workers
+
 
 BRIDGE_NAME_PREFIX = "brq"
 GATEWAY_INTERFACE_PREFIX = "gw-"
 TAP_INTERFACE_PREFIX = "tap"
-BRIDGE_FS = "/sys/devices/virtual/net/"
-BRIDGE_NAME_PLACEHOLDER = "bridge_name"
-BRIDGE_INTERFACES_FS = BRIDGE_FS + BRIDGE_NAME_PLACEHOLDER + "/brif/"
-PORT_OPSTATUS_UPDATESQL = "UPDATE ports SET op_status = '%s' WHERE uuid = '%s'"
-DEVICE_NAME_PLACEHOLDER = "device_name"
-BRIDGE_PORT_FS_FOR_DEVICE = BRIDGE_FS + DEVICE_NAME_PLACEHOLDER + "/brport"
+NET_FS = "/sys/class/net/"
 VLAN_BINDINGS = "vlan_bindings"
 PORT_BINDINGS = "port_bindings"
 OP_STATUS_UP = "UP"
 OP_STATUS_DOWN = "DOWN"
-DB_CONNECTION = None
+# Only the columns the agent uses, state is indexed
+ACTIVE_PORTS_QUERY = ("SELECT uuid, network_id, interface_id, op_status "
+                      "FROM ports WHERE state = 'ACTIVE'")
+# Ports plugged and unplugged concurrently
+DEFAULT_COMMAND_WORKERS = 4
+# Locks the bridges are set up under, each one shared by several bridges
+BRIDGE_LOCKS = 32
+# Seconds between two full syncs while both the link monitor and the
+# notification channel are up
+RESYNC_INTERVAL = 60
+# Reported by "ip -force -batch -" after the error of a command
+BATCH_ERROR = re.compile(r"^Command failed -:(\d+)$")
+
+
+class IpBatch:
+    """Commands run by a single "ip -force -batch -".
+
+    Each command belongs to an owner, e.g. the tap device it plugs, which
+    is reported as failed if any of its commands fails, and may have a
+    callback applying its change to the device snapshot once it ran.
+    """
+
+    def __init__(self):
+        # (owner, ip arguments, callback) tuples
+        self.commands = []
+        # devices created and device -> bridge set by the commands, which
+        # the snapshot only reflects once the batch ran
+        self.created = set()
+        self.masters = {}
+
+    def add(self, owner, args, on_success=None):
+        self.commands.append((owner, args, on_success))
+
+
+class DeviceSnapshot:
+    """The network devices of the host, as found in sysfs.
+
+    Reading sysfs is much cheaper than running ip or brctl for every
+    device the agent looks at. The snapshot is then kept up to date with
+    the changes made by the agent, which may come from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = set()
+        # bridge name -> names of the interfaces on the bridge
+        self.bridges = {}
+        # interface name -> bridge it is on
+        self.bridge_of = {}
+        self.tun_devices = set()
+        self.vlans = set()
+        for device in os.listdir(NET_FS):
+            try:
+                self._read_device(device, os.path.join(NET_FS, device))
+            except (IOError, OSError):
+                # the device went away while being read
+                continue
+
+    def _read_device(self, device, path):
+        if not os.path.isdir(path):
+            return
+        brif = os.path.join(path, "brif")
+        if os.path.isdir(brif):
+            interfaces = set(os.listdir(brif))
+            self.bridges[device] = interfaces
+            for interface in interfaces:
+                self.bridge_of[interface] = device
+        elif os.path.exists(os.path.join(path, "tun_flags")):
+            self.tun_devices.add(device)
+        else:
+            uevent = open(os.path.join(path, "uevent"))
+            try:
+                if "DEVTYPE=vlan\n" in uevent.readlines():
+                    self.vlans.add(device)
+            finally:
+                uevent.close()
+        self.devices.add(device)
+
+    def get_bridge(self, device):
+        return self.bridge_of.get(device)
+
+    def get_bridges(self):
+        self.lock.acquire()
+        try:
+            return self.bridges.keys()
+        finally:
+            self.lock.release()
+
+    def get_interfaces(self, bridge):
+        self.lock.acquire()
+        try:
+            if bridge in self.bridges:
+                return list(self.bridges[bridge])
+        finally:
+            self.lock.release()
+
+    def get_attached_devices(self):
+        """Return the names of the interfaces on a bridge."""
+        self.lock.acquire()
+        try:
+            return set(self.bridge_of)
+        finally:
+            self.lock.release()
+
+    def add_device(self, device, vlan=False):
+        self.lock.acquire()
+        try:
+            self.devices.add(device)
+            if vlan:
+                self.vlans.add(device)
+        finally:
+            self.lock.release()
+
+    def add_bridge(self, bridge):
+        self.lock.acquire()
+        try:
+            self.devices.add(bridge)
+            self.bridges.setdefault(bridge, set())
+        finally:
+            self.lock.release()
+
+    def remove_device(self, device):
+        self.lock.acquire()
+        try:
+            self._detach(device)
+            for interface in self.bridges.pop(device, ()):
+                del self.bridge_of[interface]
+            self.devices.discard(device)
+            self.tun_devices.discard(device)
+            self.vlans.discard(device)
+        finally:
+            self.lock.release()
+
+    def attach(self, device, bridge):
+        self.lock.acquire()
+        try:
+            self._detach(device)
+            self.bridges.setdefault(bridge, set()).add(device)
+            self.bridge_of[device] = bridge
+        finally:
+            self.lock.release()
+
+    def detach(self, device):
+        self.lock.acquire()
+        try:
+            self._detach(device)
+        finally:
+            self.lock.release()
+
+    def _detach(self, device):
+        bridge = self.bridge_of.pop(device, None)
+        if bridge in self.bridges:
+            self.bridges[bridge].discard(device)
 
 
 class LinuxBridge:
@@ -58,25 +213,120 @@ class LinuxBridge:
         self.br_name_prefix = br_name_prefix
         self.physical_interface = physical_interface
         self.root_helper = root_helper
+        # ports are plugged concurrently, but each bridge is only set up
+        # by one of them. The locks are striped so that they do not pile
+        # up as networks come and go.
+        self.bridge_locks = [threading.Lock() for i in range(BRIDGE_LOCKS)]
+        self.snapshot = None
+        self.snapshot_lock = threading.Lock()
 
     def run_cmd(self, args):
-        cmd = shlex.split(self.root_helper) + args
-        LOG.debug("Running command: " + " ".join(cmd))
-        p = Popen(cmd, stdout=PIPE)
-        retval = p.communicate()[0]
-        if p.returncode == -(signal.SIGALRM):
-            LOG.debug("Timeout running command: " + " ".join(cmd))
+        LOG.debug("Running command: " + " ".join(args))
+        returncode, retval, stderr = rootwrap.execute(self.root_helper, args)
+        if returncode:
+            # the devices are not in the state expected by the snapshot
+            self.invalidate_snapshot()
+        if returncode == -(signal.SIGALRM):
+            LOG.debug("Timeout running command: " + " ".join(args))
         if retval:
             LOG.debug("Command returned: %s" % retval)
+        if stderr:
+            LOG.debug("Command stderr: %s" % stderr)
         return retval
 
+    def get_snapshot(self):
+        """Return the devices of the host, read again if invalidated."""
+        self.snapshot_lock.acquire()
+        try:
+            if self.snapshot is None:
+                self.snapshot = DeviceSnapshot()
+            return self.snapshot
+        finally:
+            self.snapshot_lock.release()
+
+    def invalidate_snapshot(self):
+        self.snapshot_lock.acquire()
+        try:
+            self.snapshot = None
+        finally:
+            self.snapshot_lock.release()
+
     def device_exists(self, device):
         """Check if ethernet device exists."""
-        retval = self.run_cmd(['ip', 'link', 'show', 'dev', device])
-        if retval:
-            return True
-        else:
-            return False
+        return device in self.get_snapshot().devices
+
+    def run_batch(self, batch):
+        """Run the commands of batch with a single ip process.
+
+        :returns: the owners of the commands which failed.
+        """
+        if not batch.commands:
+            return set()
+        lines = [" ".join(args) for owner, args, on_success in batch.commands]
+        LOG.debug("Running %d commands with ip -batch" % len(lines))
+        returncode, retval, stderr = rootwrap.execute(
+            self.root_helper, ['ip', '-force', '-batch', '-'],
+            "\n".join(lines) + "\n")
+        failed_lines = set()
+        errors = []
+        for line in stderr.splitlines():
+            match = BATCH_ERROR.match(line)
+            if not match:
+                errors.append(line.strip())
+                continue
+            number = int(match.group(1))
+            if 0 < number <= len(lines):
+                LOG.error("Command \"ip %s\" failed: %s"
+                          % (lines[number - 1], " ".join(errors)))
+                failed_lines.add(number)
+            errors = []
+        if returncode and not failed_lines:
+            LOG.error("Unable to run ip -batch: %s" % stderr)
+            failed_lines = set(range(1, len(lines) + 1))
+
+        failed = set()
+        for number, (owner, args, on_success) in enumerate(batch.commands):
+            if number + 1 in failed_lines:
+                failed.add(owner)
+            elif on_success:
+                on_success()
+        if failed_lines:
+            # the devices are not in the state expected by the snapshot
+            self.invalidate_snapshot()
+        return failed
+
+    def batch_attach(self, device, bridge_name, batch, owner):
+        """Add the commands putting device on a bridge to batch."""
+        current_bridge_name = batch.masters.get(
+            device, self.get_snapshot().get_bridge(device))
+        if current_bridge_name != bridge_name:
+            snapshot = self.get_snapshot()
+            batch.add(owner, ['link', 'set', 'dev', device, 'master',
+                              bridge_name],
+                      lambda: snapshot.attach(device, bridge_name))
+            batch.masters[device] = bridge_name
+
+    def batch_vlan_bridge(self, bridge_name, vlan_id, batch, owner):
+        """Add the commands creating a vlan and bridge to batch."""
+        interface = self.get_subinterface_name(vlan_id)
+        snapshot = self.get_snapshot()
+        if not (self.device_exists(interface) or interface in batch.created):
+            batch.add(owner, ['link', 'add', 'link', self.physical_interface,
+                              'name', interface, 'type', 'vlan', 'id',
+                              vlan_id],
+                      lambda: snapshot.add_device(interface, vlan=True))
+            batch.add(owner, ['link', 'set', interface, 'up'])
+            batch.created.add(interface)
+        if not (self.device_exists(bridge_name) or
+                bridge_name in batch.created):
+            batch.add(owner, ['link', 'add', 'name', bridge_name, 'type',
+                              'bridge', 'forward_delay', '0', 'stp_state',
+                              '0'],
+                      lambda: snapshot.add_bridge(bridge_name))
+            batch.add(owner, ['link', 'set', bridge_name, 'up'])
+            batch.created.add(bridge_name)
+        self.batch_attach(interface, bridge_name, batch, owner)
+        return interface
 
     def get_bridge_name(self, network_id):
         if not network_id:
@@ -101,47 +351,34 @@ class LinuxBridge:
 
     def get_all_quantum_bridges(self):
         quantum_bridge_list = []
-        bridge_list = os.listdir(BRIDGE_FS)
-        for bridge in bridge_list:
+        for bridge in self.get_snapshot().get_bridges():
             if bridge.startswith(BRIDGE_NAME_PREFIX):
                 quantum_bridge_list.append(bridge)
         return quantum_bridge_list
 
     def get_interfaces_on_bridge(self, bridge_name):
-        if self.device_exists(bridge_name):
-            bridge_interface_path = \
-                    BRIDGE_INTERFACES_FS.replace(BRIDGE_NAME_PLACEHOLDER,
-                                                 bridge_name)
-            return os.listdir(bridge_interface_path)
+        return self.get_snapshot().get_interfaces(bridge_name)
 
     def get_all_tap_devices(self):
         tap_devices = []
-        retval = self.run_cmd(['ip', 'tuntap'])
-        rows = retval.split('\n')
-        for row in rows:
-            split_row = row.split(':')
-            if split_row[0].startswith(TAP_INTERFACE_PREFIX):
-                tap_devices.append(split_row[0])
+        for device in self.get_snapshot().tun_devices:
+            if device.startswith(TAP_INTERFACE_PREFIX):
+                tap_devices.append(device)
 
         return tap_devices
 
     def get_all_gateway_devices(self):
         gw_devices = []
-        retval = self.run_cmd(['ip', 'tuntap'])
-        rows = retval.split('\n')
-        for row in rows:
-            split_row = row.split(':')
-            if split_row[0].startswith(GATEWAY_INTERFACE_PREFIX):
-                gw_devices.append(split_row[0])
+        for device in self.get_snapshot().tun_devices:
+            if device.startswith(GATEWAY_INTERFACE_PREFIX):
+                gw_devices.append(device)
 
         return gw_devices
 
     def get_bridge_for_tap_device(self, tap_device_name):
-        bridges = self.get_all_quantum_bridges()
-        for bridge in bridges:
-            interfaces = self.get_interfaces_on_bridge(bridge)
-            if tap_device_name in interfaces:
-                return bridge
+        bridge = self.get_snapshot().get_bridge(tap_device_name)
+        if bridge and bridge.startswith(BRIDGE_NAME_PREFIX):
+            return bridge
 
         return None
 
@@ -149,16 +386,28 @@ class LinuxBridge:
         if not device_name:
             return False
         else:
-            bridge_port_path = \
-                    BRIDGE_PORT_FS_FOR_DEVICE.replace(DEVICE_NAME_PLACEHOLDER,
-                                                      device_name)
-            return os.path.exists(bridge_port_path)
-
-    def ensure_vlan_bridge(self, network_id, vlan_id):
-        """Create a vlan and bridge unless they already exist."""
-        interface = self.ensure_vlan(vlan_id)
+            return self.get_snapshot().get_bridge(device_name) is not None
+
+    def get_bridge_lock(self, bridge_name):
+        return self.bridge_locks[hash(bridge_name) % len(self.bridge_locks)]
+
+    def ensure_vlan_bridge(self, network_id, vlan_id, batch=None,
+                           owner=None):
+        """Create a vlan and bridge unless they already exist.
+
+        If batch is given, the commands are added to it, on behalf of
+        owner, instead of being run.
+        """
         bridge_name = self.get_bridge_name(network_id)
-        self.ensure_bridge(bridge_name, interface)
+        if batch is not None:
+            return self.batch_vlan_bridge(bridge_name, vlan_id, batch, owner)
+        lock = self.get_bridge_lock(bridge_name)
+        lock.acquire()
+        try:
+            interface = self.ensure_vlan(vlan_id)
+            self.ensure_bridge(bridge_name, interface)
+        finally:
+            lock.release()
         return interface
 
     def ensure_vlan(self, vlan_id):
@@ -172,6 +421,7 @@ class LinuxBridge:
                              'name', interface, 'type', 'vlan', 'id',
                              vlan_id]):
                 return
+            self.get_snapshot().add_device(interface, vlan=True)
             if self.run_cmd(['ip', 'link', 'set', interface, 'up']):
                 return
             LOG.debug("Done creating subinterface %s" % interface)
@@ -186,6 +436,7 @@ class LinuxBridge:
                                                                 interface))
             if self.run_cmd(['brctl', 'addbr', bridge_name]):
                 return
+            self.get_snapshot().add_bridge(bridge_name)
             if self.run_cmd(['brctl', 'setfd', bridge_name, str(0)]):
                 return
             if self.run_cmd(['brctl', 'stp', bridge_name, 'off']):
@@ -195,12 +446,18 @@ class LinuxBridge:
             LOG.debug("Done starting bridge %s for subinterface %s" %
                       (bridge_name, interface))
 
-        self.run_cmd(['brctl', 'addif', bridge_name, interface])
+        snapshot = self.get_snapshot()
+        if snapshot.get_bridge(interface) != bridge_name:
+            if self.run_cmd(['brctl', 'addif', bridge_name, interface]):
+                return
+            snapshot.attach(interface, bridge_name)
 
-    def add_tap_interface(self, network_id, vlan_id, tap_device_name):
+    def add_tap_interface(self, network_id, vlan_id, tap_device_name,
+                          batch=None, owner=None):
         """
         If a VIF has been plugged into a network, this function will
-        add the corresponding tap device to the relevant bridge
+        add the corresponding tap device to the relevant bridge. If batch
+        is given, the commands are added to it instead of being run.
         """
         if not tap_device_name:
             return False
@@ -217,19 +474,27 @@ class LinuxBridge:
             return False
         LOG.debug("Adding device %s to bridge %s" % (tap_device_name,
                                                      bridge_name))
+        if batch is not None:
+            owner = owner or tap_device_name
+            self.ensure_vlan_bridge(network_id, vlan_id, batch, owner)
+            # setting the master moves the device from its current bridge
+            self.batch_attach(tap_device_name, bridge_name, batch, owner)
+            return True
         if current_bridge_name:
             if self.run_cmd(['brctl', 'delif', current_bridge_name,
                              tap_device_name]):
                 return False
+            self.get_snapshot().detach(tap_device_name)
 
         self.ensure_vlan_bridge(network_id, vlan_id)
         if self.run_cmd(['brctl', 'addif', bridge_name, tap_device_name]):
             return False
+        self.get_snapshot().attach(tap_device_name, bridge_name)
         LOG.debug("Done adding device %s to bridge %s" % (tap_device_name,
                                                           bridge_name))
         return True
 
-    def add_interface(self, network_id, vlan_id, interface_id):
+    def add_interface(self, network_id, vlan_id, interface_id, batch=None):
         if not interface_id:
             """
             Since the VIF id is null, no VIF is plugged into this port
@@ -238,18 +503,25 @@ class LinuxBridge:
             return False
         if interface_id.startswith(GATEWAY_INTERFACE_PREFIX):
             return self.add_tap_interface(network_id, vlan_id,
-                                              interface_id)
+                                              interface_id, batch)
         else:
             tap_device_name = self.get_tap_device_name(interface_id)
             return self.add_tap_interface(network_id, vlan_id,
-                                          tap_device_name)
+                                          tap_device_name, batch,
+                                          interface_id)
 
-    def delete_vlan_bridge(self, bridge_name):
+    def delete_vlan_bridge(self, bridge_name, batch=None):
         if self.device_exists(bridge_name):
             interfaces_on_bridge = self.get_interfaces_on_bridge(bridge_name)
+            vlans = self.get_snapshot().vlans
+            if batch is not None:
+                self.batch_delete_vlan_bridge(bridge_name,
+                                              interfaces_on_bridge, vlans,
+                                              batch)
+                return
             for interface in interfaces_on_bridge:
                 self.remove_interface(bridge_name, interface)
-                if interface.startswith(self.physical_interface):
+                if interface in vlans:
                     self.delete_vlan(interface)
 
             LOG.debug("Deleting bridge %s" % bridge_name)
@@ -257,19 +529,42 @@ class LinuxBridge:
                 return
             if self.run_cmd(['brctl', 'delbr', bridge_name]):
                 return
+            self.get_snapshot().remove_device(bridge_name)
             LOG.debug("Done deleting bridge %s" % bridge_name)
 
         else:
             LOG.error("Cannot delete bridge %s, does not exist" % bridge_name)
 
-    def remove_interface(self, bridge_name, interface_name):
+    def batch_delete_vlan_bridge(self, bridge_name, interfaces_on_bridge,
+                                 vlans, batch):
+        """Add the commands deleting a bridge and its vlan to batch.
+
+        Deleting the bridge removes the interfaces from it.
+        """
+        snapshot = self.get_snapshot()
+        LOG.debug("Deleting bridge %s" % bridge_name)
+        batch.add(bridge_name, ['link', 'set', bridge_name, 'down'])
+        batch.add(bridge_name, ['link', 'delete', bridge_name],
+                  lambda: snapshot.remove_device(bridge_name))
+        for interface in interfaces_on_bridge:
+            if interface in vlans:
+                self.batch_delete_vlan(interface, batch, bridge_name)
+
+    def remove_interface(self, bridge_name, interface_name, batch=None):
         if self.device_exists(bridge_name):
             if not self.is_device_on_bridge(interface_name):
                 return True
             LOG.debug("Removing device %s from bridge %s" % \
                       (interface_name, bridge_name))
+            if batch is not None:
+                snapshot = self.get_snapshot()
+                batch.add(interface_name, ['link', 'set', 'dev',
+                                           interface_name, 'nomaster'],
+                          lambda: snapshot.detach(interface_name))
+                return True
             if self.run_cmd(['brctl', 'delif', bridge_name, interface_name]):
                 return False
+            self.get_snapshot().detach(interface_name)
             LOG.debug("Done removing device %s from bridge %s" % \
                       (interface_name, bridge_name))
             return True
@@ -278,6 +573,14 @@ class LinuxBridge:
                       (interface_name, bridge_name))
             return False
 
+    def batch_delete_vlan(self, interface, batch, owner):
+        """Add the commands deleting a vlan interface to batch."""
+        snapshot = self.get_snapshot()
+        LOG.debug("Deleting subinterface %s for vlan" % interface)
+        batch.add(owner, ['link', 'set', interface, 'down'])
+        batch.add(owner, ['link', 'delete', interface],
+                  lambda: snapshot.remove_device(interface))
+
     def delete_vlan(self, interface):
         if self.device_exists(interface):
             LOG.debug("Deleting subinterface %s for vlan" % interface)
@@ -285,24 +588,70 @@ class LinuxBridge:
                 return
             if self.run_cmd(['ip', 'link', 'delete', interface]):
                 return
+            self.get_snapshot().remove_device(interface)
             LOG.debug("Done deleting subinterface %s" % interface)
 
 
 class LinuxBridgeQuantumAgent:
 
     def __init__(self, br_name_prefix, physical_interface, polling_interval,
-                 root_helper):
+                 root_helper, subscriber=None, monitor=None, ip_batch=False):
         self.polling_interval = int(polling_interval)
         self.root_helper = root_helper
+        self.subscriber = subscriber or notifier.NullSubscriber()
+        self.monitor = monitor
+        self.ip_batch = ip_batch
+        self.plug_latency = metrics.LatencyTracker("plug_to_up")
+        self.status = status.StatusReporter()
         self.setup_linux_bridge(br_name_prefix, physical_interface)
 
     def setup_linux_bridge(self, br_name_prefix, physical_interface):
         self.linux_br = LinuxBridge(br_name_prefix, physical_interface,
                                     self.root_helper)
 
+    def run_tasks(self, tasks):
+        """Run a list of (key, function, args) tuples.
+
+        The functions run concurrently in the worker pool. With ip_batch,
+        they are given a batch argument instead, to which they add their
+        commands on behalf of key, and the batch is run at the end.
+
+        :returns: a dict of key -> result of the function, False if its
+            commands failed.
+        """
+        results = {}
+        if self.ip_batch:
+            batch = IpBatch()
+            for key, function, args in tasks:
+                results[key] = function(*args, batch=batch)
+            for key in self.linux_br.run_batch(batch):
+                results[key] = False
+        else:
+            pool = workers.get_pool()
+            for key, function, args in tasks:
+                pool.submit(key, function, *args)
+            for task in pool.wait():
+                results[task.key] = task.result
+        return results
+
+    def plug_ports(self, bindings):
+        """Plug the ports of a list of (port binding, vlan id) tuples.
+
+        :returns: the port bindings which were plugged.
+        """
+        tasks = []
+        for pb, vlan_id in bindings:
+            tasks.append((pb['interface_id'], self.process_port_binding,
+                          (pb['uuid'], pb['network_id'], pb['interface_id'],
+                           vlan_id)))
+        results = self.run_tasks(tasks)
+        return [pb for pb, vlan_id in bindings
+                if results.get(pb['interface_id'])]
+
     def process_port_binding(self, port_id, network_id, interface_id,
-                             vlan_id):
-        return self.linux_br.add_interface(network_id, vlan_id, interface_id)
+                             vlan_id, batch=None):
+        return self.linux_br.add_interface(network_id, vlan_id, interface_id,
+                                           batch)
 
     def process_unplugged_interfaces(self, plugged_interfaces):
         """
@@ -325,21 +674,25 @@ class LinuxBridgeQuantumAgent:
                 plugged_tap_device_names.append(tap_device_name)
 
         LOG.debug("plugged tap device names %s" % plugged_tap_device_names)
-        for tap_device in self.linux_br.get_all_tap_devices():
-            if tap_device not in plugged_tap_device_names:
-                current_bridge_name = \
-                        self.linux_br.get_bridge_for_tap_device(tap_device)
-                if current_bridge_name:
-                    self.linux_br.remove_interface(current_bridge_name,
-                                                   tap_device)
-
-        for gw_device in self.linux_br.get_all_gateway_devices():
-            if gw_device not in plugged_gateway_device_names:
-                current_bridge_name = \
-                        self.linux_br.get_bridge_for_tap_device(gw_device)
-                if current_bridge_name:
-                    self.linux_br.remove_interface(current_bridge_name,
-                                                   gw_device)
+        # only the devices still on a bridge need to be unplugged
+        attached = self.linux_br.get_snapshot().get_attached_devices()
+        unplugged = (
+            (set(self.linux_br.get_all_tap_devices()) -
+             set(plugged_tap_device_names)) |
+            (set(self.linux_br.get_all_gateway_devices()) -
+             set(plugged_gateway_device_names)))
+        results = self.run_tasks([(device, self.unplug_device, (device,))
+                                  for device in sorted(unplugged & attached)])
+        for result in results.values():
+            if result:
+                metrics.incr("ports_removed")
+
+    def unplug_device(self, device_name, batch=None):
+        current_bridge_name = \
+                self.linux_br.get_bridge_for_tap_device(device_name)
+        if current_bridge_name:
+            return self.linux_br.remove_interface(current_bridge_name,
+                                                  device_name, batch)
 
     def process_deleted_networks(self, vlan_bindings):
         current_quantum_networks = vlan_bindings.keys()
@@ -349,47 +702,48 @@ class LinuxBridgeQuantumAgent:
             current_quantum_bridge_names.append(bridge_name)
 
         quantum_bridges_on_this_host = self.linux_br.get_all_quantum_bridges()
+        tasks = []
         for bridge in quantum_bridges_on_this_host:
             if bridge not in current_quantum_bridge_names:
-                self.linux_br.delete_vlan_bridge(bridge)
+                tasks.append((bridge, self.linux_br.delete_vlan_bridge,
+                              (bridge,)))
+        self.run_tasks(tasks)
 
-    def manage_networks_on_host(self, conn, old_vlan_bindings,
+    def manage_networks_on_host(self, db, old_vlan_bindings,
                                 old_port_bindings):
-        if DB_CONNECTION != 'sqlite':
-            cursor = MySQLdb.cursors.DictCursor(conn)
-        else:
-            cursor = conn.cursor()
-        cursor.execute("SELECT * FROM vlan_bindings")
-        rows = cursor.fetchall()
-        cursor.close()
+        # devices may have been plugged or unplugged since the last time
+        self.linux_br.invalidate_snapshot()
+        db_started = time.time()
         vlan_bindings = {}
         vlans_string = ""
-        for row in rows:
+        for row in db.fetch("SELECT network_id, vlan_id FROM vlan_bindings"):
             vlan_bindings[row['network_id']] = row
             vlans_string = "%s %s" % (vlans_string, row)
 
         plugged_interfaces = []
-        cursor = MySQLdb.cursors.DictCursor(conn)
-        cursor.execute("SELECT * FROM ports where state = 'ACTIVE'")
-        port_bindings = cursor.fetchall()
-        cursor.close()
+        port_bindings = db.fetch(ACTIVE_PORTS_QUERY)
+        metrics.observe("db", time.time() - db_started)
 
         ports_string = ""
+        bindings = []
+        pending = set()
         for pb in port_bindings:
             ports_string = "%s %s" % (ports_string, pb)
             if pb['interface_id']:
+                if pb['op_status'] != OP_STATUS_UP:
+                    self.plug_latency.start(pb['uuid'])
+                    pending.add(pb['uuid'])
                 vlan_id = \
                         str(vlan_bindings[pb['network_id']]['vlan_id'])
-                if self.process_port_binding(pb['uuid'],
-                                             pb['network_id'],
-                                             pb['interface_id'],
-                                             vlan_id):
-                    cursor = MySQLdb.cursors.DictCursor(conn)
-                    sql = PORT_OPSTATUS_UPDATESQL % (pb['uuid'],
-                                                     OP_STATUS_UP)
-                    cursor.execute(sql)
-                    cursor.close()
+                bindings.append((pb, vlan_id))
                 plugged_interfaces.append(pb['interface_id'])
+        plugged = self.plug_ports(bindings)
+        self.plug_latency.retain(pending)
+        self.status.retain(set(pb['uuid'] for pb in port_bindings))
+
+        for pb in plugged:
+            metrics.incr("ports_added")
+            self.status.update(pb['uuid'], OP_STATUS_UP, pb['op_status'])
 
         if old_port_bindings != port_bindings:
             LOG.debug("Port-bindings: %s" % ports_string)
@@ -401,21 +755,189 @@ class LinuxBridgeQuantumAgent:
 
         self.process_deleted_networks(vlan_bindings)
 
-        conn.commit()
+        # the database session is only used from this thread
+        for port_id, op_status in self.status.flush(db).items():
+            if op_status == OP_STATUS_UP:
+                self.plug_latency.stop(port_id)
         return {VLAN_BINDINGS: vlan_bindings,
                 PORT_BINDINGS: port_bindings}
 
-    def daemon_loop(self, conn):
+    def get_device_port_bindings(self, db, device):
+        """Return the active ports whose interface is device."""
+        if device.startswith(GATEWAY_INTERFACE_PREFIX):
+            interface_id = device
+        elif device.startswith(TAP_INTERFACE_PREFIX):
+            # the tap name only holds the beginning of the interface id
+            interface_id = device[len(TAP_INTERFACE_PREFIX):] + "%"
+        else:
+            return []
+        port_bindings = db.fetch(
+            ACTIVE_PORTS_QUERY + " AND interface_id LIKE :interface_id",
+            interface_id=interface_id)
+        return [pb for pb in port_bindings
+                if (pb['interface_id'] == device or
+                    self.linux_br.get_tap_device_name(pb['interface_id']) ==
+                    device)]
+
+    def process_changed_devices(self, db, devices, deleted_networks=()):
+        """Reconcile the given devices and remove the bridges of the
+        deleted networks.
+
+        Devices of the host with an active port are plugged, and the other
+        ones are unplugged. Only these devices and their ports are looked
+        at, rather than every port and device as in
+        manage_networks_on_host().
+        """
+        self.linux_br.invalidate_snapshot()
+        db_started = time.time()
+        bindings = []
+        unplugged = []
+        for device in devices:
+            if not (device.startswith(TAP_INTERFACE_PREFIX) or
+                    device.startswith(GATEWAY_INTERFACE_PREFIX)) or \
+                    not self.linux_br.device_exists(device):
+                continue
+            port_bindings = self.get_device_port_bindings(db, device)
+            if not port_bindings and \
+                    self.linux_br.get_bridge_for_tap_device(device):
+                unplugged.append(device)
+            for pb in port_bindings:
+                vlan_bindings = db.fetch(
+                    "SELECT vlan_id FROM vlan_bindings "
+                    "WHERE network_id = :network_id",
+                    network_id=pb['network_id'])
+                if vlan_bindings:
+                    bindings.append((pb, str(vlan_bindings[0]['vlan_id'])))
+        metrics.observe("db", time.time() - db_started)
+
+        for pb, vlan_id in bindings:
+            if pb['op_status'] != OP_STATUS_UP:
+                self.plug_latency.start(pb['uuid'])
+        for pb in self.plug_ports(bindings):
+            metrics.incr("ports_added")
+            self.status.update(pb['uuid'], OP_STATUS_UP, pb['op_status'])
+        results = self.run_tasks([(device, self.unplug_device, (device,))
+                                  for device in unplugged])
+        for result in results.values():
+            if result:
+                metrics.incr("ports_removed")
+        tasks = []
+        for network_id in deleted_networks:
+            bridge = self.linux_br.get_bridge_name(network_id)
+            if self.linux_br.device_exists(bridge):
+                tasks.append((bridge, self.linux_br.delete_vlan_bridge,
+                              (bridge,)))
+        self.run_tasks(tasks)
+
+        for port_id, op_status in self.status.flush(db).items():
+            if op_status == OP_STATUS_UP:
+                self.plug_latency.stop(port_id)
+
+    def get_interface_device(self, interface_id):
+        """Return the name of the device of an interface on this host."""
+        if interface_id.startswith(GATEWAY_INTERFACE_PREFIX):
+            # named by the linux net driver
+            return interface_id
+        return self.linux_br.get_tap_device_name(interface_id)
+
+    def get_event_changes(self, events):
+        """Return what events ask process_changed_devices() to reconcile.
+
+        These are the devices added to the host, the devices of the
+        interfaces plugged, unplugged or updated in the plugin, and the
+        networks deleted.
+
+        :returns: a (devices, deleted networks) tuple, or None if the events
+            require a full sync, i.e. if the link monitor is not active or
+            if notifier.event_targets() returns None for them.
+        """
+        if not (self.monitor and self.monitor.active):
+            return None
+        targets = notifier.event_targets(
+            events, (netlink.LINK_ADD, netlink.LINK_DELETE))
+        if targets is None:
+            return None
+        devices = set()
+        deleted_networks = set()
+        for event in events:
+            if event.get("event") == netlink.LINK_ADD:
+                devices.add(event["device"])
+            elif event.get("event") == notifier.NETWORK_DELETE:
+                deleted_networks.add(event["network_id"])
+        for interface_id in targets[0]:
+            devices.add(self.get_interface_device(interface_id))
+        return sorted(devices), deleted_networks
+
+    def wait_for_changes(self, resync_deadline):
+        """Wait until the next iteration of the daemon loop is due.
+
+        As long as both the link monitor and the notification channel are
+        up, every change is reported through the subscriber, so this only
+        returns when events arrive or when resync_deadline is reached.
+        Otherwise this returns after polling_interval at most.
+
+        :returns: the events received.
+        """
+        while True:
+            events = self.subscriber.wait(self.polling_interval)
+            if events:
+                return events
+            if not (self.monitor and self.monitor.active and
+                    self.subscriber.connected):
+                return events
+            if time.time() >= resync_deadline:
+                return events
+
+    def daemon_loop(self, db):
         old_vlan_bindings = {}
         old_port_bindings = {}
+        resync_deadline = 0
+        events = []
 
         while True:
-            bindings = self.manage_networks_on_host(conn,
-                                                    old_vlan_bindings,
-                                                    old_port_bindings)
-            old_vlan_bindings = bindings[VLAN_BINDINGS]
-            old_port_bindings = bindings[PORT_BINDINGS]
-            time.sleep(self.polling_interval)
+            started = time.time()
+            changes = self.get_event_changes(events)
+            try:
+                if changes is None or started >= resync_deadline:
+                    resync_deadline = started + RESYNC_INTERVAL
+                    bindings = self.manage_networks_on_host(
+                        db, old_vlan_bindings, old_port_bindings)
+                    old_vlan_bindings = bindings[VLAN_BINDINGS]
+                    old_port_bindings = bindings[PORT_BINDINGS]
+                else:
+                    self.process_changed_devices(db, *changes)
+            except exc.SQLAlchemyError, e:
+                # the pool reconnects on the next iteration, which syncs
+                # everything since changes may have been missed
+                LOG.error("Unable to access the database: %s" % e)
+                db.rollback()
+                resync_deadline = 0
+            metrics.iteration_done(started)
+            events = self.wait_for_changes(resync_deadline)
+
+
+def get_sql_connection(config):
+    """Return the URL of the plugin's database.
+
+    Unless set as sql_connection, it is built from the same options as in
+    the plugin.
+
+    :raises ValueError: if the plugin uses its in-memory sqlite database,
+        which only exists in the quantum server's process.
+    """
+    try:
+        return config.get("DATABASE", "sql_connection")
+    except ConfigParser.Error:
+        pass
+    if config.get("DATABASE", "connection") == 'sqlite':
+        raise ValueError("connection = sqlite is the plugin's in-memory "
+                         "database, which the agent cannot read: set "
+                         "sql_connection to the plugin's database URL")
+    return "mysql://%s:%s@%s:%s/%s" % (config.get("DATABASE", "user"),
+                                       config.get("DATABASE", "pass"),
+                                       config.get("DATABASE", "host"),
+                                       config.getint("DATABASE", "port"),
+                                       config.get("DATABASE", "name"))
 
 
 def main():
@@ -437,7 +959,7 @@ def main():
 
     config_file = args[0]
     config = ConfigParser.ConfigParser()
-    conn = None
+    db = None
     try:
         fh = open(config_file)
         fh.close()
@@ -446,35 +968,62 @@ def main():
         physical_interface = config.get("LINUX_BRIDGE", "physical_interface")
         polling_interval = config.get("AGENT", "polling_interval")
         root_helper = config.get("AGENT", "root_helper")
-        'Establish database connection and load models'
-        global DB_CONNECTION
-        DB_CONNECTION = config.get("DATABASE", "connection")
-        if DB_CONNECTION == 'sqlite':
-            LOG.info("Connecting to sqlite DB")
-            conn = sqlite3.connect(":memory:")
-            conn.row_factory = sqlite3.Row
-        else:
-            db_name = config.get("DATABASE", "name")
-            db_user = config.get("DATABASE", "user")
-            db_pass = config.get("DATABASE", "pass")
-            db_host = config.get("DATABASE", "host")
-            db_port = int(config.get("DATABASE", "port"))
-            LOG.info("Connecting to database %s on %s" % (db_name, db_host))
-            conn = MySQLdb.connect(host=db_host, user=db_user, port=db_port,
-                                   passwd=db_pass, db=db_name)
+        try:
+            use_rootwrap_daemon = config.getboolean("AGENT", "rootwrap_daemon")
+        except ConfigParser.Error:
+            use_rootwrap_daemon = False
+        try:
+            command_workers = config.getint("AGENT", "command_workers")
+        except ConfigParser.Error:
+            command_workers = DEFAULT_COMMAND_WORKERS
+        try:
+            stats_socket = config.get("AGENT", "stats_socket")
+        except ConfigParser.Error:
+            stats_socket = None
+        try:
+            stats_interval = config.getint("AGENT", "stats_interval")
+        except ConfigParser.Error:
+            stats_interval = metrics.DEFAULT_STATS_INTERVAL
+        try:
+            notification_address = config.get("NOTIFICATION", "address")
+        except ConfigParser.Error:
+            notification_address = None
+        try:
+            use_netlink_monitor = config.getboolean("AGENT",
+                                                    "netlink_monitor")
+        except ConfigParser.Error:
+            use_netlink_monitor = True
+        try:
+            ip_batch = config.getboolean("AGENT", "ip_batch")
+        except ConfigParser.Error:
+            ip_batch = False
+        'Establish database connection'
+        engine = database.get_engine(get_sql_connection(config))
+        LOG.info("Connecting to database \"%s\" on %s" %
+                 (engine.url.database, engine.url.host))
+        db = database.AgentDB(engine)
     except Exception, e:
         LOG.error("Unable to parse config file \"%s\": \nException%s"
                   % (config_file, str(e)))
         sys.exit(1)
 
     try:
+        rootwrap.configure_daemon(root_helper, use_rootwrap_daemon)
+        workers.configure(command_workers)
+        metrics.configure(stats_socket, stats_interval)
+        subscriber = notifier.get_subscriber(notification_address)
+        monitor = None
+        if use_netlink_monitor:
+            monitor = netlink.LinkMonitor(on_event=subscriber.dispatch)
+            monitor.start()
         plugin = LinuxBridgeQuantumAgent(br_name_prefix, physical_interface,
-                                         polling_interval, root_helper)
+                                         polling_interval, root_helper,
+                                         subscriber, monitor, ip_batch)
         LOG.info("Agent initialized successfully, now running...")
-        plugin.daemon_loop(conn)
+        plugin.daemon_loop(db)
     finally:
-        if conn:
-            conn.close()
+        if db:
+            db.close()
 
     sys.exit(0)
 
@@ -46,3 +46,7 @@ if DB_CONNECTION != 'sqlite':
     DB_PASS = SECTION_CONF['pass']
     DB_HOST = SECTION_CONF['host']
     DB_PORT = SECTION_CONF['port']
+
+
+SECTION_CONF = CONF_PARSER_OBJ.get('NOTIFICATION', {})
+NOTIFICATION_ADDRESS = SECTION_CONF.get('address')
@@ -0,0 +1,289 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import ConfigParser
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import exc
+import stubout
+
+from quantum.agent import database
+from quantum.agent import netlink
+from quantum.agent import notifier
+from quantum.agent import rootwrap
+from quantum.plugins.linuxbridge.agent import linuxbridge_quantum_agent
+from quantum.tests.benchmark import agents
+from quantum.tests.benchmark import fakes
+
+
+NET_A = "aaaaaaaa-aaaa-aaaa-aaaa-aaaaaaaaaaaa"
+NET_B = "bbbbbbbb-bbbb-bbbb-bbbb-bbbbbbbbbbbb"
+
+
+class LinuxBridgeTest(unittest.TestCase):
+    """Runs the bridge operations against a fake host."""
+
+    def setUp(self):
+        self.lb = linuxbridge_quantum_agent
+        self.tempdir = tempfile.mkdtemp()
+        self.host = fakes.FakeLinuxHost(self.tempdir, 0, "eth1")
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(self.lb, "NET_FS", self.tempdir + os.sep)
+        self.stubs.Set(rootwrap, "_execute", self.host.execute)
+        self.linux_br = self.lb.LinuxBridge("brq", "eth1", "sudo")
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        shutil.rmtree(self.tempdir)
+
+    def _commands(self):
+        return self.host.commands.value
+
+    def test_snapshot(self):
+        self.host.plug_tap("tap0")
+        self.assertTrue(self.linux_br.add_interface(NET_A, "10", "0"))
+        snapshot = self.lb.DeviceSnapshot()
+        self.assertEqual(snapshot.devices,
+                         set(["eth1", "eth1.10", "brqaaaaaaaa-aa", "tap0"]))
+        self.assertEqual(snapshot.bridges,
+                         {"brqaaaaaaaa-aa": set(["eth1.10", "tap0"])})
+        self.assertEqual(snapshot.tun_devices, set(["tap0"]))
+        self.assertEqual(snapshot.vlans, set(["eth1.10"]))
+
+    def test_bridge_locks(self):
+        names = ["brq%011d" % i for i in range(100)]
+        locks = set(self.linux_br.get_bridge_lock(name) for name in names)
+        self.assertTrue(len(locks) <= self.lb.BRIDGE_LOCKS)
+        self.assertTrue(self.linux_br.get_bridge_lock(names[0]) is
+                        self.linux_br.get_bridge_lock("brq%011d" % 0))
+
+    def test_index_maintained(self):
+        self.host.plug_tap("tap0")
+        self.host.plug_tap("tap1")
+        self.assertTrue(self.linux_br.add_interface(NET_A, "10", "0"))
+        self.assertTrue(self.linux_br.add_interface(NET_A, "10", "1"))
+        # the tap moves to another network
+        self.assertTrue(self.linux_br.add_interface(NET_B, "11", "1"))
+        self.assertFalse(self.linux_br.add_interface(NET_B, "11", "1"))
+        self.linux_br.delete_vlan_bridge("brqaaaaaaaa-aa")
+        # the changes are tracked without reading sysfs again
+        snapshot = self.linux_br.get_snapshot()
+        self.assertEqual(snapshot.bridge_of,
+                         self.lb.DeviceSnapshot().bridge_of)
+        self.assertEqual(snapshot.devices, self.lb.DeviceSnapshot().devices)
+        self.assertEqual(self.linux_br.get_bridge_for_tap_device("tap1"),
+                         "brqbbbbbbbb-bb")
+        self.assertEqual(self.linux_br.get_bridge_for_tap_device("tap0"),
+                         None)
+
+    def test_no_commands_when_plugged(self):
+        self.host.plug_tap("tap0")
+        self.assertTrue(self.linux_br.add_interface(NET_A, "10", "0"))
+        self.linux_br.invalidate_snapshot()
+        commands = self._commands()
+        self.assertFalse(self.linux_br.add_interface(NET_A, "10", "0"))
+        self.assertEqual(self._commands(), commands)
+
+    def test_batch(self):
+        for tap in ("tap0", "tap1", "tap2"):
+            self.host.plug_tap(tap)
+        self.assertTrue(self.linux_br.add_interface(NET_B, "11", "2"))
+        batch = self.lb.IpBatch()
+        self.assertTrue(self.linux_br.add_interface(NET_A, "10", "0", batch))
+        self.assertTrue(self.linux_br.add_interface(NET_A, "10", "1", batch))
+        self.assertTrue(self.linux_br.add_interface(NET_A, "10", "2", batch))
+        self.linux_br.delete_vlan_bridge("brqbbbbbbbb-bb", batch)
+        commands = self._commands()
+        self.assertEqual(self.linux_br.run_batch(batch), set())
+        self.assertEqual(self._commands(), commands + 1)
+        self.assertEqual(self.host.bridges, set(["brqaaaaaaaa-aa"]))
+        self.assertEqual(self.host.devices,
+                         {"eth1": None, "eth1.10": "brqaaaaaaaa-aa",
+                          "brqaaaaaaaa-aa": None, "tap0": "brqaaaaaaaa-aa",
+                          "tap1": "brqaaaaaaaa-aa", "tap2": "brqaaaaaaaa-aa"})
+        snapshot = self.linux_br.get_snapshot()
+        self.assertEqual(snapshot.bridge_of,
+                         self.lb.DeviceSnapshot().bridge_of)
+        self.assertEqual(snapshot.devices, self.lb.DeviceSnapshot().devices)
+
+        batch = self.lb.IpBatch()
+        self.linux_br.remove_interface("brqaaaaaaaa-aa", "tap0", batch)
+        self.linux_br.run_batch(batch)
+        self.assertEqual(self.host.devices["tap0"], None)
+
+    def test_batch_failures(self):
+        self.host.plug_tap("tap0")
+        self.host.plug_tap("tap1")
+        snapshot = self.linux_br.get_snapshot()
+        # the device is gone by the time the batch runs
+        self.host.unplug_tap("tap1")
+        batch = self.lb.IpBatch()
+        self.linux_br.add_interface(NET_A, "10", "0", batch)
+        self.linux_br.add_interface(NET_A, "10", "1", batch)
+        self.assertEqual(self.linux_br.run_batch(batch), set(["1"]))
+        self.assertEqual(self.host.devices["tap0"], "brqaaaaaaaa-aa")
+        self.assertFalse(self.linux_br.get_snapshot() is snapshot)
+
+    def test_failed_command_invalidates(self):
+        self.host.plug_tap("tap0")
+        snapshot = self.linux_br.get_snapshot()
+        self.linux_br.run_cmd(["brctl", "addif", "brqnone", "tap0"])
+        self.assertFalse(self.linux_br.get_snapshot() is snapshot)
+
+
+class FakeMonitor(object):
+    active = True
+
+
+class LinuxBridgeQuantumAgentTest(unittest.TestCase):
+
+    def setUp(self):
+        lb = linuxbridge_quantum_agent
+        self.tempdir = tempfile.mkdtemp()
+        self.host = fakes.FakeLinuxHost(self.tempdir, 0, "eth1")
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(lb, "NET_FS", self.tempdir + os.sep)
+        self.stubs.Set(rootwrap, "_execute", self.host.execute)
+        self.db = database.AgentDB(database.get_engine("sqlite://"))
+        for statement in agents.SCHEMA:
+            self.db.execute(statement)
+        self.db.execute("INSERT INTO vlan_bindings VALUES (10, :network_id)",
+                        network_id=NET_A)
+        self.db.execute("INSERT INTO ports VALUES "
+                        "('port0', :network_id, '0123456789ab-cdef', "
+                        "'ACTIVE', 'DOWN')", network_id=NET_A)
+        self.db.commit()
+        self.agent = lb.LinuxBridgeQuantumAgent("brq", "eth1", 2, "sudo",
+                                                monitor=FakeMonitor())
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_process_changed_devices(self):
+        self.host.plug_tap("tap0123456789a")
+        self.agent.process_changed_devices(self.db, ["eth1.10",
+                                                     "tap0123456789a"])
+        self.assertEqual(self.host.devices["tap0123456789a"],
+                         "brqaaaaaaaa-aa")
+        rows = self.db.fetch("SELECT op_status FROM ports")
+        self.assertEqual(rows[0]["op_status"], "UP")
+
+    def test_process_unplugged_device(self):
+        self.host.plug_tap("tap0123456789a")
+        self.agent.process_changed_devices(self.db, ["tap0123456789a"])
+        self.db.execute("UPDATE ports SET interface_id = NULL")
+        self.db.commit()
+        self.agent.process_changed_devices(self.db, ["tap0123456789a",
+                                                     "tapmissing"])
+        self.assertEqual(self.host.devices["tap0123456789a"], None)
+
+    def test_process_deleted_network(self):
+        self.host.plug_tap("tap0123456789a")
+        self.agent.process_changed_devices(self.db, ["tap0123456789a"])
+        self.assertTrue("brqaaaaaaaa-aa" in self.host.devices)
+        self.agent.process_changed_devices(self.db, [], [NET_A, NET_B])
+        self.assertFalse("brqaaaaaaaa-aa" in self.host.devices)
+
+    def test_manage_networks_on_host(self):
+        self.host.plug_tap("tap0123456789a")
+        bindings = self.agent.manage_networks_on_host(self.db, {}, {})
+        self.assertEqual(bindings[linuxbridge_quantum_agent.PORT_BINDINGS],
+                         [("port0", NET_A, "0123456789ab-cdef", "DOWN")])
+        self.assertEqual(self.host.devices["tap0123456789a"],
+                         "brqaaaaaaaa-aa")
+        rows = self.db.fetch("SELECT op_status FROM ports")
+        self.assertEqual(rows[0]["op_status"], "UP")
+
+    def test_database_error(self):
+        self.host.plug_tap("tap0123456789a")
+        fetch = self.db.fetch
+        failures = [exc.OperationalError("SELECT", {},
+                                         Exception("server has gone away"))]
+
+        def flaky_fetch(statement, **params):
+            if failures:
+                raise failures.pop(0)
+            return fetch(statement, **params)
+
+        deadlines = []
+
+        def wait_for_changes(resync_deadline):
+            deadlines.append(resync_deadline)
+            if len(deadlines) == 2:
+                raise StopIteration()
+            return []
+
+        self.stubs.Set(self.db, "fetch", flaky_fetch)
+        self.stubs.Set(self.agent, "wait_for_changes", wait_for_changes)
+        self.assertRaises(StopIteration, self.agent.daemon_loop, self.db)
+        # the agent kept running and synced on the next iteration
+        self.assertEqual(deadlines[0], 0)
+        self.assertEqual(self.host.devices["tap0123456789a"],
+                         "brqaaaaaaaa-aa")
+
+    def test_get_event_changes(self):
+        add = {"event": netlink.LINK_ADD, "device": "tap0"}
+        delete = {"event": netlink.LINK_DELETE, "device": "tap1"}
+        self.assertEqual(self.agent.get_event_changes([add, delete]),
+                         (["tap0"], set()))
+        self.assertEqual(self.agent.get_event_changes([]), None)
+        self.assertEqual(self.agent.get_event_changes(
+            [add, {"event": notifier.RESYNC}]), None)
+        self.agent.monitor.active = False
+        self.assertEqual(self.agent.get_event_changes([add]), None)
+
+    def test_get_plugin_event_changes(self):
+        events = [{"event": notifier.PORT_UNPLUG, "network_id": NET_A,
+                   "port_id": "port0", "interface_id": "0123456789ab-cdef"},
+                  {"event": notifier.PORT_PLUG, "network_id": NET_A,
+                   "port_id": "port1", "interface_id": "gw-0123456789"},
+                  {"event": notifier.NETWORK_DELETE, "network_id": NET_B}]
+        self.assertEqual(self.agent.get_event_changes(events),
+                         (["gw-0123456789", "tap0123456789a"], set([NET_B])))
+
+
+class GetSqlConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = ConfigParser.ConfigParser()
+        self.config.add_section("DATABASE")
+        for option, value in (("connection", "mysql"), ("name", "quantum"),
+                              ("user", "quantum"), ("pass", "secret"),
+                              ("host", "db"), ("port", "3306")):
+            self.config.set("DATABASE", option, value)
+
+    def test_mysql(self):
+        self.assertEqual(
+            linuxbridge_quantum_agent.get_sql_connection(self.config),
+            "mysql://quantum:secret@db:3306/quantum")
+
+    def test_sql_connection(self):
+        self.config.set("DATABASE", "sql_connection", "sqlite:////q.sqlite")
+        self.assertEqual(
+            linuxbridge_quantum_agent.get_sql_connection(self.config),
+            "sqlite:////q.sqlite")
+
+    def test_in_memory_sqlite_refused(self):
+        self.config.set("DATABASE", "connection", "sqlite")
+        self.assertRaises(ValueError,
+                          linuxbridge_quantum_agent.get_sql_connection,
+                          self.config)
@@ -36,7 +36,7 @@ class NVPApiHelper(NvpApiClientEventlet):
 
     def __init__(self, api_providers, user, password, request_timeout,
                  http_timeout, retries, redirects, failover_time,
-                 concurrent_connections=3):
+                 concurrent_connections=3, load_balancing=False):
         '''Constructor.
 
         :param api_providers: a list of tuples in the form:
@@ -53,10 +53,12 @@ class NVPApiHelper(NvpApiClientEventlet):
         :param redirects: the number of concurrent connections.
         :param failover_time: minimum time between controller failover and new
             connections allowed.
+        :param load_balancing: spread requests across all the controllers
+            and send writes straight to the cluster's master.
         '''
         NvpApiClientEventlet.__init__(
             self, api_providers, user, password, concurrent_connections,
-            failover_time=failover_time)
+            failover_time=failover_time, load_balancing=load_balancing)
 
         self._request_timeout = request_timeout
         self._http_timeout = http_timeout
@@ -93,9 +93,15 @@ def parse_config(config):
     except ConfigParser.NoOptionError, e:
         concurrent_connections = str(DEFAULT_CONCURRENT_CONNECTIONS)
 
+    try:
+        load_balancing = config.get('NVP', 'load_balancing')
+    except ConfigParser.NoOptionError, e:
+        load_balancing = 'False'
+
     plugin_config = {
         'failover_time': failover_time,
-        'concurrent_connections': concurrent_connections
+        'concurrent_connections': concurrent_connections,
+        'load_balancing': load_balancing
     }
     LOG.info('parse_config(): plugin_config == "%s"' % plugin_config)
 
@@ -260,7 +266,9 @@ class NvpPlugin(object):
             retries=c.retries, redirects=c.redirects,
             failover_time=int(self.plugin_config['failover_time']),
             concurrent_connections=int(
-                self.plugin_config['concurrent_connections']))
+                self.plugin_config['concurrent_connections']),
+            load_balancing=(
+                self.plugin_config['load_balancing'].lower() == 'true'))
 
         c.api_client.login()
 
@@ -349,13 +357,12 @@ class NvpPlugin(object):
         :raises: exception.NetworkNotFound
         :raises: exception.QuantumException
         '''
-        if not nvplib.check_tenant(self.controller, netw_id, tenant_id):
+        info, lports = nvplib.query_network_ports(
+            self.controller, netw_id, relations="LogicalPortAttachment")
+        owner, name = info
+        if owner != tenant_id:
             raise exception.NetworkNotFound(net_id=netw_id)
-        result = None
         remote_vifs = []
-        switch = netw_id
-        lports = nvplib.query_ports(self.controller, switch,
-          relations="LogicalPortAttachment")
 
         for port in lports:
             relation = port["_relations"]
@@ -363,12 +370,9 @@ class NvpPlugin(object):
             if "vif_uuid" in vic:
                 remote_vifs.append(vic["vif_uuid"])
 
-        if not result:
-            result = nvplib.get_network(self.controller, switch)
-
         d = {"net-id": netw_id,
              "net-ifaces": remote_vifs,
-             "net-name": result["display_name"],
+             "net-name": name,
              "net-op-status": "UP"}
         LOG.debug("get_network_details() completed for tenant %s: %s" % (
                   tenant_id, d))
@@ -445,8 +449,6 @@ class NvpPlugin(object):
         if not nvplib.check_tenant(self.controller, netw_id, tenant_id):
             raise exception.NetworkNotFound(net_id=netw_id)
         params["controller"] = self.controller
-        if not nvplib.check_tenant(self.controller, netw_id, tenant_id):
-            raise exception.NetworkNotFound(net_id=netw_id)
         result = nvplib.create_port(tenant_id, netw_id, port_init_state,
           **params)
         d = {"port-id": result["uuid"],
@@ -49,7 +49,7 @@ class NvpApiClient(object):
         pass
 
     @abstractmethod
-    def acquire_connection(self):
+    def acquire_connection(self, is_write=False):
         pass
 
     @abstractmethod
@@ -40,7 +40,8 @@ class NvpApiClientEventlet(object):
                  concurrent_connections=DEFAULT_CONCURRENT_CONNECTIONS,
                  use_https=True,
                  connect_timeout=DEFAULT_CONNECT_TIMEOUT,
-                 failover_time=DEFAULT_FAILOVER_TIME):
+                 failover_time=DEFAULT_FAILOVER_TIME,
+                 load_balancing=False):
         '''Constructor
 
         Args:
@@ -50,6 +51,9 @@ class NvpApiClientEventlet(object):
             concurrent_connections: total number of concurrent connections.
             use_https: whether or not to use https for requests.
             connect_timeout: connection timeout in seconds.
+            failover_time: seconds before a failed controller is used again.
+            load_balancing: spread requests across all the healthy
+                controllers instead of using one at a time.
         '''
         self._api_providers = set([tuple(p) for p in api_providers])
         self._user = user
@@ -58,10 +62,13 @@ class NvpApiClientEventlet(object):
         self._use_https = use_https
         self._connect_timeout = connect_timeout
         self._failover_time = failover_time
+        self._load_balancing = load_balancing
 
         # Connection pool is a queue. Head of the queue is the
         # connection pool with the highest priority.
         self._conn_pool = eventlet.queue.Queue()
+        # api provider -> its connection pool
+        self._provider_pools = {}
         for host, port, is_ssl in self._api_providers:
             provider_conn_pool = eventlet.queue.Queue()
             for i in range(concurrent_connections):
@@ -72,9 +79,17 @@ class NvpApiClientEventlet(object):
                 provider_conn_pool.put(conn)
 
             self._conn_pool.put(provider_conn_pool)
+            self._provider_pools[(host, port, is_ssl)] = provider_conn_pool
 
         self._active_conn_pool = self._conn_pool.get()
 
+        # The api provider the cluster last redirected a write to.
+        self._master = None
+        # api provider -> time of its next health probe, for the failed ones
+        self._failed_providers = {}
+        # Clients of redirect locations which are not api providers.
+        self._redirect_clients = {}
+
         self._cookie = None
         self._need_login = True
         self._doing_login_sem = eventlet.semaphore.Semaphore(1)
@@ -106,29 +121,43 @@ class NvpApiClientEventlet(object):
     def auth_cookie(self):
         return self._cookie
 
-    def acquire_connection(self):
+    def acquire_connection(self, is_write=False):
         '''Check out an available HTTPConnection instance.
 
         Blocks until a connection is available.
 
+        Args:
+            is_write: True if the request changes the configuration, in
+                which case it goes to the cluster's master when known.
+
         Returns: An available HTTPConnection instance or None if no
                  api_providers are configured.
         '''
         if not self._api_providers:
             return None
 
-        # The sleep time is to give controllers time to become consistent after
-        # there has been a change in the controller used as the api_provider.
-        now = time.time()
-        if now < getattr(self, '_issue_conn_barrier', now):
-            lg.info("acquire_connection() waiting for timer to expire.")
-            time.sleep(self._issue_conn_barrier - now)
-
-        if self._active_conn_pool.empty():
+        if self._load_balancing:
+            conn_pool = self._provider_pools[self._select_provider(is_write)]
+        else:
+            # The sleep time is to give controllers time to become
+            # consistent after there has been a change in the controller
+            # used as the api_provider.
+            now = time.time()
+            if now < getattr(self, '_issue_conn_barrier', now):
+                lg.info("acquire_connection() waiting for timer to expire.")
+                time.sleep(self._issue_conn_barrier - now)
+            conn_pool = self._active_conn_pool
+
+        if conn_pool.empty():
             lg.debug("Waiting to acquire an API client connection")
+        conn = self._checkout_connection(conn_pool)
+        lg.debug("API client connection %s acquired" % _conn_str(conn))
+        return conn
 
+    def _checkout_connection(self, conn_pool):
+        '''Get a connection from conn_pool, reconnecting if it was idle.'''
         # get() call is blocking.
-        conn = self._active_conn_pool.get()
+        conn = conn_pool.get()
         now = time.time()
         if getattr(conn, 'last_used', now) < now - self.CONN_IDLE_TIMEOUT:
             lg.info("Connection %s idle for %0.2f seconds; reconnecting."
@@ -136,12 +165,90 @@ class NvpApiClientEventlet(object):
             conn = self._create_connection(*self._conn_params(conn))
 
             # Stash conn pool so conn knows where to go when it releases.
-            conn.conn_pool = self._active_conn_pool
+            conn.conn_pool = conn_pool
 
         conn.last_used = now
-        lg.debug("API client connection %s acquired" % _conn_str(conn))
         return conn
 
+    def _select_provider(self, is_write):
+        '''Return the api provider a request should be sent to.
+
+        Writes go to the master when it is known and healthy. Otherwise
+        the healthy provider with the fewest outstanding requests is used.
+        '''
+        self._probe_failed_providers()
+        if (is_write and self._master is not None and
+                self._master not in self._failed_providers):
+            return self._master
+        providers = [p for p in self._provider_pools
+                     if p not in self._failed_providers]
+        if not providers:
+            # every provider failed, use them all until one comes back
+            providers = self._provider_pools.keys()
+        # the least outstanding requests, i.e. the most idle connections
+        return max(providers, key=lambda p: self._provider_pools[p].qsize())
+
+    def _probe_failed_providers(self):
+        now = time.time()
+        for provider, probe_time in self._failed_providers.items():
+            if probe_time <= now:
+                # a single probe at a time per provider
+                self._failed_providers[provider] = now + self._failover_time
+                eventlet.spawn_n(self._probe_provider, provider)
+
+    def _probe_provider(self, provider):
+        '''Bring a failed api provider back if it accepts connections.'''
+        conn = self._create_connection(*provider)
+        try:
+            conn.connect()
+        except Exception, e:
+            lg.info("API provider %s still unavailable: %s"
+                    % (_conn_str(conn), e))
+            return
+        finally:
+            conn.close()
+        lg.info("API provider %s is available again" % _conn_str(conn))
+        self._failed_providers.pop(provider, None)
+
+    def _find_provider(self, host, port, is_ssl):
+        for provider in self._api_providers:
+            if (provider[0] == host and str(provider[1]) == str(port) and
+                    provider[2] == is_ssl):
+                return provider
+        return None
+
+    def acquire_redirect_connection(self, location, is_write=False):
+        '''Check out a connection to the location of a redirect.
+
+        The pooled connections of a known api provider are reused, and the
+        provider is remembered as the master when a write was redirected
+        to it. Other locations get a client of their own, kept for the
+        next redirects.
+
+        Args:
+            location: a (host, port, is_ssl) tuple.
+            is_write: True if the redirected request is a write.
+
+        Returns: a tuple of an HTTPConnection instance and the
+                 authentication cookie to send with it.
+        '''
+        provider = self._find_provider(*location)
+        if provider is not None:
+            if is_write and self._master != provider:
+                lg.info("Sending writes to %s:%s" % provider[:2])
+                self._master = provider
+            conn = self._checkout_connection(self._provider_pools[provider])
+            return conn, self._cookie
+
+        api_client = self._redirect_clients.get(location)
+        if api_client is None:
+            api_client = NvpApiClientEventlet(
+                [location], self._user, self._password,
+                use_https=location[2])
+            self._redirect_clients[location] = api_client
+        api_client.wait_for_login()
+        return api_client.acquire_connection(), api_client.auth_cookie
+
     def release_connection(self, http_conn, bad_state=False):
         '''Mark HTTPConnection instance as available for check-out.
 
@@ -151,7 +258,12 @@ class NvpApiClientEventlet(object):
             bad_state: True if http_conn is known to be in a bad state
                 (e.g. connection fault.)
         '''
-        if self._conn_params(http_conn) not in self._api_providers:
+        conn_params = self._conn_params(http_conn)
+        if conn_params in self._redirect_clients:
+            self._redirect_clients[conn_params].release_connection(
+                http_conn, bad_state)
+            return
+        if conn_params not in self._api_providers:
             lg.debug("Released connection '%s' is no longer an API provider "
                      "for the cluster" % _conn_str(http_conn))
             return
@@ -166,7 +278,13 @@ class NvpApiClientEventlet(object):
             http_conn.conn_pool = conn_pool
             conn_pool.put(http_conn)
 
-            if self._active_conn_pool == http_conn.conn_pool:
+            if self._load_balancing:
+                # other providers take its requests until a probe succeeds
+                self._failed_providers.setdefault(
+                    conn_params, time.time() + self._failover_time)
+                if self._master == conn_params:
+                    self._master = None
+            elif self._active_conn_pool == http_conn.conn_pool:
                 # Get next connection from the connection pool and make it
                 # active.
                 lg.info("API connection fault changing active_conn_pool.")
@@ -13,7 +13,6 @@
 #    under the License.
 
 
-import client_eventlet
 import eventlet
 import httplib
 import urllib
@@ -134,7 +133,8 @@ class NvpApiRequestEventlet:
         return "%s %s/%s" % (self._method, _conn_str(conn), url)
 
     def _issue_request(self):
-        conn = self._api_client.acquire_connection()
+        conn = self._api_client.acquire_connection(
+            is_write=self._method != "GET")
         if conn is None:
             error = Exception("No API connections available")
             self._request_error = error
@@ -236,18 +236,25 @@ class NvpApiRequestEventlet:
             lg.warn("Received malformed redirect location: %s" % url)
             return (conn, None)         # case 3
         # case 2, redirect location includes a scheme
-        # so setup a new connection and authenticate
+        # so switch to a connection to that location
         use_https = result.scheme == "https"
-        api_providers = [(result.hostname, result.port, use_https)]
-        api_client = client_eventlet.NvpApiClientEventlet(
-            api_providers, self._api_client.user, self._api_client.password,
-            use_https=use_https)
-        api_client.wait_for_login()
-        if api_client.auth_cookie:
-            self._headers["Cookie"] = api_client.auth_cookie
-        else:
-            self._headers["Cookie"] = ""
-        conn = api_client.acquire_connection()
+        port = result.port
+        if port is None:
+            port = use_https and httplib.HTTPS_PORT or httplib.HTTP_PORT
+        location = (result.hostname, port, use_https)
+        # keep the connection when it already goes to that location,
+        # rather than waiting on the pool it would be released to
+        if self._api_client._conn_params(conn) != location:
+            # conn is only released once the new connection is acquired,
+            # until then _issue_request releases it if the acquire fails
+            new_conn, cookie = self._api_client.acquire_redirect_connection(
+                location, is_write=self._method != "GET")
+            self._api_client.release_connection(conn)
+            conn = new_conn
+            if cookie:
+                self._headers["Cookie"] = cookie
+            else:
+                self._headers["Cookie"] = ""
         if result.query:
             url = "%s?%s" % (result.path, result.query)
         else:
@@ -0,0 +1,86 @@
+# Copyright 2012 Nicira Networks, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import eventlet
+
+
+class TTLCache(object):
+    '''A bounded mapping whose entries expire after ttl seconds.
+
+    When the cache is full, expired entries are dropped first, then the
+    least recently used one. The cache may be shared by green threads.
+    '''
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        # key -> [value, expiry time, last use]
+        self._entries = {}
+        self._uses = 0
+        self._sem = eventlet.semaphore.Semaphore(1)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''Return the value of key, or None if it is missing or expired.'''
+        self._sem.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._uses += 1
+            entry[2] = self._uses
+            return entry[0]
+        finally:
+            self._sem.release()
+
+    def set(self, key, value):
+        self._sem.acquire()
+        try:
+            if key not in self._entries and \
+                    len(self._entries) >= self.max_size:
+                self._evict()
+            self._uses += 1
+            self._entries[key] = [value, time.time() + self.ttl, self._uses]
+        finally:
+            self._sem.release()
+
+    def invalidate(self, key):
+        self._sem.acquire()
+        try:
+            self._entries.pop(key, None)
+        finally:
+            self._sem.release()
+
+    def clear(self):
+        self._sem.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._sem.release()
+
+    def _evict(self):
+        now = time.time()
+        for key, entry in self._entries.items():
+            if entry[1] <= now:
+                del self._entries[key]
+        if len(self._entries) >= self.max_size:
+            oldest = min(self._entries, key=lambda k: self._entries[k][2])
+            del self._entries[oldest]
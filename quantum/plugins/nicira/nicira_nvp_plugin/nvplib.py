@@ -15,13 +15,28 @@
 # @author: Brad Hall, Nicira Networks, Inc.
 
 from quantum.common import exceptions as exception
+import eventlet
 import json
 import logging
 import NvpApiClient
+import nvp_cache
 
 LOG = logging.getLogger("nvplib")
 LOG.setLevel(logging.INFO)
 
+# Maximum number of logical switches whose owner and name are cached, and
+# seconds after which an entry is read again from the controller, so that
+# changes made behind the plugin's back are eventually noticed.
+LSWITCH_CACHE_SIZE = 10000
+LSWITCH_CACHE_TTL = 60
+
+# lswitch uuid -> (tenant id, display name)
+lswitch_cache = nvp_cache.TTLCache(LSWITCH_CACHE_SIZE, LSWITCH_CACHE_TTL)
+
+# Requests of a do_multiple_requests() call in flight at once. The number
+# of connections of the api client bounds it as well.
+MAX_CONCURRENT_REQUESTS = 10
+
 
 def do_single_request(*args, **kwargs):
     """Issue a request to a specified controller if specified via kwargs
@@ -31,6 +46,28 @@ def do_single_request(*args, **kwargs):
     return controller.api_client.request(*args)
 
 
+def do_multiple_requests(requests, controller,
+                         concurrency=MAX_CONCURRENT_REQUESTS):
+    """Issue independent requests to a controller concurrently.
+
+    :param requests: a list of (method, uri) or (method, uri, body) tuples.
+    :param concurrency: maximum number of requests in flight at once.
+    :returns: a list with, for every request in order, its response or the
+        NvpApiClient.NvpApiException it raised, for the caller to map to a
+        quantum exception.
+    """
+    def issue(request):
+        try:
+            return do_single_request(*request, controller=controller)
+        except NvpApiClient.NvpApiException as e:
+            return e
+
+    LOG.debug("Issuing %d requests to controller: %s" % (len(requests),
+                                                         controller.name))
+    pool = eventlet.GreenPool(concurrency)
+    return list(pool.imap(issue, requests))
+
+
 def check_default_transport_zone(c):
     """Make sure the default transport zone specified in the config exists"""
     msg = []
@@ -49,11 +86,33 @@ def check_default_transport_zone(c):
 
 def check_tenant(controller, net_id, tenant_id):
     """Return true if the tenant "owns" this network"""
-    net = get_network(controller, net_id)
-    for t in net["tags"]:
-        if t["scope"] == "os_tid" and t["tag"] == tenant_id:
-            return True
-    return False
+    owner, name = get_lswitch_info(controller, net_id)
+    return owner == tenant_id
+
+
+def _lswitch_info(lswitch):
+    owner = None
+    for t in lswitch.get("tags") or []:
+        if t["scope"] == "os_tid":
+            owner = t["tag"]
+    return owner, lswitch["display_name"]
+
+
+def _cache_lswitch(lswitch):
+    """Remember the owner and name of an lswitch returned by NVP"""
+    lswitch_cache.set(lswitch["uuid"], _lswitch_info(lswitch))
+
+
+def get_lswitch_info(controller, net_id):
+    """Return the (tenant id, display name) of a network.
+
+    Served from lswitch_cache when possible, so that checking the tenant
+    of a network usually costs no request to the controller.
+    """
+    info = lswitch_cache.get(net_id)
+    if info is None:
+        info = _lswitch_info(get_network(controller, net_id))
+    return info
 
 # -------------------------------------------------------------------
 # Network functions
@@ -70,6 +129,7 @@ def get_network(controller, net_id):
     except NvpApiClient.NvpApiException as e:
         raise exception.QuantumException()
     LOG.debug("Got network \"%s\": %s" % (net_id, network))
+    _cache_lswitch(network)
     return network
 
 
@@ -89,6 +149,7 @@ def create_lswitch(controller, lswitch_obj):
         raise exception.QuantumException()
 
     r = json.loads(resp_obj)
+    _cache_lswitch(r)
     d = {}
     d["net-id"] = r["uuid"]
     d["net-name"] = r["display_name"]
@@ -109,6 +170,9 @@ def update_network(controller, network, **kwargs):
         raise exception.NetworkNotFound(net_id=network)
     except NvpApiClient.NvpApiException as e:
         raise exception.QuantumException()
+    finally:
+        # the name is read again by the next request needing it
+        lswitch_cache.invalidate(network)
 
     obj = json.loads(resp_obj)
     return obj
@@ -127,6 +191,7 @@ def get_all_networks(controller, tenant_id, networks):
         return []
     lswitches = json.loads(resp_obj)["results"]
     for lswitch in lswitches:
+        _cache_lswitch(lswitch)
         net_id = lswitch["uuid"]
         if net_id not in [x["net-id"] for x in networks]:
             networks.append({"net-id": net_id,
@@ -146,6 +211,9 @@ def query_networks(controller, tenant_id, fields="*", tags=None):
     if not resp_obj:
         return []
     lswitches = json.loads(resp_obj)["results"]
+    if fields == "*":
+        for lswitch in lswitches:
+            _cache_lswitch(lswitch)
     nets = [{'net-id': lswitch["uuid"],
              'net-name': lswitch["display_name"]}
              for lswitch in lswitches]
@@ -157,15 +225,16 @@ def delete_network(controller, network):
 
 
 def delete_networks(controller, networks):
+    results = do_multiple_requests(
+        [("DELETE", "/ws.v1/lswitch/%s" % network) for network in networks],
+        controller)
     for network in networks:
-        path = "/ws.v1/lswitch/%s" % network
-
-        try:
-            do_single_request("DELETE", path, controller=controller)
-        except NvpApiClient.ResourceNotFound as e:
-            LOG.error("Network not found, Error: %s" % str(e))
+        lswitch_cache.invalidate(network)
+    for network, result in zip(networks, results):
+        if isinstance(result, NvpApiClient.ResourceNotFound):
+            LOG.error("Network not found, Error: %s" % str(result))
             raise exception.NetworkNotFound(net_id=network)
-        except NvpApiClient.NvpApiException as e:
+        if isinstance(result, NvpApiClient.NvpApiException):
             raise exception.QuantumException()
 
 
@@ -193,12 +262,8 @@ def create_network(tenant_id, net_name, **kwargs):
 
 
 def get_port_stats(controller, network_id, port_id):
-    try:
-        do_single_request("GET", "/ws.v1/lswitch/%s" % (network_id),
-                          controller=controller)
-    except NvpApiClient.ResourceNotFound as e:
-        LOG.error("Network not found, Error: %s" % str(e))
-        raise exception.NetworkNotFound(net_id=network_id)
+    # Make sure the network exists first
+    get_lswitch_info(controller, network_id)
     try:
         path = "/ws.v1/lswitch/%s/lport/%s/statistic" % (network_id, port_id)
         resp = do_single_request("GET", path, controller=controller)
@@ -221,13 +286,18 @@ def check_port_state(state):
         raise exception.StateInvalid(port_state=state)
 
 
-def query_ports(controller, network, relations=None, fields="*", filters=None):
+def _query_ports_uri(network, relations=None, fields="*", filters=None):
     uri = "/ws.v1/lswitch/" + network + "/lport?"
     if relations:
         uri += "relations=%s" % relations
     uri += "&fields=%s" % fields
     if filters and "attachment" in filters:
         uri += "&attachment_vif_uuid=%s" % filters["attachment"]
+    return uri
+
+
+def query_ports(controller, network, relations=None, fields="*", filters=None):
+    uri = _query_ports_uri(network, relations, fields, filters)
     try:
         resp_obj = do_single_request("GET", uri,
           controller=controller)
@@ -239,6 +309,31 @@ def query_ports(controller, network, relations=None, fields="*", filters=None):
     return json.loads(resp_obj)["results"]
 
 
+def query_network_ports(controller, network, relations=None, fields="*",
+                        filters=None):
+    """Return the (tenant id, display name) of a network and its ports.
+
+    The lswitch is read along with its ports when it is not cached.
+    """
+    info = lswitch_cache.get(network)
+    if info is not None:
+        return info, query_ports(controller, network, relations, fields,
+                                 filters)
+    lswitch, lports = do_multiple_requests(
+        [("GET", "/ws.v1/lswitch/%s" % network),
+         ("GET", _query_ports_uri(network, relations, fields, filters))],
+        controller)
+    for result in (lswitch, lports):
+        if isinstance(result, NvpApiClient.ResourceNotFound):
+            LOG.error("Network not found, Error: %s" % str(result))
+            raise exception.NetworkNotFound(net_id=network)
+        if isinstance(result, NvpApiClient.NvpApiException):
+            raise exception.QuantumException()
+    lswitch = json.loads(lswitch)
+    _cache_lswitch(lswitch)
+    return _lswitch_info(lswitch), json.loads(lports)["results"]
+
+
 def delete_port(controller, network, port):
     uri = "/ws.v1/lswitch/" + network + "/lport/" + port
     try:
@@ -255,10 +350,15 @@ def delete_all_ports(controller, ls_uuid):
       "/ws.v1/lswitch/%s/lport?fields=uuid" % ls_uuid,
       controller=controller)
     res = json.loads(res)
-    for r in res["results"]:
-        do_single_request("DELETE",
-          "/ws.v1/lswitch/%s/lport/%s" % (ls_uuid, r["uuid"]),
-          controller=controller)
+    results = do_multiple_requests(
+        [("DELETE", "/ws.v1/lswitch/%s/lport/%s" % (ls_uuid, r["uuid"]))
+         for r in res["results"]], controller)
+    for result in results:
+        # ports deleted in the meantime are fine
+        if isinstance(result, NvpApiClient.NvpApiException) and \
+                not isinstance(result, NvpApiClient.ResourceNotFound):
+            LOG.error("Unable to delete port, Error: %s" % str(result))
+            raise exception.QuantumException()
 
 
 def get_port(controller, network, port, relations=None):
@@ -378,14 +478,7 @@ def create_port(tenant, network, port_init_state, **params):
 def get_port_status(controller, lswitch_id, port_id):
     """Retrieve the operational status of the port"""
     # Make sure the network exists first
-    try:
-        do_single_request("GET", "/ws.v1/lswitch/%s" % (lswitch_id),
-                          controller=controller)
-    except NvpApiClient.ResourceNotFound as e:
-        LOG.error("Network not found, Error: %s" % str(e))
-        raise exception.NetworkNotFound(net_id=lswitch_id)
-    except NvpApiClient.NvpApiException as e:
-        raise exception.QuantumException()
+    get_lswitch_info(controller, lswitch_id)
     try:
         r = do_single_request("GET",
             "/ws.v1/lswitch/%s/lport/%s/status" % (lswitch_id, port_id),
@@ -235,5 +235,19 @@ CONCURRENT_CONNECTIONS = 5
         cluster1, plugin_config = parse_config(cp)
         self.assertTrue(plugin_config['concurrent_connections'] == '5')
 
+    def test_load_balancing(self):
+        config = StringIO.StringIO('''
+[DEFAULT]
+[NVP]
+DEFAULT_TZ_UUID = <default uuid>
+NVP_CONTROLLER_CONNECTIONS = CONNECTION1
+CONNECTION1 = 10.0.0.1:4242:admin:admin:42:43:44:45
+LOAD_BALANCING = True
+''')
+        cp = ConfigParser.ConfigParser()
+        cp.readfp(config)
+        cluster1, plugin_config = parse_config(cp)
+        self.assertTrue(plugin_config['load_balancing'] == 'True')
+
 if __name__ == '__main__':
     unittest.main()
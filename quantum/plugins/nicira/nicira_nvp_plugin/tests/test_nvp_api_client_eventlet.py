@@ -0,0 +1,123 @@
+# Copyright (C) 2009-2012 Nicira Networks, Inc. All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+
+# System
+import socket
+import time
+import unittest
+
+# Third party
+import eventlet
+from mock import patch
+
+# Local
+import nicira_nvp_plugin.api_client.client_eventlet as nace
+
+PROVIDERS = [("10.0.0.1", 443, True), ("10.0.0.2", 443, True),
+             ("10.0.0.3", 443, True)]
+
+
+class NvpApiClientBalancingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.client = nace.NvpApiClientEventlet(
+            PROVIDERS, "admin", "admin", concurrent_connections=2,
+            failover_time=60, load_balancing=True)
+
+    def _provider(self, conn):
+        return self.client._conn_params(conn)
+
+    def test_reads_spread_across_providers(self):
+        conns = [self.client.acquire_connection() for i in range(3)]
+        self.assertEqual(set(self._provider(c) for c in conns),
+                         set(PROVIDERS))
+
+    def test_least_outstanding_requests(self):
+        busy = self.client.acquire_connection()
+        idle = [self.client.acquire_connection() for i in range(2)]
+        self.client.release_connection(idle[0])
+        self.client.release_connection(idle[1])
+        # the other two providers have no outstanding request
+        for i in range(4):
+            conn = self.client.acquire_connection()
+            self.assertNotEqual(self._provider(conn), self._provider(busy))
+            self.client.release_connection(conn)
+
+    def test_writes_sent_to_master(self):
+        conn, cookie = self.client.acquire_redirect_connection(
+            ("10.0.0.2", 443, True), is_write=True)
+        self.assertEqual(self._provider(conn), PROVIDERS[1])
+        self.client.release_connection(conn)
+        conns = [self.client.acquire_connection(is_write=True)
+                 for i in range(2)]
+        self.assertEqual([self._provider(c) for c in conns],
+                         [PROVIDERS[1]] * 2)
+        # reads still go to the least busy providers
+        conn = self.client.acquire_connection()
+        self.assertNotEqual(self._provider(conn), PROVIDERS[1])
+
+    def test_failed_provider_avoided(self):
+        self.client.acquire_redirect_connection(PROVIDERS[0], is_write=True)
+        conn = self.client.acquire_connection(is_write=True)
+        self.assertEqual(self._provider(conn), PROVIDERS[0])
+        self.client.release_connection(conn, bad_state=True)
+        for i in range(4):
+            conn = self.client.acquire_connection(is_write=True)
+            self.assertNotEqual(self._provider(conn), PROVIDERS[0])
+            self.client.release_connection(conn)
+
+    def test_redirect_client_reused(self):
+        location = ("10.9.9.9", 443, True)
+        with patch.object(nace.NvpApiClientEventlet, "wait_for_login"):
+            for i in range(5):
+                conn, cookie = self.client.acquire_redirect_connection(
+                    location)
+                self.client.release_connection(conn)
+        self.assertEqual(self.client._redirect_clients.keys(), [location])
+        pool = self.client._redirect_clients[location]._active_conn_pool
+        self.assertEqual(pool.qsize(), nace.DEFAULT_CONCURRENT_CONNECTIONS)
+
+    def test_redirect_connection_idle_reconnect(self):
+        conn, cookie = self.client.acquire_redirect_connection(PROVIDERS[0])
+        conn.last_used = time.time() - self.client.CONN_IDLE_TIMEOUT - 1
+        self.client.release_connection(conn)
+        pool = self.client._provider_pools[PROVIDERS[0]]
+        conns = [self.client.acquire_redirect_connection(PROVIDERS[0])[0]
+                 for i in range(pool.qsize())]
+        self.assertFalse(conn in conns)
+        self.assertEqual(set(self._provider(c) for c in conns),
+                         set([PROVIDERS[0]]))
+
+
+class NvpApiClientProbeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.provider = ("127.0.0.1", self.listener.getsockname()[1], False)
+        self.client = nace.NvpApiClientEventlet(
+            [self.provider, ("10.0.0.1", 443, True)], "admin", "admin",
+            failover_time=0, load_balancing=True)
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_probe_brings_provider_back(self):
+        self.client._failed_providers[self.provider] = time.time()
+        conn = self.client.acquire_connection()
+        self.assertNotEqual(self.client._conn_params(conn), self.provider)
+        eventlet.sleep(0.1)
+        self.assertEqual(self.client._failed_providers, {})
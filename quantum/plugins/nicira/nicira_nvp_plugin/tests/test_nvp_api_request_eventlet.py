@@ -282,6 +282,25 @@ class NvpApiRequestEventletTest(unittest.TestCase):
                 ('location', '/path?q=1')])
             self.assertTrue(retval is not None)
 
+    def test_redirect_params_failed_acquire_keeps_conn(self):
+        self.client.acquire_redirect_connection = Mock()
+        self.client.acquire_redirect_connection.side_effect = Exception()
+        self.client.release_connection = Mock()
+        myconn = Mock()
+        self.assertRaises(Exception, self.req._redirect_params, myconn,
+                          [('location', 'https://host:1/path')])
+        # conn is still the caller's to release
+        self.assertFalse(self.client.release_connection.called)
+
+    def test_redirect_params_same_location_keeps_conn(self):
+        self.client.acquire_redirect_connection = Mock()
+        myconn = self.client._create_connection("host", 1, True)
+        (conn, retval) = self.req._redirect_params(
+            myconn, [('location', 'https://host:1/path')])
+        self.assertTrue(conn is myconn)
+        self.assertEqual(retval, '/path')
+        self.assertFalse(self.client.acquire_redirect_connection.called)
+
     def test_handle_request_auto_login(self):
         self.req._auto_login = True
         self.req._api_client = Mock()
@@ -0,0 +1,222 @@
+# Copyright 2012 Nicira Networks, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import time
+import unittest
+
+import eventlet
+
+from quantum.common import exceptions as exception
+from nicira_nvp_plugin.QuantumPlugin import NvpPlugin
+from nicira_nvp_plugin import NvpApiClient
+from nicira_nvp_plugin import nvp_cache
+from nicira_nvp_plugin import nvplib
+
+
+class FakeNvpApi(object):
+    '''Logical switches and ports of an NVP controller, in memory.'''
+
+    def __init__(self, latency=0):
+        self.lswitches = {}
+        self.lports = {}
+        self.requests = []
+        self.next_uuid = 0
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _uuid(self):
+        self.next_uuid += 1
+        return "%08d-0000-0000-0000-000000000000" % self.next_uuid
+
+    def request(self, method, url, body="", content_type="application/json"):
+        self.requests.append((method, url))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            eventlet.sleep(self.latency)
+            return self._handle(method, url, body)
+        finally:
+            self.in_flight -= 1
+
+    def _handle(self, method, url, body):
+        path = url.split("?")[0].split("/")[2:]
+        if path == ["lswitch"] and method == "POST":
+            lswitch = json.loads(body)
+            lswitch["uuid"] = self._uuid()
+            self.lswitches[lswitch["uuid"]] = lswitch
+            return json.dumps(lswitch)
+        if path[1] not in self.lswitches:
+            raise NvpApiClient.ResourceNotFound()
+        lswitch = self.lswitches[path[1]]
+        if len(path) == 2:
+            if method == "DELETE":
+                del self.lswitches[path[1]]
+                return ""
+            if method == "PUT":
+                lswitch.update(json.loads(body))
+            return json.dumps(lswitch)
+        if len(path) == 3:
+            if method == "POST":
+                lport = json.loads(body)
+                lport["uuid"] = self._uuid()
+                self.lports[lport["uuid"]] = lport
+                return json.dumps(lport)
+            return json.dumps({"results": [
+                {"uuid": uuid, "_relations": {"LogicalPortAttachment": {}}}
+                for uuid in self.lports]})
+        if path[3] not in self.lports:
+            raise NvpApiClient.ResourceNotFound()
+        lport = self.lports[path[3]]
+        if method == "DELETE":
+            del self.lports[path[3]]
+            return ""
+        if path[4:] == ["status"]:
+            return json.dumps({"link_status_up": True})
+        if method == "PUT":
+            lport.update(json.loads(body))
+        return json.dumps(lport)
+
+
+class FakeController(object):
+    name = "fake"
+    default_tz_uuid = "tz"
+
+    def __init__(self):
+        self.api_client = FakeNvpApi()
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def test_expiry(self):
+        cache = nvp_cache.TTLCache(10, 0.01)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.02)
+        self.assertEqual(cache.get("a"), None)
+
+    def test_least_recently_used_evicted(self):
+        cache = nvp_cache.TTLCache(2, 60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+
+class LswitchCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        nvplib.lswitch_cache.clear()
+        self.controller = FakeController()
+        self.api = self.controller.api_client
+        self.plugin = NvpPlugin.__new__(NvpPlugin)
+        self.plugin.controller = self.controller
+        self.net_id = self.plugin.create_network("tenant", "net")["net-id"]
+        self.api.requests = []
+
+    def test_check_tenant_cached(self):
+        self.assertTrue(nvplib.check_tenant(self.controller, self.net_id,
+                                            "tenant"))
+        self.assertFalse(nvplib.check_tenant(self.controller, self.net_id,
+                                             "other"))
+        self.assertEqual(self.api.requests, [])
+
+    def test_miss_reads_lswitch(self):
+        nvplib.lswitch_cache.clear()
+        details = self.plugin.get_network_details("tenant", self.net_id)
+        self.assertEqual(details["net-name"], "net")
+        # the lswitch and its ports
+        self.assertEqual(len(self.api.requests), 2)
+
+    def test_update_invalidates(self):
+        self.plugin.update_network("tenant", self.net_id, name="renamed")
+        details = self.plugin.get_network_details("tenant", self.net_id)
+        self.assertEqual(details["net-name"], "renamed")
+
+    def test_delete_invalidates(self):
+        self.plugin.delete_network("tenant", self.net_id)
+        self.assertRaises(exception.NetworkNotFound,
+                          self.plugin.get_network_details, "tenant",
+                          self.net_id)
+
+    def test_port_round_trips(self):
+        port_id = self.plugin.create_port("tenant", self.net_id,
+                                          "ACTIVE")["port-id"]
+        # creating the lport and reading its status
+        self.assertEqual(len(self.api.requests), 2)
+        self.api.requests = []
+        self.plugin.plug_interface("tenant", self.net_id, port_id, "vif")
+        self.assertEqual(len(self.api.requests), 1)
+
+
+class MultipleRequestsTest(unittest.TestCase):
+
+    def setUp(self):
+        nvplib.lswitch_cache.clear()
+        self.controller = FakeController()
+        self.api = self.controller.api_client
+        self.plugin = NvpPlugin.__new__(NvpPlugin)
+        self.plugin.controller = self.controller
+
+    def test_results_in_order(self):
+        net_id = self.plugin.create_network("tenant", "net")["net-id"]
+        results = nvplib.do_multiple_requests(
+            [("GET", "/ws.v1/lswitch/missing"),
+             ("GET", "/ws.v1/lswitch/%s" % net_id)], self.controller)
+        self.assertTrue(isinstance(results[0],
+                                   NvpApiClient.ResourceNotFound))
+        self.assertEqual(json.loads(results[1])["uuid"], net_id)
+
+    def test_concurrency_cap(self):
+        self.api.latency = 0.01
+        nvplib.do_multiple_requests(
+            [("GET", "/ws.v1/lswitch/missing")] * 20, self.controller,
+            concurrency=4)
+        self.assertEqual(self.api.max_in_flight, 4)
+
+    def test_delete_all_ports(self):
+        net_id = self.plugin.create_network("tenant", "net")["net-id"]
+        for i in range(50):
+            nvplib.create_port("tenant", net_id, "ACTIVE",
+                               controller=self.controller)
+        self.api.latency = 0.01
+        nvplib.delete_all_ports(self.controller, net_id)
+        # the deletes overlap, up to the default concurrency
+        self.assertTrue(1 < self.api.max_in_flight <=
+                        nvplib.MAX_CONCURRENT_REQUESTS)
+        self.assertEqual(self.api.lports, {})
+
+    def test_delete_networks_not_found(self):
+        net_id = self.plugin.create_network("tenant", "net")["net-id"]
+        self.assertRaises(exception.NetworkNotFound, nvplib.delete_networks,
+                          self.controller, ["missing", net_id])
+        # the other network is deleted all the same
+        self.assertEqual(self.api.lswitches, {})
+
+    def test_network_details_on_miss(self):
+        net_id = self.plugin.create_network("tenant", "net")["net-id"]
+        nvplib.lswitch_cache.clear()
+        self.api.latency = 0.01
+        self.api.requests = []
+        self.plugin.get_network_details("tenant", net_id)
+        # the lswitch and its ports are read at once
+        self.assertEqual(len(self.api.requests), 2)
+        self.assertEqual(self.api.max_in_flight, 2)
+        self.assertRaises(exception.NetworkNotFound,
+                          self.plugin.get_network_details, "other", net_id)
@@ -20,15 +20,26 @@
 # @author: Dave Lapsley, Nicira Networks, Inc.
 
 import ConfigParser
+import itertools
+import json
 import logging as LOG
-import shlex
+import os
+import socket
+import struct
 import sys
 import time
 import signal
 
 from optparse import OptionParser
 from sqlalchemy.ext.sqlsoup import SqlSoup
-from subprocess import *
+
+from quantum.agent import database
+from quantum.agent import metrics
+from quantum.agent import notifier
+from quantum.agent import ovsdb
+from quantum.agent import rootwrap
+from quantum.agent import status
+from quantum.agent import workers
 
 
 # Global constants.
@@ -38,7 +49,22 @@ OP_STATUS_DOWN = "DOWN"
 # A placeholder for dead vlans.
 DEAD_VLAN_TAG = "4095"
 
-REFRESH_INTERVAL = 2
+# Every flow installed by the agent carries a cookie made of this prefix
+# and of the local vlan the flow belongs to (0 for bridge-wide flows), so
+# the agent can recognize its own flows in "ovs-ofctl dump-flows" output.
+COOKIE_PREFIX = 0x5154 << 48
+COOKIE_PREFIX_MASK = 0xffff << 48
+
+# Fields of "ovs-ofctl dump-flows" output that are not part of the match.
+FLOW_STATS_FIELDS = ("duration", "table", "n_packets", "n_bytes",
+                     "idle_age", "hard_age", "idle_timeout", "hard_timeout")
+
+# Interval of the full rescan done even when the ovsdb monitor and the
+# plugin notifications are both available.
+RESYNC_INTERVAL = 60
+
+# Threads running independent commands, such as XAPI lookups.
+DEFAULT_COMMAND_WORKERS = 4
 
 
 # A class to represent a VIF (i.e., a port that has 'iface-id' and 'vif-mac'
@@ -57,64 +83,214 @@ class VifPort:
           ", ofport=" + self.ofport + ", bridge name = " + self.switch.br_name
 
 
+def flow_cookie(vlan=0):
+    """Return the cookie of the flows belonging to a local vlan."""
+    return COOKIE_PREFIX | int(vlan)
+
+
+def parse_match(match):
+    """Return a normalized, hashable form of a flow match string.
+
+    Numbers are compared by value, since ovs-ofctl prints some fields such
+    as tun_id in hex.
+    """
+    fields = set()
+    for field in match.split(","):
+        field = field.strip()
+        if not field:
+            continue
+        key, sep, value = field.partition("=")
+        if sep:
+            try:
+                value = int(value, 0)
+            except ValueError:
+                value = value.lower()
+        else:
+            value = None
+        fields.add((key, value))
+    return frozenset(fields)
+
+
+def parse_actions(actions):
+    """Return a normalized, hashable form of a flow actions string.
+
+    As in parse_match(), numbers are compared by value. Names are not case
+    sensitive, since ovs-ofctl prints "normal" as "NORMAL".
+    """
+    parsed = []
+    action = ""
+    depth = 0
+    # commas also separate the arguments of actions such as resubmit(,1)
+    for char in actions + ",":
+        if char == "," and not depth:
+            action = action.strip()
+            if action:
+                key, sep, value = action.partition(":")
+                try:
+                    value = int(value, 0)
+                except ValueError:
+                    value = value.lower()
+                parsed.append((key.lower(), value))
+            action = ""
+            continue
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        action += char
+    return tuple(parsed)
+
+
+def parse_flow(line):
+    """Parse a line of "ovs-ofctl dump-flows" output.
+
+    Returns a dict with the cookie, priority, match (as a string usable
+    with "del-flows --strict") and actions of the flow, or None if the
+    line does not describe a flow.
+    """
+    fields, sep, actions = line.strip().partition(" actions=")
+    if not sep:
+        return None
+    flow = {"cookie": 0, "priority": 32768, "actions": actions}
+    match = []
+    for field in fields.replace(", ", ",").split(","):
+        key, _, value = field.partition("=")
+        if key == "cookie":
+            flow["cookie"] = int(value, 0)
+        elif key == "priority":
+            flow["priority"] = int(value)
+        elif key not in FLOW_STATS_FIELDS:
+            match.append(field)
+    flow["match"] = ",".join(match)
+    return flow
+
+
 class OVSBridge:
     def __init__(self, br_name, root_helper):
         self.br_name = br_name
         self.root_helper = root_helper
-
-    def run_cmd(self, args):
-        cmd = shlex.split(self.root_helper) + args
-        LOG.debug("## running command: " + " ".join(cmd))
-        p = Popen(cmd, stdout=PIPE)
-        retval = p.communicate()[0]
-        if p.returncode == -(signal.SIGALRM):
-            LOG.debug("## timeout running command: " + " ".join(cmd))
+        # While defer_apply is set, database changes and flow mods are
+        # queued and only sent by apply_deferred(), as a single ovs-vsctl
+        # transaction and a few bulk ovs-ofctl calls.
+        self.defer_apply = False
+        self.deferred_vsctl = []
+        self.deferred_flows = []
+        # (cookie, priority, match) -> flow string of the flows added by
+        # the agent, i.e. the flows reconcile_flows() makes sure exist
+        self.desired_flows = {}
+        # names of the interfaces the cached port list was read for
+        self._interface_names = None
+        self._port_names = None
+
+    def run_cmd(self, args, process_input=None):
+        LOG.debug("## running command: " + " ".join(args))
+        returncode, retval, stderr = rootwrap.execute(self.root_helper, args,
+                                                      process_input)
+        if returncode == -(signal.SIGALRM):
+            LOG.debug("## timeout running command: " + " ".join(args))
+        if stderr:
+            LOG.debug("## command stderr: %s" % stderr)
         return retval
 
     def run_vsctl(self, args):
         full_args = ["ovs-vsctl", "--timeout=2"] + args
         return self.run_cmd(full_args)
 
+    def vsctl_command(self, args):
+        """Run a single ovs-vsctl command, or queue it if deferring."""
+        if self.defer_apply:
+            self.deferred_vsctl.append(args)
+        else:
+            self.run_vsctl(["--"] + args)
+
+    def defer_apply_on(self):
+        self.defer_apply = True
+
+    def defer_apply_off(self):
+        self.apply_deferred()
+        self.defer_apply = False
+
+    def apply_deferred(self):
+        """Send the queued commands and flow mods to Open vSwitch.
+
+        The ovs-vsctl commands are run as one transaction. Flow mods are
+        fed to "ovs-ofctl add-flows" and "ovs-ofctl del-flows" through
+        stdin, one call per run of consecutive mods of the same kind so
+        that their order is preserved.
+        """
+        if self.deferred_vsctl:
+            args = []
+            for command in self.deferred_vsctl:
+                args += ["--"] + command
+            self.deferred_vsctl = []
+            self.run_vsctl(args)
+        flows = self.deferred_flows
+        self.deferred_flows = []
+        for action, mods in itertools.groupby(flows, lambda mod: mod[0]):
+            flow_strs = "".join(flow_str + "\n" for _, flow_str in mods)
+            self.run_ofctl("%s-flows" % action, ["-"], flow_strs)
+
+    def ensure_bridge(self):
+        self.run_vsctl(["--", "--may-exist", "add-br", self.br_name])
+
     def reset_bridge(self):
-        self.run_vsctl(["--", "--if-exists", "del-br", self.br_name])
-        self.run_vsctl(["add-br", self.br_name])
+        self.run_vsctl(["--", "--if-exists", "del-br", self.br_name,
+                        "--", "add-br", self.br_name])
 
     def delete_port(self, port_name):
-        self.run_vsctl(["--", "--if-exists", "del-port", self.br_name,
-          port_name])
+        self.vsctl_command(["--if-exists", "del-port", self.br_name,
+                            port_name])
 
     def set_db_attribute(self, table_name, record, column, value):
         args = ["set", table_name, record, "%s=%s" % (column, value)]
-        self.run_vsctl(args)
+        self.vsctl_command(args)
 
     def clear_db_attribute(self, table_name, record, column):
         args = ["clear", table_name, record, column]
-        self.run_vsctl(args)
+        self.vsctl_command(args)
 
-    def run_ofctl(self, cmd, args):
+    def run_ofctl(self, cmd, args, process_input=None):
         full_args = ["ovs-ofctl", cmd, self.br_name] + args
-        return self.run_cmd(full_args)
+        return self.run_cmd(full_args, process_input)
 
     def remove_all_flows(self):
+        # pending flow mods would be removed right away
+        self.deferred_flows = []
+        self.desired_flows = {}
         self.run_ofctl("del-flows", [])
 
     def get_port_ofport(self, port_name):
         return self.db_get_val("Interface", port_name, "ofport")
 
+    def mod_flow(self, action, flow_str):
+        """Apply an "add" or "del" flow mod, or queue it if deferring."""
+        if self.defer_apply:
+            self.deferred_flows.append((action, flow_str))
+        elif action == "add":
+            self.run_ofctl("add-flow", [flow_str])
+        else:
+            self.run_ofctl("del-flows", [flow_str])
+
     def add_flow(self, **dict):
         if "actions" not in dict:
             raise Exception("must specify one or more actions")
         if "priority" not in dict:
             dict["priority"] = "0"
+        cookie = dict.get("cookie", flow_cookie())
 
-        flow_str = "priority=%s" % dict["priority"]
+        flow_str = "cookie=0x%x,priority=%s" % (cookie, dict["priority"])
         if "match" in dict:
             flow_str += "," + dict["match"]
         flow_str += ",actions=%s" % (dict["actions"])
-        self.run_ofctl("add-flow", [flow_str])
+        key = (cookie, int(dict["priority"]),
+               parse_match(dict.get("match", "")))
+        self.desired_flows[key] = (flow_str, parse_actions(dict["actions"]))
+        self.mod_flow("add", flow_str)
 
     def delete_flows(self, **dict):
         all_args = []
+        if "cookie" in dict:
+            all_args.append("cookie=0x%x/-1" % dict["cookie"])
         if "priority" in dict:
             all_args.append("priority=%s" % dict["priority"])
         if "match" in dict:
@@ -122,41 +298,97 @@ class OVSBridge:
         if "actions" in dict:
             all_args.append("actions=%s" % (dict["actions"]))
         flow_str = ",".join(all_args)
-        self.run_ofctl("del-flows", [flow_str])
+        # a non-strict delete removes every flow at least as specific as
+        # the given match
+        match = parse_match(dict.get("match", ""))
+        for key in self.desired_flows.keys():
+            cookie, priority, flow_match = key
+            if ("cookie" in dict and cookie != dict["cookie"]):
+                continue
+            if match <= flow_match:
+                del self.desired_flows[key]
+        self.mod_flow("del", flow_str)
+
+    def dump_flows(self):
+        """Return the flows of the bridge, as parsed by parse_flow()."""
+        flows = []
+        for line in self.run_ofctl("dump-flows", []).splitlines():
+            flow = parse_flow(line)
+            if flow:
+                flows.append(flow)
+        return flows
+
+    def reconcile_flows(self):
+        """Make the agent's flows on the bridge match desired_flows.
+
+        Only flows tagged with an agent cookie are considered. Stale ones
+        are removed, and missing ones or ones whose actions differ are
+        added, with at most one ovs-ofctl call for each. Flows are matched
+        up by cookie, priority and match.
+
+        :returns: a (number of flows added, number of flows deleted) tuple.
+        """
+        self.apply_deferred()
+        actual = {}
+        for flow in self.dump_flows():
+            if flow["cookie"] & COOKIE_PREFIX_MASK != COOKIE_PREFIX:
+                continue
+            key = (flow["cookie"], flow["priority"],
+                   parse_match(flow["match"]))
+            flow_str = "priority=%s" % flow["priority"]
+            if flow["match"]:
+                flow_str += "," + flow["match"]
+            actual[key] = (flow_str, parse_actions(flow["actions"]))
+        stale = [actual[key][0] for key in actual
+                 if key not in self.desired_flows]
+        # adding a flow replaces the one with the same priority and match
+        missing = [flow_str
+                   for key, (flow_str, actions) in self.desired_flows.items()
+                   if key not in actual or actual[key][1] != actions]
+        if stale:
+            LOG.info("Deleting %d stale flows from %s"
+                     % (len(stale), self.br_name))
+            self.run_ofctl("del-flows", ["--strict", "-"],
+                           "".join(flow_str + "\n" for flow_str in stale))
+        if missing:
+            LOG.info("Restoring %d missing flows on %s"
+                     % (len(missing), self.br_name))
+            self.run_ofctl("add-flows", ["-"],
+                           "".join(flow_str + "\n" for flow_str in missing))
+        return (len(missing), len(stale))
 
     def add_tunnel_port(self, port_name, remote_ip):
-        self.run_vsctl(["add-port", self.br_name, port_name])
-        self.set_db_attribute("Interface", port_name, "type", "gre")
-        self.set_db_attribute("Interface", port_name, "options:remote_ip",
-            remote_ip)
-        self.set_db_attribute("Interface", port_name, "options:in_key", "flow")
-        self.set_db_attribute("Interface", port_name, "options:out_key",
-            "flow")
-        return self.get_port_ofport(port_name)
+        """Add a GRE tunnel port.
+
+        Returns the new port's ofport, or None if the command was deferred.
+        """
+        self.vsctl_command(["--may-exist", "add-port", self.br_name,
+                            port_name,
+                            "--", "set", "Interface", port_name, "type=gre",
+                            "options:remote_ip=%s" % remote_ip,
+                            "options:in_key=flow",
+                            "options:out_key=flow"])
+        if not self.defer_apply:
+            return self.get_port_ofport(port_name)
 
     def add_patch_port(self, local_name, remote_name):
-        self.run_vsctl(["add-port", self.br_name, local_name])
-        self.set_db_attribute("Interface", local_name, "type", "patch")
-        self.set_db_attribute("Interface", local_name, "options:peer",
-                              remote_name)
+        self.vsctl_command(["--may-exist", "add-port", self.br_name,
+                            local_name,
+                            "--", "set", "Interface", local_name,
+                            "type=patch", "options:peer=%s" % remote_name])
         return self.get_port_ofport(local_name)
 
     def db_get_map(self, table, record, column):
-        str = self.run_vsctl(["get", table, record, column]).rstrip("\n\r")
-        return self.db_str_to_map(str)
+        self.apply_deferred()
+        return ovsdb.db_get_map(self.run_vsctl, table, record, column)
 
     def db_get_val(self, table, record, column):
+        self.apply_deferred()
         return self.run_vsctl(["get", table, record, column]).rstrip("\n\r")
 
-    def db_str_to_map(self, full_str):
-        list = full_str.strip("{}").split(", ")
-        ret = {}
-        for e in list:
-            if e.find("=") == -1:
-                continue
-            arr = e.split("=")
-            ret[arr[0]] = arr[1].strip("\"")
-        return ret
+    def db_list(self, table, columns, record=None):
+        self.apply_deferred()
+        return ovsdb.db_list(self.run_vsctl, table, columns, record)
 
     def get_port_name_list(self):
         res = self.run_vsctl(["list-ports", self.br_name])
@@ -173,13 +405,29 @@ class OVSBridge:
                         "param-key=nicira-iface-id",
                         "uuid=%s" % xs_vif_uuid]).strip()
 
-    # returns a VIF object for each VIF port
-    def get_vif_ports(self):
+    # returns a VIF object for each VIF port. interfaces may be given as
+    # a list of Interface records, e.g. from an ovsdb.InterfaceMonitor, to
+    # avoid reading the Interface table.
+    def get_vif_ports(self, interfaces=None):
         edge_ports = []
-        port_names = self.get_port_name_list()
-        for name in port_names:
-            external_ids = self.db_get_map("Interface", name, "external_ids")
-            ofport = self.db_get_val("Interface", name, "ofport")
+        if interfaces is None:
+            port_names = set(self.get_port_name_list())
+            interfaces = self.db_list("Interface", ovsdb.INTERFACE_COLUMNS)
+        else:
+            # Only list the bridge ports again when interfaces come or go
+            interface_names = set(i["name"] for i in interfaces)
+            if interface_names != self._interface_names:
+                self._port_names = set(self.get_port_name_list())
+                self._interface_names = interface_names
+            port_names = self._port_names
+        pool = workers.get_pool()
+        xapi_ports = []
+        for interface in interfaces:
+            name = interface["name"]
+            if name not in port_names:
+                continue
+            external_ids = interface["external_ids"] or {}
+            ofport = str(interface["ofport"])
             if "iface-id" in external_ids and "attached-mac" in external_ids:
                 p = VifPort(name, ofport, external_ids["iface-id"],
                             external_ids["attached-mac"], self)
@@ -187,15 +435,61 @@ class OVSBridge:
             elif "xs-vif-uuid" in external_ids and \
                  "attached-mac" in external_ids:
                 # if this is a xenserver and iface-id is not automatically
-                # synced to OVS from XAPI, we grab it from XAPI directly
-                iface_id = self.get_xapi_iface_id(external_ids["xs-vif-uuid"])
-                p = VifPort(name, ofport, iface_id,
+                # synced to OVS from XAPI, we grab it from XAPI directly,
+                # for all such ports at once
+                p = VifPort(name, ofport, None,
                             external_ids["attached-mac"], self)
+                xapi_ports.append((p, pool.submit(
+                    name, self.get_xapi_iface_id,
+                    external_ids["xs-vif-uuid"])))
                 edge_ports.append(p)
 
+        if xapi_ports:
+            pool.wait()
+            for p, task in xapi_ports:
+                if task.error:
+                    edge_ports.remove(p)
+                else:
+                    p.vif_id = task.result
+
         return edge_ports
 
 
+def tunnel_port_name(remote_ip):
+    """Return the GRE port name for an IPv4 address, e.g. gre-0a000001."""
+    return "gre-%08x" % struct.unpack("!I", socket.inet_aton(remote_ip))
+
+
+def tunnel_port_ip(port_name):
+    """Return the remote IP encoded by tunnel_port_name(), or None."""
+    if not port_name.startswith("gre-") or len(port_name) != 12:
+        return None
+    try:
+        return socket.inet_ntoa(struct.pack("!I", int(port_name[4:], 16)))
+    except ValueError:
+        return None
+
+
+def load_state(state_file):
+    """Return the state saved by save_state(), or None if there is none."""
+    if not state_file or not os.path.exists(state_file):
+        return None
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (IOError, ValueError), e:
+        LOG.error("Ignoring unreadable state file %s: %s" % (state_file, e))
+        return None
+
+
+def save_state(state_file, state):
+    """Write state to state_file as JSON, atomically replacing it."""
+    tmp_file = state_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(state, f)
+    os.rename(tmp_file, state_file)
+
+
 class LocalVLANMapping:
     def __init__(self, vlan, lsw_id, vif_ids=None):
         if vif_ids is None:
@@ -203,16 +497,81 @@ class LocalVLANMapping:
         self.vlan = vlan
         self.lsw_id = lsw_id
         self.vif_ids = vif_ids
+        # tunnel ofports and remote mac -> tunnel ofport programmed on the
+        # tunnel bridge for this vlan, when flooding is restricted
+        self.flood_ofports = None
+        self.remote_macs = {}
 
     def __str__(self):
         return "lv-id = %s ls-id = %s" % (self.vlan, self.lsw_id)
 
 
+class PortState:
+    """State of a VIF on the integration bridge, as applied by the agent.
+
+    A port without a network binding is put on the dead vlan with a drop
+    flow for its traffic.
+    """
+    def __init__(self, port_name, ofport, net_id, tag):
+        self.port_name = port_name
+        self.ofport = ofport
+        self.net_id = net_id
+        self.tag = tag
+
+    @property
+    def dead(self):
+        return self.net_id is None
+
+    def __eq__(self, other):
+        return (isinstance(other, PortState) and
+                (self.port_name, self.ofport, self.net_id, self.tag) ==
+                (other.port_name, other.ofport, other.net_id, other.tag))
+
+    def __ne__(self, other):
+        return not self == other
+
+
+class PortBinding:
+    """The columns of a port row used by the tunnel agent.
+
+    Every commit expires the rows loaded by the session, after which
+    reading a column of one of them queries the database again.
+    """
+    def __init__(self, row):
+        self.uuid = row.uuid
+        self.network_id = row.network_id
+        self.interface_id = row.interface_id
+        self.op_status = row.op_status
+
+
+class VifLocation:
+    """A row of vif_locations, detached from the session like PortBinding.
+    """
+    def __init__(self, interface_id, ip_address, mac_address):
+        self.interface_id = interface_id
+        self.ip_address = ip_address
+        self.mac_address = mac_address
+
+
 class OVSQuantumAgent(object):
 
-    def __init__(self, integ_br, root_helper):
+    def __init__(self, integ_br, root_helper, subscriber=None,
+                 monitor=None, state_file=None):
         self.root_helper = root_helper
-        self.setup_integration_br(integ_br)
+        self.subscriber = subscriber or notifier.NullSubscriber()
+        self.monitor = monitor
+        # vif_id -> PortState last applied to the integration bridge
+        self.applied_state = {}
+        self.status = status.StatusReporter()
+        self.plug_latency = metrics.LatencyTracker("plug_to_up")
+        # If the state of a previous run was saved, adopt the bridge as it
+        # is instead of wiping it, so that restarts don't disturb traffic.
+        self.state_file = state_file
+        self.saved_state = None
+        state = load_state(state_file)
+        self.setup_integration_br(integ_br, warm=state is not None)
+        if state:
+            self.restore_state(state)
 
     def port_bound(self, port, vlan_id):
         self.int_br.set_db_attribute("Port", port.port_name, "tag",
@@ -223,84 +582,262 @@ class OVSQuantumAgent(object):
         if still_exists:
             self.int_br.clear_db_attribute("Port", port.port_name, "tag")
 
-    def setup_integration_br(self, integ_br):
+    def setup_integration_br(self, integ_br, warm=False):
         self.int_br = OVSBridge(integ_br, self.root_helper)
-        self.int_br.remove_all_flows()
+        if not warm:
+            self.int_br.remove_all_flows()
         # switch all traffic using L2 learning
         self.int_br.add_flow(priority=1, actions="normal")
 
-    def daemon_loop(self, db):
-        self.local_vlan_map = {}
-        old_local_bindings = {}
-        old_vif_ports = {}
-
-        while True:
-
-            all_bindings = {}
+    def restore_state(self, state):
+        """Adopt the ports configured by a previous run of the agent.
+
+        Their flows are added again, which leaves existing identical flows
+        and the traffic using them undisturbed. Anything that changed since
+        is repaired by the first sync.
+        """
+        self.int_br.defer_apply_on()
+        for vif_id, port in state["applied_state"].items():
+            port_state = PortState(port["port_name"], port["ofport"],
+                                   port["net_id"], port["tag"])
+            self.applied_state[vif_id] = port_state
+            if port_state.dead:
+                self.int_br.add_flow(priority=2,
+                                     match="in_port=%s" % port_state.ofport,
+                                     actions="drop",
+                                     cookie=flow_cookie(DEAD_VLAN_TAG))
+        self.int_br.defer_apply_off()
+        self.saved_state = state
+        LOG.info("Restored the state of %d ports from %s"
+                 % (len(self.applied_state), self.state_file))
+
+    def persist_state(self):
+        """Save the applied state if it changed since it was last saved."""
+        if not self.state_file:
+            return
+        applied_state = {}
+        for vif_id, port_state in self.applied_state.items():
+            applied_state[vif_id] = {"port_name": port_state.port_name,
+                                     "ofport": port_state.ofport,
+                                     "net_id": port_state.net_id,
+                                     "tag": port_state.tag}
+        state = {"applied_state": applied_state}
+        if state != self.saved_state:
+            save_state(self.state_file, state)
+            self.saved_state = state
+
+    def desired_port_state(self, port, binding, vlan_bindings):
+        if binding is None:
+            return PortState(port.port_name, port.ofport, None,
+                             DEAD_VLAN_TAG)
+        # If the network has no vlan yet we have to stick the port on the
+        # dead vlan, without dropping its traffic.
+        vlan_id = vlan_bindings.get(binding.network_id, DEAD_VLAN_TAG)
+        return PortState(port.port_name, port.ofport, binding.network_id,
+                         str(vlan_id))
+
+    def apply_port_state(self, port, old, new):
+        """Issue the commands moving port from state old to state new.
+
+        old is None for a port the agent has not configured yet.
+        """
+        if old and old.net_id != new.net_id and old.net_id is not None:
+            LOG.info("Removing binding to net-id = %s for %s"
+                     % (old.net_id, str(port)))
+        if old is None or old.port_name != new.port_name or \
+           old.tag != new.tag:
+            self.int_br.set_db_attribute("Port", new.port_name, "tag",
+                                         new.tag)
+        if old and old.dead and old.ofport != new.ofport:
+            self.int_br.delete_flows(match="in_port=%s" % old.ofport)
+        if new.dead:
+            if old is None or not old.dead or old.ofport != new.ofport:
+                self.int_br.add_flow(priority=2,
+                                     match="in_port=%s" % new.ofport,
+                                     actions="drop",
+                                     cookie=flow_cookie(DEAD_VLAN_TAG))
+        elif old is None or old.dead or old.ofport != new.ofport:
+            self.int_br.delete_flows(match="in_port=%s" % new.ofport)
+        if new.net_id is not None and (old is None or
+                                       old.net_id != new.net_id):
+            LOG.info("Adding binding to net-id = %s for %s on vlan %s"
+                     % (new.net_id, str(port), new.tag))
+
+    def count_port_change(self, old, new):
+        old_net_id = old and old.net_id
+        if old_net_id == new.net_id:
+            return
+        if old_net_id is not None:
+            metrics.incr("ports_removed")
+        if new.net_id is not None:
+            metrics.incr("ports_added")
+
+    def verify_applied_state(self):
+        """Drop the applied state of ports whose tag no longer matches.
+
+        Those ports are reconfigured by the next sync, which repairs any
+        change made behind the agent's back.
+        """
+        actual_tags = {}
+        for port in self.int_br.db_list("Port", ["name", "tag"]):
+            tag = port["tag"]
+            if isinstance(tag, list):
+                # empty set, the port has no tag
+                tag = None
+            else:
+                tag = str(tag)
+            actual_tags[port["name"]] = tag
+        for vif_id, state in self.applied_state.items():
+            if actual_tags.get(state.port_name) != state.tag:
+                LOG.info("Port %s does not match its applied state, "
+                         "repairing" % state.port_name)
+                del self.applied_state[vif_id]
+
+    def get_db_bindings(self, db, vif_ids=None):
+        """Read port and vlan bindings from the plugin's database.
+
+        If vif_ids is given, only the ports attached to these interfaces
+        and the vlans of their networks are read.
+
+        :returns: a (ports, vlan bindings) tuple of database rows.
+        """
+        with metrics.timer("db"):
             try:
-                ports = db.ports.all()
+                if vif_ids is None:
+                    ports = db.ports.all()
+                elif vif_ids:
+                    ports = db.ports.filter(
+                        db.ports.interface_id.in_(list(vif_ids))).all()
+                else:
+                    ports = []
             except:
                 ports = []
-            for port in ports:
-                all_bindings[port.interface_id] = port
-
-            vlan_bindings = {}
             try:
-                vlan_binds = db.vlan_bindings.all()
+                if vif_ids is None:
+                    vlan_binds = db.vlan_bindings.all()
+                elif ports:
+                    network_ids = list(set(p.network_id for p in ports))
+                    vlan_binds = db.vlan_bindings.filter(
+                        db.vlan_bindings.network_id.in_(network_ids)).all()
+                else:
+                    vlan_binds = []
             except:
                 vlan_binds = []
-            for bind in vlan_binds:
-                vlan_bindings[bind.network_id] = bind.vlan_id
-
-            new_vif_ports = {}
-            new_local_bindings = {}
-            vif_ports = self.int_br.get_vif_ports()
-            for p in vif_ports:
-                new_vif_ports[p.vif_id] = p
-                if p.vif_id in all_bindings:
-                    net_id = all_bindings[p.vif_id].network_id
-                    new_local_bindings[p.vif_id] = net_id
-                else:
-                    # no binding, put him on the 'dead vlan'
-                    self.int_br.set_db_attribute("Port", p.port_name, "tag",
-                                                 DEAD_VLAN_TAG)
-                    self.int_br.add_flow(priority=2,
-                           match="in_port=%s" % p.ofport, actions="drop")
-
-                old_b = old_local_bindings.get(p.vif_id, None)
-                new_b = new_local_bindings.get(p.vif_id, None)
-
-                if old_b != new_b:
-                    if old_b is not None:
-                        LOG.info("Removing binding to net-id = %s for %s"
-                          % (old_b, str(p)))
-                        self.port_unbound(p, True)
-                        if p.vif_id in all_bindings:
-                            all_bindings[p.vif_id].op_status = OP_STATUS_DOWN
-                    if new_b is not None:
-                        # If we don't have a binding we have to stick it on
-                        # the dead vlan
-                        net_id = all_bindings[p.vif_id].network_id
-                        vlan_id = vlan_bindings.get(net_id, DEAD_VLAN_TAG)
-                        self.port_bound(p, vlan_id)
-                        if p.vif_id in all_bindings:
-                            all_bindings[p.vif_id].op_status = OP_STATUS_UP
-                        LOG.info("Adding binding to net-id = %s " \
-                             "for %s on vlan %s" % (new_b, str(p), vlan_id))
-
-            for vif_id in old_vif_ports:
-                if vif_id not in new_vif_ports:
-                    LOG.info("Port Disappeared: %s" % vif_id)
-                    if vif_id in old_local_bindings:
-                        old_b = old_local_bindings[vif_id]
-                        self.port_unbound(old_vif_ports[vif_id], False)
-                    if vif_id in all_bindings:
-                        all_bindings[vif_id].op_status = OP_STATUS_DOWN
+        return ports, vlan_binds
+
+    def changed_vif_ids(self, vif_ports, interface_ids, network_ids):
+        """Return the interfaces a sync limited to targets must look at.
+
+        These are the local interfaces named in plugin events, those which
+        appeared, moved or vanished on the bridge, and those bound to a
+        network which was just created and may now have a vlan. Events
+        about interfaces of other hosts cost no database access.
+        """
+        vif_ids = set()
+        present = set()
+        for p in vif_ports:
+            present.add(p.vif_id)
+            old_state = self.applied_state.get(p.vif_id)
+            if p.vif_id in interface_ids or old_state is None or \
+               old_state.port_name != p.port_name or \
+               old_state.ofport != p.ofport:
+                vif_ids.add(p.vif_id)
+        for vif_id, state in self.applied_state.items():
+            if vif_id not in present or state.net_id in network_ids:
+                vif_ids.add(vif_id)
+        return vif_ids
+
+    def sync(self, db, full_resync, targets=None):
+        """Bring the integration bridge and port op_status up to date.
+
+        Only the changes since the previous call are applied. A full resync
+        also rereads the actual state of the bridge. If targets holds the
+        (interface ids, network ids) named in plugin events, only the ports
+        returned by changed_vif_ids() are read from the database and
+        reconfigured, instead of every port.
+        """
+        self.int_br.defer_apply_on()
+        if full_resync:
+            self.verify_applied_state()
+        vif_ports = ovsdb.scan_vif_ports(self.int_br, self.monitor,
+                                         full_resync)
+        if targets is None:
+            changed = None
+        else:
+            changed = self.changed_vif_ids(vif_ports, *targets)
+
+        all_bindings = {}
+        vlan_bindings = {}
+        ports, vlan_binds = self.get_db_bindings(db, changed)
+        port_ids = set()
+        pending = set()
+        for port in ports:
+            all_bindings[port.interface_id] = port
+            port_ids.add(port.uuid)
+            if port.op_status != OP_STATUS_UP:
+                self.plug_latency.start(port.uuid)
+                pending.add(port.uuid)
+        if changed is None:
+            self.plug_latency.retain(pending)
+            self.status.retain(port_ids)
+        for bind in vlan_binds:
+            vlan_bindings[bind.network_id] = bind.vlan_id
+
+        vif_ids = set()
+        for p in vif_ports:
+            vif_ids.add(p.vif_id)
+            if changed is not None and p.vif_id not in changed:
+                continue
+            binding = all_bindings.get(p.vif_id)
+            old_state = self.applied_state.get(p.vif_id)
+            new_state = self.desired_port_state(p, binding, vlan_bindings)
+            if new_state != old_state:
+                self.apply_port_state(p, old_state, new_state)
+                self.applied_state[p.vif_id] = new_state
+                self.count_port_change(old_state, new_state)
+            if binding:
+                self.status.update(binding.uuid, OP_STATUS_UP,
+                                   binding.op_status)
+
+        for vif_id in self.applied_state.keys():
+            if vif_id not in vif_ids:
+                LOG.info("Port Disappeared: %s" % vif_id)
+                if self.applied_state[vif_id].net_id is not None:
+                    metrics.incr("ports_removed")
+                del self.applied_state[vif_id]
+                binding = all_bindings.get(vif_id)
+                if binding:
+                    self.status.update(binding.uuid, OP_STATUS_DOWN,
+                                       binding.op_status)
+
+        self.int_br.defer_apply_off()
+        if full_resync:
+            self.int_br.reconcile_flows()
+        for port_id, op_status in self.status.flush(db).items():
+            if op_status == OP_STATUS_UP:
+                self.plug_latency.stop(port_id)
+        self.persist_state()
 
-            old_vif_ports = new_vif_ports
-            old_local_bindings = new_local_bindings
-            db.commit()
-            time.sleep(REFRESH_INTERVAL)
+    def daemon_loop(self, db):
+        self.local_vlan_map = {}
+        resync_deadline = 0
+        events = []
+
+        while True:
+            started = time.time()
+            full_resync = started >= resync_deadline
+            if full_resync:
+                resync_deadline = started + RESYNC_INTERVAL
+            targets = None
+            # without the notification channel, database changes are only
+            # found by reading every port
+            if not full_resync and self.subscriber.connected:
+                targets = notifier.event_targets(events,
+                                                 (ovsdb.INTERFACE_EVENT,))
+            self.sync(db, full_resync, targets)
+            metrics.iteration_done(started)
+            events = ovsdb.wait_for_changes(self.subscriber, self.monitor,
+                                            resync_deadline)
 
 
 class OVSQuantumTunnelAgent(object):
@@ -319,6 +856,12 @@ class OVSQuantumTunnelAgent(object):
 
     Port patching is done to connect local VLANs on the integration bridge
     to inter-hypervisor tunnels on the tunnel bridge.
+
+    With on-demand tunnels, each agent registers its hypervisor in the
+    tunnel_endpoints table and its vifs in vif_locations. Nothing expires
+    the rows of a hypervisor which is gone for good: they must be deleted
+    when it is decommissioned, or the other agents keep their tunnels to
+    it.
     '''
 
     # Lower bound on available vlans.
@@ -328,20 +871,87 @@ class OVSQuantumTunnelAgent(object):
     MAX_VLAN_TAG = 4094
 
     def __init__(self, integ_br, tun_br, remote_ip_file, local_ip,
-                 root_helper):
+                 root_helper, subscriber=None, monitor=None, state_file=None,
+                 l2_population=False):
         '''Constructor.
 
         :param integ_br: name of the integration bridge.
         :param tun_br: name of the tunnel bridge.
         :param remote_ip_file: name of file containing list of hypervisor IPs.
-        :param local_ip: local IP address of this hypervisor.'''
+            If empty, tunnels are created on demand to the hypervisors
+            registered in the database which share a network with this one.
+        :param local_ip: local IP address of this hypervisor.
+        :param subscriber: optional NotificationSubscriber used to wake up
+            the daemon loop as soon as the plugin reports a change.
+        :param monitor: optional ovsdb.InterfaceMonitor providing the local
+            interfaces without polling ovs-vsctl.
+        :param state_file: optional path where the local vlan map is saved.
+            If it holds the state of a previous run, the bridges are adopted
+            as they are instead of being rebuilt, so that restarting the
+            agent does not interrupt traffic.
+        :param l2_population: forward traffic to remote vifs with one flow
+            per MAC address, and flood the rest only to the tunnels of the
+            hypervisors hosting the network. Requires on-demand tunnels.'''
         self.root_helper = root_helper
+        self.subscriber = subscriber or notifier.NullSubscriber()
+        self.monitor = monitor
+        self.state_file = state_file
+        self.saved_state = None
+        self.local_ip = local_ip
+        # remote ip -> GRE port name, for tunnels managed on demand
+        self.dynamic_tunnels = not remote_ip_file
+        self.tunnel_ports = {}
+        # remote ip -> ofport of its GRE port, used by l2_population
+        self.tunnel_ofports = {}
+        self.endpoint_registered = False
+        self.plug_latency = metrics.LatencyTracker("plug_to_up")
+        self.l2_population = l2_population
+        if l2_population and not self.dynamic_tunnels:
+            LOG.warn("l2-population requires on-demand tunnels, ignored "
+                     "since remote-ip-file is set")
+            self.l2_population = False
         self.available_local_vlans = set(
             xrange(OVSQuantumTunnelAgent.MIN_VLAN_TAG,
                    OVSQuantumTunnelAgent.MAX_VLAN_TAG))
-        self.setup_integration_br(integ_br)
+        state = load_state(state_file)
+        warm = state is not None
+        self.setup_integration_br(integ_br, warm)
         self.local_vlan_map = {}
-        self.setup_tunnel_br(tun_br, remote_ip_file, local_ip)
+        self.setup_tunnel_br(tun_br, remote_ip_file, local_ip, warm)
+        if state:
+            self.restore_state(state)
+
+    def restore_state(self, state):
+        '''Adopt the local vlans allocated by a previous run of the agent.
+
+        Their flows are added again, which leaves existing identical flows
+        undisturbed. The vifs of each vlan are bound again by the first pass
+        of the daemon loop, and vlans left without any are reclaimed.
+
+        :param state: the state saved by persist_state().'''
+        self.tun_br.defer_apply_on()
+        for net_uuid, lv in state["local_vlan_map"].items():
+            self.available_local_vlans.discard(lv["vlan"])
+            self.local_vlan_map[net_uuid] = LocalVLANMapping(lv["vlan"],
+                                                             lv["lsw_id"])
+            self.install_local_vlan_flows(lv["vlan"], lv["lsw_id"])
+        self.tun_br.defer_apply_off()
+        self.saved_state = state
+        LOG.info("Restored %d local vlans from %s"
+                 % (len(self.local_vlan_map), self.state_file))
+
+    def persist_state(self):
+        '''Save the local vlan map if it changed since it was last saved.'''
+        if not self.state_file:
+            return
+        local_vlan_map = {}
+        for net_uuid, lvm in self.local_vlan_map.items():
+            local_vlan_map[net_uuid] = {"vlan": lvm.vlan,
+                                        "lsw_id": lvm.lsw_id}
+        state = {"local_vlan_map": local_vlan_map}
+        if state != self.saved_state:
+            save_state(self.state_file, state)
+            self.saved_state = state
 
     def provision_local_vlan(self, net_uuid, lsw_id):
         '''Provisions a local VLAN.
@@ -353,16 +963,25 @@ class OVSQuantumTunnelAgent(object):
         lvid = self.available_local_vlans.pop()
         LOG.info("Assigning %s as local vlan for net-id=%s" % (lvid, net_uuid))
         self.local_vlan_map[net_uuid] = LocalVLANMapping(lvid, lsw_id)
+        self.install_local_vlan_flows(lvid, lsw_id)
 
-        # outbound
-        self.tun_br.add_flow(priority=4, match="in_port=%s,dl_vlan=%s" %
-                            (self.patch_int_ofport, lvid),
-                             actions="set_tunnel:%s,normal" % (lsw_id))
+    def install_local_vlan_flows(self, lvid, lsw_id):
+        '''Add the tunnel bridge flows of a local VLAN.
+
+        :param lvid: the local vlan id.
+        :param lsw_id: the logical switch id of this vlan.'''
+        # outbound, set by update_forwarding_flows() with l2_population
+        if not self.l2_population:
+            self.tun_br.add_flow(priority=4, match="in_port=%s,dl_vlan=%s" %
+                                 (self.patch_int_ofport, lvid),
+                                 actions="set_tunnel:%s,normal" % (lsw_id),
+                                 cookie=flow_cookie(lvid))
 
         # inbound
         self.tun_br.add_flow(priority=3, match="tun_id=%s" % lsw_id,
                              actions="mod_vlan_vid:%s,output:%s" % (lvid,
-                             self.patch_int_ofport))
+                             self.patch_int_ofport),
+                             cookie=flow_cookie(lvid))
 
     def reclaim_local_vlan(self, net_uuid, lvm):
         '''Reclaim a local VLAN.
@@ -371,8 +990,7 @@ class OVSQuantumTunnelAgent(object):
         :param lvm: a LocalVLANMapping object that tracks (vlan, lsw_id,
             vif_ids) mapping.'''
         LOG.info("reclaming vlan = %s from net-id = %s" % (lvm.vlan, net_uuid))
-        self.tun_br.delete_flows(match="tun_id=%s" % lvm.lsw_id)
-        self.tun_br.delete_flows(match="dl_vlan=%s" % lvm.vlan)
+        self.tun_br.delete_flows(cookie=flow_cookie(lvm.vlan))
         del self.local_vlan_map[net_uuid]
         self.available_local_vlans.add(lvm.vlan)
 
@@ -421,23 +1039,27 @@ class OVSQuantumTunnelAgent(object):
         self.int_br.set_db_attribute("Port", port.port_name, "tag",
                                      DEAD_VLAN_TAG)
         self.int_br.add_flow(priority=2,
-                             match="in_port=%s" % port.ofport, actions="drop")
+                             match="in_port=%s" % port.ofport, actions="drop",
+                             cookie=flow_cookie(DEAD_VLAN_TAG))
 
-    def setup_integration_br(self, integ_br):
+    def setup_integration_br(self, integ_br, warm=False):
         '''Setup the integration bridge.
 
         Create patch ports and remove all existing flows.
 
-        :param integ_br: the name of the integration bridge.'''
+        :param integ_br: the name of the integration bridge.
+        :param warm: keep the existing ports and flows.'''
         self.int_br = OVSBridge(integ_br, self.root_helper)
-        self.int_br.delete_port("patch-tun")
+        if not warm:
+            self.int_br.delete_port("patch-tun")
         self.patch_tun_ofport = self.int_br.add_patch_port("patch-tun",
                                                            "patch-int")
-        self.int_br.remove_all_flows()
+        if not warm:
+            self.int_br.remove_all_flows()
         # switch all traffic using L2 learning
         self.int_br.add_flow(priority=1, actions="normal")
 
-    def setup_tunnel_br(self, tun_br, remote_ip_file, local_ip):
+    def setup_tunnel_br(self, tun_br, remote_ip_file, local_ip, warm=False):
         '''Setup the tunnel bridge.
 
         Reads in list of IP addresses. Creates GRE tunnels to each of these
@@ -447,11 +1069,34 @@ class OVSQuantumTunnelAgent(object):
         :param tun_br: the name of the tunnel bridge.
         :param remote_ip_file: path to file that contains list of destination
             IP addresses.
-        :param local_ip: the ip address of this node.'''
+        :param local_ip: the ip address of this node.
+        :param warm: keep the bridge and its flows if it already exists.'''
         self.tun_br = OVSBridge(tun_br, self.root_helper)
-        self.tun_br.reset_bridge()
+        if warm:
+            self.tun_br.ensure_bridge()
+        else:
+            self.tun_br.reset_bridge()
         self.patch_int_ofport = self.tun_br.add_patch_port("patch-int",
                                                            "patch-tun")
+        if self.dynamic_tunnels:
+            if warm:
+                self.adopt_tunnel_ports()
+        else:
+            self.setup_tunnel_mesh(remote_ip_file, local_ip)
+
+        if not warm:
+            self.tun_br.remove_all_flows()
+        # default drop
+        self.tun_br.add_flow(priority=1, actions="drop")
+
+    def setup_tunnel_mesh(self, remote_ip_file, local_ip):
+        '''Create GRE tunnels to every IP address listed in remote_ip_file.
+
+        :param remote_ip_file: path to file that contains list of destination
+            IP addresses.
+        :param local_ip: the ip address of this node.'''
+        # create the whole tunnel mesh in a single transaction
+        self.tun_br.defer_apply_on()
         try:
             with open(remote_ip_file, 'r') as f:
                 remote_ip_list = f.readlines()
@@ -459,14 +1104,197 @@ class OVSQuantumTunnelAgent(object):
                 tunnel_ips = (x for x in clean_ips if x != local_ip and x)
                 for i, remote_ip in enumerate(tunnel_ips):
                     self.tun_br.add_tunnel_port("gre-" + str(i), remote_ip)
+                    metrics.gauge("tunnels", i + 1)
         except Exception, e:
             LOG.error("Error configuring tunnels: '%s' %s"
                       % (remote_ip_file, str(e)))
             raise
+        self.tun_br.defer_apply_off()
+
+    def adopt_tunnel_ports(self):
+        '''Take over the on-demand tunnels created by a previous run.'''
+        for port_name in self.tun_br.get_port_name_list():
+            remote_ip = tunnel_port_ip(port_name)
+            if remote_ip:
+                self.tunnel_ports[remote_ip] = port_name
+                if self.l2_population:
+                    self.set_tunnel_ofport(remote_ip, port_name)
+
+    def set_tunnel_ofport(self, remote_ip, port_name):
+        '''Look up the ofport of a GRE port for the forwarding flows.'''
+        ofport = self.tun_br.get_port_ofport(port_name)
+        if ofport.isdigit() and int(ofport) > 0:
+            self.tunnel_ofports[remote_ip] = ofport
+        else:
+            LOG.warn("No ofport for tunnel port %s" % port_name)
 
-        self.tun_br.remove_all_flows()
-        # default drop
-        self.tun_br.add_flow(priority=1, actions="drop")
+    def register_endpoint(self, db):
+        '''Advertise this hypervisor as a tunnel endpoint in the database.'''
+        try:
+            if not db.tunnel_endpoints.get(self.local_ip):
+                db.tunnel_endpoints.insert(ip_address=self.local_ip)
+                db.commit()
+            self.endpoint_registered = True
+            LOG.info("Registered tunnel endpoint %s" % self.local_ip)
+        except Exception, e:
+            db.rollback()
+            LOG.info("Unable to register tunnel endpoint: %s" % e)
+
+    def update_vif_locations(self, db, local_vif_ports):
+        '''Record in the database which vifs are plugged on this hypervisor.
+
+        :param local_vif_ports: vif id -> VifPort of the bound local vifs.
+        :returns: the list of all vif locations, as VifLocation objects, or
+            None on failure.'''
+        try:
+            # interface id -> VifLocation, as left by the changes below
+            locations = {}
+            for row in db.vif_locations.all():
+                mac_address = row.mac_address
+                if row.ip_address == self.local_ip:
+                    port = local_vif_ports.get(row.interface_id)
+                    if not port:
+                        db.delete(row)
+                        continue
+                    if mac_address != port.vif_mac:
+                        mac_address = row.mac_address = port.vif_mac
+                locations[row.interface_id] = VifLocation(
+                    row.interface_id, row.ip_address, mac_address)
+            for vif_id, port in local_vif_ports.items():
+                location = locations.get(vif_id)
+                if location and location.ip_address == self.local_ip:
+                    continue
+                db.vif_locations.filter_by(interface_id=vif_id).delete()
+                db.vif_locations.insert(interface_id=vif_id,
+                                        ip_address=self.local_ip,
+                                        mac_address=port.vif_mac)
+                locations[vif_id] = VifLocation(vif_id, self.local_ip,
+                                                port.vif_mac)
+            db.commit()
+            return locations.values()
+        except Exception, e:
+            db.rollback()
+            LOG.info("Unable to update vif locations: %s" % e)
+            return None
+
+    def get_db_tunnel_endpoints(self, db):
+        '''Get the registered tunnel endpoints.
+
+        :returns: a set of ip addresses, or None on failure.'''
+        try:
+            return set(e.ip_address for e in db.tunnel_endpoints.all())
+        except Exception, e:
+            LOG.info("Exception accessing db.tunnel_endpoints: %s" % e)
+            return None
+
+    def update_tunnels(self, db, all_bindings, local_vif_ports):
+        '''Create and delete tunnels as networks come and go.
+
+        A tunnel is needed to each registered endpoint with at least one vif
+        on a network that also has a vif on this hypervisor.
+
+        :param all_bindings: interface id -> port from the database.
+        :param local_vif_ports: vif id -> VifPort of the bound local vifs.
+        :returns: the list of all vif locations, or None on failure.'''
+        if not self.endpoint_registered:
+            self.register_endpoint(db)
+        with metrics.timer("db"):
+            locations = self.update_vif_locations(db, local_vif_ports)
+            endpoints = self.get_db_tunnel_endpoints(db)
+        if locations is None or endpoints is None:
+            return None
+
+        local_networks = set(all_bindings[vif_id].network_id
+                             for vif_id in local_vif_ports)
+        needed = set()
+        for location in locations:
+            port = all_bindings.get(location.interface_id)
+            if (port and port.network_id in local_networks and
+                location.ip_address != self.local_ip and
+                location.ip_address in endpoints):
+                needed.add(location.ip_address)
+
+        added = needed - set(self.tunnel_ports)
+        removed = set(self.tunnel_ports) - needed
+        for remote_ip in added:
+            port_name = tunnel_port_name(remote_ip)
+            self.tun_br.add_tunnel_port(port_name, remote_ip)
+            self.tunnel_ports[remote_ip] = port_name
+            if self.l2_population:
+                self.set_tunnel_ofport(remote_ip, port_name)
+        for remote_ip in removed:
+            self.tun_br.delete_port(self.tunnel_ports.pop(remote_ip))
+            self.tunnel_ofports.pop(remote_ip, None)
+        if added or removed:
+            LOG.info("Tunnels: %d (%d added, %d removed)"
+                     % (len(self.tunnel_ports), len(added), len(removed)))
+        metrics.gauge("tunnels", len(self.tunnel_ports))
+        return locations
+
+    def update_forwarding_flows(self, all_bindings, locations):
+        '''Program the outbound flows of every local vlan for l2_population.
+
+        Traffic to a MAC address known to live on another hypervisor is
+        sent down that hypervisor's tunnel only. Broadcasts and unknown
+        unicast are flooded to the tunnels of the hypervisors with a vif
+        on the network, and dropped if there is none.
+
+        :param all_bindings: interface id -> port from the database.
+        :param locations: the vif locations returned by update_tunnels().'''
+        flood_ofports = {}
+        remote_macs = {}
+        for location in locations:
+            port = all_bindings.get(location.interface_id)
+            ofport = self.tunnel_ofports.get(location.ip_address)
+            if not port or not ofport:
+                continue
+            net_uuid = port.network_id
+            if net_uuid not in self.local_vlan_map:
+                continue
+            flood_ofports.setdefault(net_uuid, set()).add(ofport)
+            if location.mac_address:
+                macs = remote_macs.setdefault(net_uuid, {})
+                macs[location.mac_address] = ofport
+
+        for net_uuid, lvm in self.local_vlan_map.items():
+            ofports = sorted(flood_ofports.get(net_uuid, ()), key=int)
+            if ofports != lvm.flood_ofports:
+                self.set_flood_flow(lvm, ofports)
+            self.set_unicast_flows(lvm, remote_macs.get(net_uuid, {}))
+
+    def set_flood_flow(self, lvm, ofports):
+        '''Flood the outbound traffic of a local vlan to the given tunnels.'''
+        if ofports:
+            actions = "strip_vlan,set_tunnel:%s,%s" % (
+                lvm.lsw_id, ",".join("output:%s" % p for p in ofports))
+        else:
+            actions = "drop"
+        self.tun_br.add_flow(priority=4, match="in_port=%s,dl_vlan=%s" %
+                             (self.patch_int_ofport, lvm.vlan),
+                             actions=actions, cookie=flow_cookie(lvm.vlan))
+        lvm.flood_ofports = ofports
+
+    def set_unicast_flows(self, lvm, remote_macs):
+        '''Add and remove the per MAC flows of a local vlan.
+
+        :param remote_macs: remote mac -> ofport of the tunnel leading to
+            the hypervisor hosting it.'''
+        for mac, ofport in remote_macs.items():
+            if lvm.remote_macs.get(mac) == ofport:
+                continue
+            self.tun_br.add_flow(priority=5,
+                                 match="in_port=%s,dl_vlan=%s,dl_dst=%s" %
+                                 (self.patch_int_ofport, lvm.vlan, mac),
+                                 actions="strip_vlan,set_tunnel:%s,output:%s"
+                                 % (lvm.lsw_id, ofport),
+                                 cookie=flow_cookie(lvm.vlan))
+        for mac in lvm.remote_macs:
+            if mac not in remote_macs:
+                self.tun_br.delete_flows(
+                    match="in_port=%s,dl_vlan=%s,dl_dst=%s" %
+                    (self.patch_int_ofport, lvm.vlan, mac),
+                    cookie=flow_cookie(lvm.vlan))
+        lvm.remote_macs = dict(remote_macs)
 
     def get_db_port_bindings(self, db):
         '''Get database port bindings from central Quantum database.
@@ -474,14 +1302,16 @@ class OVSQuantumTunnelAgent(object):
         The central quantum database 'ovs_quantum' resides on the openstack
         mysql server.
 
-        :returns: a dictionary containing port bindings.'''
+        :returns: a dictionary of interface id -> PortBinding.'''
         ports = []
         try:
-            ports = db.ports.all()
+            with metrics.timer("db"):
+                ports = db.ports.all()
         except Exception, e:
             LOG.info("Exception accessing db.ports: %s" % e)
 
-        return dict([(port.interface_id, port) for port in ports])
+        return dict([(port.interface_id, PortBinding(port))
+                     for port in ports])
 
     def get_db_vlan_bindings(self, db):
         '''Get database vlan bindings from central Quantum database.
@@ -492,7 +1322,8 @@ class OVSQuantumTunnelAgent(object):
         :returns: a dictionary containing vlan bindings.'''
         lsw_id_binds = []
         try:
-            lsw_id_binds.extend(db.vlan_bindings.all())
+            with metrics.timer("db"):
+                lsw_id_binds.extend(db.vlan_bindings.all())
         except Exception, e:
             LOG.info("Exception accessing db.vlan_bindings: %s" % e)
 
@@ -506,26 +1337,47 @@ class OVSQuantumTunnelAgent(object):
         '''
         old_local_bindings = {}
         old_vif_ports = {}
+        old_dead_vif_ports_ids = set()
+        resync_deadline = 0
 
         while True:
+            started = time.time()
+            full_resync = started >= resync_deadline
+            if full_resync:
+                resync_deadline = started + RESYNC_INTERVAL
+            self.int_br.defer_apply_on()
+            self.tun_br.defer_apply_on()
+
             # Get bindings from db.
             all_bindings = self.get_db_port_bindings(db)
             all_bindings_vif_port_ids = set(all_bindings.keys())
+            pending = set(vif_id for vif_id, port in all_bindings.items()
+                          if port.op_status != OP_STATUS_UP)
+            for vif_id in pending:
+                self.plug_latency.start(vif_id)
+            self.plug_latency.retain(pending)
             lsw_id_bindings = self.get_db_vlan_bindings(db)
 
             # Get bindings from OVS bridge.
-            vif_ports = self.int_br.get_vif_ports()
+            vif_ports = ovsdb.scan_vif_ports(self.int_br, self.monitor,
+                                             full_resync)
             new_vif_ports = dict([(p.vif_id, p) for p in vif_ports])
             new_vif_ports_ids = set(new_vif_ports.keys())
 
             old_vif_ports_ids = set(old_vif_ports.keys())
             dead_vif_ports_ids = new_vif_ports_ids - all_bindings_vif_port_ids
-            dead_vif_ports = [new_vif_ports[p] for p in dead_vif_ports_ids]
+            # ports already on the dead vlan are left alone until a resync
+            if full_resync:
+                old_dead_vif_ports_ids = set()
+            dead_vif_ports = [new_vif_ports[p] for p in
+                              dead_vif_ports_ids - old_dead_vif_ports_ids]
             disappeared_vif_ports_ids = old_vif_ports_ids - new_vif_ports_ids
             new_local_bindings_ids = all_bindings_vif_port_ids.intersection(
                 new_vif_ports_ids)
-            new_local_bindings = dict([(p, all_bindings.get(p))
-                for p in new_vif_ports_ids])
+            # vif id -> network id, since the ports read from the database
+            # can no longer be loaded once deleted
+            new_local_bindings = dict([(p, all_bindings[p].network_id)
+                for p in new_local_bindings_ids])
             new_bindings = set((p, old_local_bindings.get(p),
                 new_local_bindings.get(p)) for p in new_vif_ports_ids)
             changed_bindings = set([b for b in new_bindings
@@ -542,25 +1394,31 @@ class OVSQuantumTunnelAgent(object):
             LOG.debug('changed_bindings: %s' % changed_bindings)
 
             # Take action.
+            locations = None
+            if self.dynamic_tunnels:
+                locations = self.update_tunnels(
+                    db, all_bindings,
+                    dict((vif_id, new_vif_ports[vif_id])
+                         for vif_id in new_local_bindings_ids))
+
             for p in dead_vif_ports:
                 LOG.info("No quantum binding for port " + str(p)
                          + "putting on dead vlan")
                 self.port_dead(p)
 
             for b in changed_bindings:
-                port_id, old_port, new_port = b
+                port_id, old_net_uuid, new_net_uuid = b
                 p = new_vif_ports[port_id]
-                if old_port:
-                    old_net_uuid = old_port.network_id
+                if old_net_uuid:
                     LOG.info("Removing binding to net-id = " +
                              old_net_uuid + " for " + str(p)
                              + " added to dead vlan")
                     self.port_unbound(p, old_net_uuid)
-                    if not new_port:
+                    metrics.incr("ports_removed")
+                    if not new_net_uuid:
                         self.port_dead(p)
 
-                if new_port:
-                    new_net_uuid = new_port.network_id
+                if new_net_uuid:
                     if new_net_uuid not in lsw_id_bindings:
                         LOG.warn("No ls-id binding found for net-id '%s'" %
                             new_net_uuid)
@@ -569,6 +1427,8 @@ class OVSQuantumTunnelAgent(object):
                     lsw_id = lsw_id_bindings[new_net_uuid]
                     try:
                         self.port_bound(p, new_net_uuid, lsw_id)
+                        metrics.incr("ports_added")
+                        self.plug_latency.stop(port_id)
                         LOG.info("Port " + str(p) + " on net-id = "
                                  + new_net_uuid + " bound to " +
                                  str(self.local_vlan_map[new_net_uuid]))
@@ -579,18 +1439,36 @@ class OVSQuantumTunnelAgent(object):
 
             for vif_id in disappeared_vif_ports_ids:
                 LOG.info("Port Disappeared: " + vif_id)
-                old_port = old_local_bindings.get(vif_id)
-                if old_port:
+                old_net_uuid = old_local_bindings.get(vif_id)
+                if old_net_uuid:
                     try:
                         self.port_unbound(old_vif_ports[vif_id],
-                                          old_port.network_id)
+                                          old_net_uuid)
+                        metrics.incr("ports_removed")
                     except Exception:
-                        LOG.info("Unable to unbind Port " + str(p) +
-                                 " on net-id = " + old_port.network_uuid)
+                        LOG.info("Unable to unbind Port " + vif_id +
+                                 " on net-id = " + old_net_uuid)
+
+            # vlans restored from the state file whose vifs are all gone
+            for net_uuid, lvm in self.local_vlan_map.items():
+                if not lvm.vif_ids:
+                    self.reclaim_local_vlan(net_uuid, lvm)
+
+            if self.l2_population and locations is not None:
+                self.update_forwarding_flows(all_bindings, locations)
 
             old_vif_ports = new_vif_ports
             old_local_bindings = new_local_bindings
-            time.sleep(REFRESH_INTERVAL)
+            old_dead_vif_ports_ids = dead_vif_ports_ids
+            self.int_br.defer_apply_off()
+            self.tun_br.defer_apply_off()
+            if full_resync:
+                self.int_br.reconcile_flows()
+                self.tun_br.reconcile_flows()
+            self.persist_state()
+            metrics.iteration_done(started)
+            ovsdb.wait_for_changes(self.subscriber, self.monitor,
+                                   resync_deadline)
 
 
 def main():
@@ -643,6 +1521,58 @@ def main():
                   % (config_file, str(e)))
         sys.exit(1)
 
+    # Optional push notifications from the plugin.
+    try:
+        notification_address = config.get("NOTIFICATION", "address")
+    except ConfigParser.Error:
+        notification_address = None
+    subscriber = notifier.get_subscriber(notification_address)
+
+    # Optional rootwrap daemon running the commands as root.
+    try:
+        use_rootwrap_daemon = config.getboolean("AGENT", "rootwrap_daemon")
+    except ConfigParser.Error:
+        use_rootwrap_daemon = False
+    rootwrap.configure_daemon(root_helper, use_rootwrap_daemon)
+
+    # Number of independent commands run concurrently.
+    try:
+        command_workers = config.getint("AGENT", "command_workers")
+    except ConfigParser.Error:
+        command_workers = DEFAULT_COMMAND_WORKERS
+    workers.configure(command_workers)
+
+    # Convergence metrics, logged periodically and optionally served on a
+    # local socket.
+    try:
+        stats_socket = config.get("AGENT", "stats_socket")
+    except ConfigParser.Error:
+        stats_socket = None
+    try:
+        stats_interval = config.getint("AGENT", "stats_interval")
+    except ConfigParser.Error:
+        stats_interval = metrics.DEFAULT_STATS_INTERVAL
+    metrics.configure(stats_socket, stats_interval)
+
+    # Optional state file enabling hitless restarts.
+    try:
+        state_file = config.get("AGENT", "state_file")
+    except ConfigParser.Error:
+        state_file = None
+
+    # Watch the Interface table instead of polling it, unless disabled.
+    try:
+        use_ovsdb_monitor = config.getboolean("AGENT", "ovsdb_monitor")
+    except ConfigParser.Error:
+        use_ovsdb_monitor = True
+    monitor = None
+    if use_ovsdb_monitor:
+        monitor = ovsdb.InterfaceMonitor(
+            root_helper,
+            on_change=lambda: subscriber.dispatch(
+                {"event": ovsdb.INTERFACE_EVENT}))
+        monitor.start()
+
     if enable_tunneling:
         # Get parameters for OVSQuantumTunnelAgent
         try:
@@ -651,30 +1581,38 @@ def main():
             if not len(tun_br):
                 raise Exception('Empty tunnel-bridge in configuration file.')
 
-            # Mandatory parameter.
-            remote_ip_file = config.get("OVS", "remote-ip-file")
-            if not len(remote_ip_file):
-                raise Exception('Empty remote-ip-file in configuration file.')
+            # Optional parameter, tunnels are created on demand if unset.
+            try:
+                remote_ip_file = config.get("OVS", "remote-ip-file")
+            except ConfigParser.Error:
+                remote_ip_file = None
 
             # Mandatory parameter.
-            remote_ip_file = config.get("OVS", "remote-ip-file")
             local_ip = config.get("OVS", "local-ip")
             if not len(local_ip):
                 raise Exception('Empty local-ip in configuration file.')
+
+            # Optional parameter, flood to every tunnel if unset.
+            try:
+                l2_population = config.getboolean("OVS", "l2-population")
+            except ConfigParser.Error:
+                l2_population = False
         except Exception, e:
             LOG.error("Error parsing tunnel params in config_file: '%s': %s"
                       % (config_file, str(e)))
             sys.exit(1)
 
         plugin = OVSQuantumTunnelAgent(integ_br, tun_br, remote_ip_file,
-                                       local_ip, root_helper)
+                                       local_ip, root_helper, subscriber,
+                                       monitor, state_file, l2_population)
     else:
         # Get parameters for OVSQuantumAgent.
-        plugin = OVSQuantumAgent(integ_br, root_helper)
+        plugin = OVSQuantumAgent(integ_br, root_helper, subscriber, monitor,
+                                 state_file)
 
     # Start everything.
     options = {"sql_connection": db_connection_url}
-    db = SqlSoup(options["sql_connection"])
+    db = SqlSoup(database.get_engine(options["sql_connection"]))
     LOG.info("Connecting to database \"%s\" on %s" %
              (db.engine.url.database, db.engine.url.host))
 
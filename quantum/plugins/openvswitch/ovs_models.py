@@ -40,3 +40,35 @@ class VlanBinding(BASE):
     def __repr__(self):
         return "<VlanBinding(%s,%s)>" % \
           (self.vlan_id, self.network_id)
+
+
+class TunnelEndpoint(BASE):
+    """Represents a hypervisor terminating GRE tunnels, registered by the
+    tunnel agent running on it"""
+    __tablename__ = 'tunnel_endpoints'
+
+    ip_address = Column(String(64), primary_key=True)
+
+    def __init__(self, ip_address):
+        self.ip_address = ip_address
+
+    def __repr__(self):
+        return "<TunnelEndpoint(%s)>" % self.ip_address
+
+
+class VifLocation(BASE):
+    """Represents the tunnel endpoint a VIF is plugged behind"""
+    __tablename__ = 'vif_locations'
+
+    interface_id = Column(String(255), primary_key=True)
+    ip_address = Column(String(64))
+    mac_address = Column(String(32))
+
+    def __init__(self, interface_id, ip_address, mac_address):
+        self.interface_id = interface_id
+        self.ip_address = ip_address
+        self.mac_address = mac_address
+
+    def __repr__(self):
+        return "<VifLocation(%s,%s,%s)>" % \
+          (self.interface_id, self.ip_address, self.mac_address)
@@ -24,6 +24,7 @@ from optparse import OptionParser
 import os
 import sys
 
+from quantum.agent import notifier
 from quantum.api.api_common import OperationalStatus
 from quantum.common import exceptions as q_exc
 from quantum.common.config import find_config_file
@@ -117,6 +118,13 @@ class OVSQuantumPlugin(QuantumPluginBase):
                       % (vlan_id, network_id))
             self.vmap.already_used(vlan_id, network_id)
 
+        # Push changes to the agents, if they are listening
+        try:
+            notification_address = config.get("NOTIFICATION", "address")
+        except ConfigParser.Error:
+            notification_address = None
+        self.notifier = notifier.get_publisher(notification_address)
+
     def get_all_networks(self, tenant_id, **kwargs):
         nets = []
         for x in db.network_list(tenant_id):
@@ -139,6 +147,8 @@ class OVSQuantumPlugin(QuantumPluginBase):
         LOG.debug("Created network: %s" % net)
         vlan_id = self.vmap.acquire(str(net.uuid))
         ovs_db.add_vlan_binding(vlan_id, str(net.uuid))
+        self.notifier.publish(notifier.NETWORK_CREATE,
+                              network_id=str(net.uuid), vlan_id=vlan_id)
         return self._make_net_dict(str(net.uuid), net.name, [],
                                         net.op_status)
 
@@ -153,6 +163,7 @@ class OVSQuantumPlugin(QuantumPluginBase):
         net = db.network_destroy(net_id)
         ovs_db.remove_vlan_binding(net_id)
         self.vmap.release(net_id)
+        self.notifier.publish(notifier.NETWORK_DELETE, network_id=net_id)
         return self._make_net_dict(str(net.uuid), net.name, [],
                                         net.op_status)
 
@@ -193,11 +204,15 @@ class OVSQuantumPlugin(QuantumPluginBase):
         db.validate_network_ownership(tenant_id, net_id)
         port = db.port_create(net_id, port_state,
                                 op_status=OperationalStatus.DOWN)
+        self.notifier.publish(notifier.PORT_CREATE, network_id=net_id,
+                              port_id=str(port.uuid))
         return self._make_port_dict(port)
 
     def delete_port(self, tenant_id, net_id, port_id):
         db.validate_port_ownership(tenant_id, net_id, port_id)
         port = db.port_destroy(port_id, net_id)
+        self.notifier.publish(notifier.PORT_DELETE, network_id=net_id,
+                              port_id=port_id)
         return self._make_port_dict(port)
 
     def update_port(self, tenant_id, net_id, port_id, **kwargs):
@@ -207,6 +222,9 @@ class OVSQuantumPlugin(QuantumPluginBase):
         db.validate_port_ownership(tenant_id, net_id, port_id)
         port = db.port_get(port_id, net_id)
         db.port_update(port_id, net_id, **kwargs)
+        self.notifier.publish(notifier.PORT_UPDATE, network_id=net_id,
+                              port_id=port_id,
+                              interface_id=port.interface_id)
         return self._make_port_dict(port)
 
     def get_port_details(self, tenant_id, net_id, port_id):
@@ -217,11 +235,16 @@ class OVSQuantumPlugin(QuantumPluginBase):
     def plug_interface(self, tenant_id, net_id, port_id, remote_iface_id):
         db.validate_port_ownership(tenant_id, net_id, port_id)
         db.port_set_attachment(port_id, net_id, remote_iface_id)
+        self.notifier.publish(notifier.PORT_PLUG, network_id=net_id,
+                              port_id=port_id, interface_id=remote_iface_id)
 
     def unplug_interface(self, tenant_id, net_id, port_id):
         db.validate_port_ownership(tenant_id, net_id, port_id)
+        old_iface_id = db.port_get(port_id, net_id).interface_id
         db.port_set_attachment(port_id, net_id, "")
         db.port_update(port_id, net_id, op_status=OperationalStatus.DOWN)
+        self.notifier.publish(notifier.PORT_UNPLUG, network_id=net_id,
+                              port_id=port_id, interface_id=old_iface_id)
 
     def get_interface_details(self, tenant_id, net_id, port_id):
         db.validate_port_ownership(tenant_id, net_id, port_id)
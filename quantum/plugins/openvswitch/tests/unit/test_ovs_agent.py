@@ -0,0 +1,481 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import stubout
+import tempfile
+import unittest
+
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.ext.sqlsoup import SqlSoup
+
+from agent import ovs_quantum_agent
+from quantum.db import models
+import ovs_models
+
+NET_UUID = '3faeebfe-5d37-11e1-a64b-000c29d5f0a7'
+
+
+class FakeBridge(object):
+    """Records the changes an agent makes to a bridge."""
+
+    def __init__(self, br_name, root_helper):
+        self.br_name = br_name
+        self.vif_ports = []
+        self.tags = {}
+        self.calls = []
+        self.flows = []
+
+    def remove_all_flows(self):
+        self.calls.append(('remove_all_flows',))
+
+    def reset_bridge(self):
+        self.calls.append(('reset_bridge',))
+
+    def ensure_bridge(self):
+        self.calls.append(('ensure_bridge',))
+
+    def delete_port(self, port_name):
+        self.calls.append(('delete_port', port_name))
+
+    def add_patch_port(self, local_name, remote_name):
+        self.calls.append(('add_patch_port', local_name))
+        return '1'
+
+    def add_tunnel_port(self, port_name, remote_ip):
+        self.calls.append(('add_tunnel_port', port_name, remote_ip))
+
+    def get_port_name_list(self):
+        return ['patch-int', 'gre-0a000009']
+
+    def get_port_ofport(self, port_name):
+        return '7'
+
+    def defer_apply_on(self):
+        pass
+
+    def defer_apply_off(self):
+        pass
+
+    def add_flow(self, **kwargs):
+        self.calls.append(('add_flow', kwargs.get('match')))
+        self.flows.append(kwargs)
+
+    def delete_flows(self, **kwargs):
+        self.calls.append(('delete_flows', kwargs.get('match')))
+
+    def set_db_attribute(self, table_name, record, column, value):
+        self.calls.append(('set', record, value))
+        self.tags[record] = int(value)
+
+    def db_list(self, table, columns, record=None):
+        return [{'name': name, 'tag': tag}
+                for name, tag in self.tags.items()]
+
+    def get_vif_ports(self, interfaces=None):
+        return self.vif_ports
+
+    def reconcile_flows(self):
+        self.calls.append(('reconcile_flows',))
+
+
+class FakeColumn(object):
+    def __init__(self, name):
+        self.name = name
+
+    def in_(self, values):
+        return lambda row: getattr(row, self.name) in values
+
+
+class FakeTable(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def __getattr__(self, name):
+        return FakeColumn(name)
+
+    def all(self):
+        self.queries += 1
+        return self.rows
+
+    def filter(self, predicate):
+        self.queries += 1
+        return FakeTable([row for row in self.rows if predicate(row)])
+
+
+class FakeRow(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeDB(object):
+    def __init__(self):
+        self.ports = FakeTable([])
+        self.vlan_bindings = FakeTable([])
+        self.statements = []
+
+    bind = None
+
+    @property
+    def session(self):
+        return self
+
+    def execute(self, statement, params):
+        """Apply the port status updates of a StatusReporter."""
+        self.statements.append(str(statement))
+        port_ids = [value for key, value in params.items() if key != 'status']
+        for row in self.ports.rows:
+            if row.uuid in port_ids:
+                row.op_status = params['status']
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class VlanAgentSyncTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(ovs_quantum_agent, 'OVSBridge', FakeBridge)
+        self.agent = ovs_quantum_agent.OVSQuantumAgent('br-int', 'sudo')
+        self.br = self.agent.int_br
+        self.br.calls = []
+        self.db = FakeDB()
+        self.port = ovs_quantum_agent.VifPort('tap0', '5', 'vif0',
+                                              'fa:16:3e:00:00:01', self.br)
+        self.br.vif_ports = [self.port]
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+
+    def _bind(self):
+        binding = FakeRow(uuid='port0', interface_id='vif0',
+                          network_id=NET_UUID, op_status='DOWN')
+        self.db.ports = FakeTable([binding])
+        self.db.vlan_bindings = FakeTable([FakeRow(network_id=NET_UUID,
+                                                   vlan_id=10)])
+        return binding
+
+    def test_dead_port_configured_once(self):
+        self.agent.sync(self.db, True)
+        self.assertEqual(self.br.calls, [('set', 'tap0', '4095'),
+                                         ('add_flow', 'in_port=5'),
+                                         ('reconcile_flows',)])
+        self.br.calls = []
+        self.agent.sync(self.db, False)
+        self.agent.sync(self.db, True)
+        self.assertEqual(self.br.calls, [('reconcile_flows',)])
+
+    def test_bind_and_steady_state(self):
+        self.agent.sync(self.db, False)
+        binding = self._bind()
+        self.br.calls = []
+        self.agent.sync(self.db, False)
+        self.assertEqual(self.br.calls, [('set', 'tap0', '10'),
+                                         ('delete_flows', 'in_port=5')])
+        self.assertEqual(binding.op_status, 'UP')
+        self.br.calls = []
+        self.agent.sync(self.db, False)
+        self.assertEqual(self.br.calls, [])
+        # unchanged statuses are not written again
+        self.assertEqual(len(self.db.statements), 1)
+
+    def test_port_disappeared(self):
+        binding = self._bind()
+        self.agent.sync(self.db, False)
+        self.br.vif_ports = []
+        self.br.calls = []
+        self.agent.sync(self.db, False)
+        self.assertEqual(self.br.calls, [])
+        self.assertEqual(binding.op_status, 'DOWN')
+        self.assertEqual(self.agent.applied_state, {})
+
+    def test_targeted_sync(self):
+        self._bind()
+        port1 = ovs_quantum_agent.VifPort('tap1', '6', 'vif1',
+                                          'fa:16:3e:00:00:02', self.br)
+        self.br.vif_ports.append(port1)
+        self.db.ports.rows.append(FakeRow(uuid='port1', interface_id='vif1',
+                                          network_id=NET_UUID,
+                                          op_status='DOWN'))
+        self.agent.sync(self.db, False)
+        # vif1 is unplugged, and only its binding is read again
+        del self.db.ports.rows[1]
+        self.db.ports.queries = 0
+        self.br.calls = []
+        self.agent.sync(self.db, False, (set(['vif1']), set()))
+        self.assertEqual(self.br.calls, [('set', 'tap1', '4095'),
+                                         ('add_flow', 'in_port=6')])
+        self.assertEqual(self.db.ports.queries, 1)
+        self.assertEqual(self.db.vlan_bindings.queries, 1)
+        self.assertEqual(self.agent.applied_state['vif0'].tag, '10')
+
+    def test_targeted_sync_without_change(self):
+        self._bind()
+        self.agent.sync(self.db, False)
+        self.db.ports.queries = 0
+        self.agent.sync(self.db, False, (set(), set()))
+        # an interface of another host
+        self.agent.sync(self.db, False, (set(['vif9']), set()))
+        self.assertEqual(self.db.ports.queries, 0)
+
+    def test_targeted_sync_new_port(self):
+        self._bind()
+        self.br.vif_ports = []
+        self.agent.sync(self.db, False)
+        self.br.vif_ports = [self.port]
+        self.br.calls = []
+        self.agent.sync(self.db, False, (set(), set()))
+        self.assertEqual(self.br.calls, [('set', 'tap0', '10'),
+                                         ('delete_flows', 'in_port=5')])
+
+    def test_targeted_sync_network_created(self):
+        self._bind()
+        vlan_bindings = self.db.vlan_bindings
+        self.db.vlan_bindings = FakeTable([])
+        self.agent.sync(self.db, False)
+        self.assertEqual(self.br.tags['tap0'], 4095)
+        self.db.vlan_bindings = vlan_bindings
+        self.agent.sync(self.db, False, (set(), set([NET_UUID])))
+        self.assertEqual(self.br.tags['tap0'], 10)
+
+    def test_verify_repairs_tag(self):
+        self._bind()
+        self.agent.sync(self.db, False)
+        # someone retags the port behind our back
+        self.br.tags['tap0'] = 1
+        self.br.calls = []
+        self.agent.sync(self.db, False)
+        self.assertEqual(self.br.calls, [])
+        self.agent.sync(self.db, True)
+        self.assertEqual(self.br.calls, [('set', 'tap0', '10'),
+                                         ('delete_flows', 'in_port=5'),
+                                         ('reconcile_flows',)])
+
+
+class WarmRestartTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(ovs_quantum_agent, 'OVSBridge', FakeBridge)
+        self.state_dir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.state_dir, 'agent.state')
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        shutil.rmtree(self.state_dir)
+
+    def test_vlan_agent(self):
+        agent = ovs_quantum_agent.OVSQuantumAgent(
+            'br-int', 'sudo', state_file=self.state_file)
+        self.assertEqual(agent.int_br.calls[0], ('remove_all_flows',))
+        agent.int_br.vif_ports = [
+            ovs_quantum_agent.VifPort('tap0', '5', 'vif0',
+                                      'fa:16:3e:00:00:01', agent.int_br)]
+        agent.sync(FakeDB(), False)
+        self.assertTrue(os.path.exists(self.state_file))
+
+        agent = ovs_quantum_agent.OVSQuantumAgent(
+            'br-int', 'sudo', state_file=self.state_file)
+        br = agent.int_br
+        # flows are kept and the dead port's drop flow is declared again
+        self.assertEqual(br.calls, [('add_flow', None),
+                                    ('add_flow', 'in_port=5')])
+        self.assertEqual(agent.applied_state.keys(), ['vif0'])
+        br.vif_ports = [
+            ovs_quantum_agent.VifPort('tap0', '5', 'vif0',
+                                      'fa:16:3e:00:00:01', br)]
+        br.calls = []
+        agent.sync(FakeDB(), False)
+        self.assertEqual(br.calls, [])
+
+    def test_tunnel_agent(self):
+        remote_ip_file = os.path.join(self.state_dir, 'remote-ips')
+        open(remote_ip_file, 'w').close()
+        agent = ovs_quantum_agent.OVSQuantumTunnelAgent(
+            'br-int', 'br-tun', remote_ip_file, '10.0.0.1', 'sudo',
+            state_file=self.state_file)
+        self.assertTrue(('reset_bridge',) in agent.tun_br.calls)
+        agent.provision_local_vlan(NET_UUID, 42)
+        lvid = agent.local_vlan_map[NET_UUID].vlan
+        agent.persist_state()
+
+        agent = ovs_quantum_agent.OVSQuantumTunnelAgent(
+            'br-int', 'br-tun', remote_ip_file, '10.0.0.1', 'sudo',
+            state_file=self.state_file)
+        self.assertEqual(agent.int_br.calls, [('add_patch_port', 'patch-tun'),
+                                              ('add_flow', None)])
+        self.assertEqual(agent.tun_br.calls[0], ('ensure_bridge',))
+        self.assertFalse(('remove_all_flows',) in agent.tun_br.calls)
+        self.assertEqual(agent.local_vlan_map[NET_UUID].vlan, lvid)
+        self.assertFalse(lvid in agent.available_local_vlans)
+        cookies = [flow.get('cookie') for flow in agent.tun_br.flows]
+        self.assertEqual(cookies.count(ovs_quantum_agent.flow_cookie(lvid)),
+                         2)
+
+
+class DynamicTunnelTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(ovs_quantum_agent, 'OVSBridge', FakeBridge)
+        engine = sqlalchemy.create_engine('sqlite://')
+        models.BASE.metadata.create_all(engine)
+        self.statements = []
+        event.listen(engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args:
+                     self.statements.append(statement))
+        self.db = SqlSoup(engine)
+        for net_id in ('net-a', 'net-b'):
+            self.db.networks.insert(uuid=net_id, tenant_id='t')
+        for vif_id, net_id in (('vif0', 'net-a'), ('vif1', 'net-a'),
+                               ('vif2', 'net-b')):
+            self.db.ports.insert(uuid='port-' + vif_id, network_id=net_id,
+                                 interface_id=vif_id)
+        self.db.tunnel_endpoints.insert(ip_address='10.0.0.2')
+        self.db.tunnel_endpoints.insert(ip_address='10.0.0.3')
+        self.db.vif_locations.insert(interface_id='vif1',
+                                     ip_address='10.0.0.2',
+                                     mac_address='fa:16:3e:00:00:02')
+        self.db.vif_locations.insert(interface_id='vif2',
+                                     ip_address='10.0.0.3',
+                                     mac_address='fa:16:3e:00:00:03')
+        self.db.commit()
+        self.agent = ovs_quantum_agent.OVSQuantumTunnelAgent(
+            'br-int', 'br-tun', None, '10.0.0.1', 'sudo')
+        self.br = self.agent.tun_br
+        self.br.calls = []
+        self.port = ovs_quantum_agent.VifPort('tap0', '5', 'vif0',
+                                              'fa:16:3e:00:00:01', self.br)
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+
+    def _update(self, local_vif_ports):
+        bindings = self.agent.get_db_port_bindings(self.db)
+        self.agent.update_tunnels(self.db, bindings, local_vif_ports)
+
+    def test_tunnel_port_name(self):
+        name = ovs_quantum_agent.tunnel_port_name('10.0.0.1')
+        self.assertEqual(name, 'gre-0a000001')
+        self.assertEqual(ovs_quantum_agent.tunnel_port_ip(name), '10.0.0.1')
+        self.assertEqual(ovs_quantum_agent.tunnel_port_ip('gre-0'), None)
+
+    def test_no_static_mesh(self):
+        self.assertTrue(self.agent.dynamic_tunnels)
+        self.assertEqual(self.agent.tunnel_ports, {})
+
+    def test_tunnels_follow_networks(self):
+        self.agent.update_tunnels(self.db, {}, {})
+        self.assertEqual(self.br.calls, [])
+        self.assertTrue(self.db.tunnel_endpoints.get('10.0.0.1'))
+
+        self._update({'vif0': self.port})
+        # only 10.0.0.2 has a vif on net-a
+        self.assertEqual(self.br.calls, [('add_tunnel_port', 'gre-0a000002',
+                                          '10.0.0.2')])
+        location = self.db.vif_locations.get('vif0')
+        self.assertEqual(location.ip_address, '10.0.0.1')
+        self.assertEqual(location.mac_address, 'fa:16:3e:00:00:01')
+
+        self.br.calls = []
+        self._update({'vif0': self.port})
+        self.assertEqual(self.br.calls, [])
+
+        self._update({})
+        self.assertEqual(self.br.calls, [('delete_port', 'gre-0a000002')])
+        self.assertEqual(self.db.vif_locations.get('vif0'), None)
+        self.assertEqual(self.agent.tunnel_ports, {})
+
+    def test_steady_state_queries(self):
+        agent = ovs_quantum_agent.OVSQuantumTunnelAgent(
+            'br-int', 'br-tun', None, '10.0.0.1', 'sudo', l2_population=True)
+
+        def iteration():
+            self.statements = []
+            bindings = agent.get_db_port_bindings(self.db)
+            locations = agent.update_tunnels(self.db, bindings,
+                                             {'vif0': self.port})
+            agent.update_forwarding_flows(bindings, locations)
+            return len(self.statements)
+
+        iteration()
+        # the ports, vif locations and tunnel endpoints
+        self.assertEqual(iteration(), 3)
+        for i in range(20):
+            vif_id = 'vif-remote%d' % i
+            self.db.ports.insert(uuid='port-' + vif_id, network_id='net-a',
+                                 interface_id=vif_id)
+            self.db.vif_locations.insert(interface_id=vif_id,
+                                         ip_address='10.0.0.3',
+                                         mac_address='fa:16:3e:00:01:%02x'
+                                         % i)
+        self.db.commit()
+        iteration()
+        # no query per port
+        self.assertEqual(iteration(), 3)
+
+    def test_adopt_tunnel_ports(self):
+        self.agent.adopt_tunnel_ports()
+        self.assertEqual(self.agent.tunnel_ports,
+                         {'10.0.0.9': 'gre-0a000009'})
+
+    def test_l2_population(self):
+        agent = ovs_quantum_agent.OVSQuantumTunnelAgent(
+            'br-int', 'br-tun', None, '10.0.0.1', 'sudo', l2_population=True)
+        br = agent.tun_br
+        bindings = agent.get_db_port_bindings(self.db)
+        locations = agent.update_tunnels(self.db, bindings,
+                                         {'vif0': self.port})
+        self.assertEqual(agent.tunnel_ofports, {'10.0.0.2': '7'})
+        agent.port_bound(self.port, 'net-a', 1)
+        lvid = agent.local_vlan_map['net-a'].vlan
+        # no flooding through the normal action
+        self.assertEqual(br.flows[-1]['match'], 'tun_id=1')
+
+        br.flows = []
+        agent.update_forwarding_flows(bindings, locations)
+        self.assertEqual([(f['priority'], f['match'], f['actions'])
+                          for f in br.flows],
+                         [(4, 'in_port=1,dl_vlan=%s' % lvid,
+                           'strip_vlan,set_tunnel:1,output:7'),
+                          (5, 'in_port=1,dl_vlan=%s,dl_dst=fa:16:3e:00:00:02'
+                           % lvid, 'strip_vlan,set_tunnel:1,output:7')])
+
+        br.flows = []
+        br.calls = []
+        agent.update_forwarding_flows(bindings, locations)
+        self.assertEqual(br.calls, [])
+
+        # the only remote vif of net-a goes away
+        self.db.vif_locations.filter_by(interface_id='vif1').delete()
+        self.db.commit()
+        locations = agent.update_tunnels(self.db, bindings,
+                                         {'vif0': self.port})
+        br.calls = []
+        agent.update_forwarding_flows(bindings, locations)
+        self.assertEqual(br.calls, [
+            ('add_flow', 'in_port=1,dl_vlan=%s' % lvid),
+            ('delete_flows', 'in_port=1,dl_vlan=%s,dl_dst=fa:16:3e:00:00:02'
+             % lvid)])
+        self.assertEqual(br.flows[-1]['actions'], 'drop')
+        self.assertEqual(agent.tunnel_ofports, {})
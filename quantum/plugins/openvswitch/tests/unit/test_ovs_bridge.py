@@ -0,0 +1,317 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import logging
+import time
+import unittest
+
+from agent import ovs_quantum_agent
+from quantum.agent import workers
+
+LOG = logging.getLogger("quantum.plugins.openvswitch.tests.unit."
+                        "test_ovs_bridge")
+
+BR_NAME = 'br-int'
+
+
+def fake_interface_table(num_ports, other_bridge_ports=0):
+    """Return (list-ports output, list Interface JSON output)."""
+    rows = []
+    names = []
+    for i in range(num_ports):
+        name = 'tap%d' % i
+        names.append(name)
+        rows.append([name,
+                     ['map', [['attached-mac', 'fa:16:3e:00:%02x:%02x' %
+                               (i / 256, i % 256)],
+                              ['iface-id', 'vif-%d' % i],
+                              ['iface-status', 'active']]],
+                     i + 1])
+    for i in range(other_bridge_ports):
+        rows.append(['eth%d' % i, ['map', []], 1000 + i])
+    table = {'headings': ['name', 'external_ids', 'ofport'], 'data': rows}
+    return "".join(n + "\n" for n in names), json.dumps(table)
+
+
+class FakeRunCmdBridge(ovs_quantum_agent.OVSBridge):
+    """OVSBridge answering ovs-vsctl from canned output."""
+
+    def __init__(self, list_ports, list_interface):
+        ovs_quantum_agent.OVSBridge.__init__(self, BR_NAME, 'sudo')
+        self.list_ports = list_ports
+        self.list_interface = list_interface
+        self.calls = []
+        self.inputs = []
+        self.flows = ""
+
+    def run_cmd(self, args, process_input=None):
+        self.calls.append(args)
+        self.inputs.append(process_input)
+        if 'list-ports' in args:
+            return self.list_ports
+        if 'list' in args and 'Interface' in args:
+            return self.list_interface
+        if 'dump-flows' in args:
+            return self.flows
+        return ''
+
+
+class OVSBridgeTest(unittest.TestCase):
+
+    def test_get_vif_ports(self):
+        list_ports, list_interface = fake_interface_table(3, 2)
+        br = FakeRunCmdBridge(list_ports, list_interface)
+        ports = br.get_vif_ports()
+        self.assertEqual([p.port_name for p in ports],
+                         ['tap0', 'tap1', 'tap2'])
+        self.assertEqual(ports[1].vif_id, 'vif-1')
+        self.assertEqual(ports[1].vif_mac, 'fa:16:3e:00:00:01')
+        self.assertEqual(ports[1].ofport, '2')
+        self.assertEqual(len(br.calls), 2)
+
+    def test_get_vif_ports_unassigned_ofport(self):
+        table = {'headings': ['name', 'external_ids', 'ofport'],
+                 'data': [['tap0',
+                           ['map', [['attached-mac', 'fa:16:3e:00:00:01'],
+                                    ['iface-id', 'vif-0']]],
+                           ['set', []]]]}
+        br = FakeRunCmdBridge("tap0\n", json.dumps(table))
+        self.assertEqual(br.get_vif_ports()[0].ofport, '[]')
+
+    def test_get_vif_ports_xapi(self):
+        table = {'headings': ['name', 'external_ids', 'ofport'],
+                 'data': [['vif%d.0' % i,
+                           ['map', [['attached-mac', 'fa:16:3e:00:00:0%d' % i],
+                                    ['xs-vif-uuid', 'uuid%d' % i]]], i + 1]
+                          for i in range(3)]}
+        br = FakeRunCmdBridge("vif0.0\nvif1.0\nvif2.0\n", json.dumps(table))
+        br.get_xapi_iface_id = lambda uuid: 'iface-' + uuid
+        original = workers.get_pool()
+        workers.configure(2)
+        try:
+            ports = br.get_vif_ports()
+        finally:
+            workers._pool = original
+        self.assertEqual([p.vif_id for p in ports],
+                         ['iface-uuid0', 'iface-uuid1', 'iface-uuid2'])
+
+    def test_get_vif_ports_bad_output(self):
+        br = FakeRunCmdBridge("tap0\n", "ovs-vsctl: unix:...: Connection "
+                              "refused")
+        self.assertEqual(br.get_vif_ports(), [])
+
+    def test_db_get_map(self):
+        table = {'headings': ['statistics'],
+                 'data': [[['map', [['rx_bytes', 10], ['tx_bytes', 20]]]]]}
+        br = FakeRunCmdBridge("", json.dumps(table))
+        self.assertEqual(br.get_port_stats('tap0'),
+                         {'rx_bytes': 10, 'tx_bytes': 20})
+        self.assertEqual(br.calls[0][-3:], ['list', 'Interface', 'tap0'])
+
+    def test_get_vif_ports_benchmark(self):
+        list_ports, list_interface = fake_interface_table(1000, 10)
+        br = FakeRunCmdBridge(list_ports, list_interface)
+        start = time.time()
+        ports = br.get_vif_ports()
+        elapsed = time.time() - start
+        LOG.info("get_vif_ports with 1000 ports: %d ovs-vsctl calls, "
+                 "%.3fs" % (len(br.calls), elapsed))
+        self.assertEqual(len(ports), 1000)
+        self.assertEqual(len(br.calls), 2)
+
+    def test_immediate_commands(self):
+        br = FakeRunCmdBridge("", "")
+        br.set_db_attribute('Port', 'tap0', 'tag', '1')
+        br.add_flow(priority=2, match='in_port=1', actions='drop')
+        br.delete_flows(match='in_port=1')
+        self.assertEqual(br.calls, [
+            ['ovs-vsctl', '--timeout=2', '--', 'set', 'Port', 'tap0',
+             'tag=1'],
+            ['ovs-ofctl', 'add-flow', BR_NAME,
+             'cookie=0x5154000000000000,priority=2,in_port=1,actions=drop'],
+            ['ovs-ofctl', 'del-flows', BR_NAME, 'in_port=1']])
+
+    def test_deferred_commands(self):
+        br = FakeRunCmdBridge("", "")
+        br.defer_apply_on()
+        br.delete_port('tap0')
+        br.set_db_attribute('Port', 'tap1', 'tag', '1')
+        br.add_flow(priority=2, match='in_port=1', actions='drop')
+        br.add_flow(priority=2, match='in_port=2', actions='drop')
+        br.delete_flows(match='in_port=1')
+        br.add_flow(priority=2, match='in_port=3', actions='drop')
+        self.assertEqual(br.calls, [])
+        br.defer_apply_off()
+        self.assertEqual(br.calls, [
+            ['ovs-vsctl', '--timeout=2',
+             '--', '--if-exists', 'del-port', BR_NAME, 'tap0',
+             '--', 'set', 'Port', 'tap1', 'tag=1'],
+            ['ovs-ofctl', 'add-flows', BR_NAME, '-'],
+            ['ovs-ofctl', 'del-flows', BR_NAME, '-'],
+            ['ovs-ofctl', 'add-flows', BR_NAME, '-']])
+        self.assertEqual(br.inputs[1:], [
+            'cookie=0x5154000000000000,priority=2,in_port=1,actions=drop\n'
+            'cookie=0x5154000000000000,priority=2,in_port=2,actions=drop\n',
+            'in_port=1\n',
+            'cookie=0x5154000000000000,priority=2,in_port=3,actions=drop\n'])
+        self.assertFalse(br.defer_apply)
+
+    def test_deferred_tunnel_mesh(self):
+        br = FakeRunCmdBridge("", "")
+        br.defer_apply_on()
+        for i in range(500):
+            self.assertEqual(br.add_tunnel_port('gre-%d' % i,
+                                                '10.0.%d.%d' % (i / 256,
+                                                                i % 256)),
+                             None)
+        br.defer_apply_off()
+        self.assertEqual(len(br.calls), 1)
+        self.assertEqual(br.calls[0].count('add-port'), 500)
+
+    def test_read_flushes_deferred(self):
+        br = FakeRunCmdBridge("", "")
+        br.defer_apply_on()
+        br.add_patch_port('patch-tun', 'patch-int')
+        self.assertEqual(br.calls[0][2:], [
+            '--', '--may-exist', 'add-port', BR_NAME, 'patch-tun',
+            '--', 'set', 'Interface', 'patch-tun', 'type=patch',
+            'options:peer=patch-int'])
+        self.assertEqual(br.calls[1][2:],
+                         ['get', 'Interface', 'patch-tun', 'ofport'])
+
+    def test_remove_all_flows_drops_pending(self):
+        br = FakeRunCmdBridge("", "")
+        br.defer_apply_on()
+        br.add_flow(priority=2, match='in_port=1', actions='drop')
+        br.remove_all_flows()
+        br.defer_apply_off()
+        self.assertEqual(br.calls,
+                         [['ovs-ofctl', 'del-flows', BR_NAME]])
+
+    def test_get_vif_ports_from_replica(self):
+        list_ports, list_interface = fake_interface_table(2)
+        br = FakeRunCmdBridge(list_ports, list_interface)
+        interfaces = [{'name': 'tap1', 'ofport': 7,
+                       'external_ids': {'iface-id': 'vif-1',
+                                        'attached-mac': 'fa:16:3e:00:00:01'}}]
+        ports = br.get_vif_ports(interfaces)
+        self.assertEqual([(p.vif_id, p.ofport) for p in ports],
+                         [('vif-1', '7')])
+        # only list-ports was run
+        self.assertEqual(len(br.calls), 1)
+        # the port list is reused until the set of interfaces changes
+        br.get_vif_ports(interfaces)
+        self.assertEqual(len(br.calls), 1)
+        br.get_vif_ports(interfaces + [{'name': 'tap9', 'ofport': 8,
+                                        'external_ids': {}}])
+        self.assertEqual(len(br.calls), 2)
+
+
+DUMP_FLOWS = """NXST_FLOW reply (xid=0x4):
+ cookie=0x5154000000000000, duration=10.2s, table=0, n_packets=0, \
+n_bytes=0, idle_age=10, priority=1 actions=drop
+ cookie=0x515400000000000a, duration=5.1s, table=0, n_packets=3, \
+n_bytes=180, priority=3,tun_id=0x2a actions=mod_vlan_vid:10,output:1
+ cookie=0x5154000000000009, duration=5.1s, table=0, n_packets=0, \
+n_bytes=0, priority=3,tun_id=0x29 actions=mod_vlan_vid:9,output:1
+ cookie=0x0, duration=99.0s, table=0, n_packets=0, n_bytes=0, \
+priority=5,in_port=7 actions=drop
+"""
+
+
+class FlowReconcileTest(unittest.TestCase):
+
+    def test_parse_flow(self):
+        lines = DUMP_FLOWS.splitlines()
+        self.assertEqual(ovs_quantum_agent.parse_flow(lines[0]), None)
+        flow = ovs_quantum_agent.parse_flow(lines[2])
+        self.assertEqual(flow, {'cookie': 0x515400000000000a,
+                                'priority': 3,
+                                'match': 'tun_id=0x2a',
+                                'actions': 'mod_vlan_vid:10,output:1'})
+
+    def test_parse_match(self):
+        self.assertEqual(ovs_quantum_agent.parse_match('tun_id=0x2a,ip'),
+                         ovs_quantum_agent.parse_match('ip, tun_id=42'))
+        self.assertNotEqual(ovs_quantum_agent.parse_match('in_port=1'),
+                            ovs_quantum_agent.parse_match('in_port=2'))
+
+    def test_parse_actions(self):
+        self.assertEqual(
+            ovs_quantum_agent.parse_actions('set_tunnel:42,normal'),
+            ovs_quantum_agent.parse_actions('set_tunnel:0x2a,NORMAL'))
+        self.assertEqual(
+            ovs_quantum_agent.parse_actions('resubmit(,1),output:2'),
+            (('resubmit(,1)', ''), ('output', 2)))
+        self.assertNotEqual(
+            ovs_quantum_agent.parse_actions('output:1,strip_vlan'),
+            ovs_quantum_agent.parse_actions('strip_vlan,output:1'))
+
+    def test_delete_flows_by_cookie(self):
+        br = FakeRunCmdBridge("", "")
+        cookie = ovs_quantum_agent.flow_cookie(10)
+        br.add_flow(priority=3, match='tun_id=42', actions='drop',
+                    cookie=cookie)
+        br.add_flow(priority=1, actions='drop')
+        br.delete_flows(cookie=cookie)
+        self.assertEqual(br.calls[-1],
+                         ['ovs-ofctl', 'del-flows', BR_NAME,
+                          'cookie=0x515400000000000a/-1'])
+        self.assertEqual(len(br.desired_flows), 1)
+
+    def test_reconcile_flows(self):
+        br = FakeRunCmdBridge("", "")
+        br.add_flow(priority=1, actions='drop')
+        br.add_flow(priority=3, match='tun_id=42',
+                    actions='mod_vlan_vid:10,output:1',
+                    cookie=ovs_quantum_agent.flow_cookie(10))
+        br.add_flow(priority=3, match='tun_id=43',
+                    actions='mod_vlan_vid:11,output:1',
+                    cookie=ovs_quantum_agent.flow_cookie(11))
+        br.flows = DUMP_FLOWS
+        br.calls = []
+        br.inputs = []
+        self.assertEqual(br.reconcile_flows(), (1, 1))
+        self.assertEqual(br.calls[1:], [
+            ['ovs-ofctl', 'del-flows', BR_NAME, '--strict', '-'],
+            ['ovs-ofctl', 'add-flows', BR_NAME, '-']])
+        # the flow without an agent cookie is left alone
+        self.assertEqual(br.inputs[1:], [
+            'priority=3,tun_id=0x29\n',
+            'cookie=0x515400000000000b,priority=3,tun_id=43,'
+            'actions=mod_vlan_vid:11,output:1\n'])
+
+    def test_reconcile_flows_actions_changed(self):
+        br = FakeRunCmdBridge("", "")
+        br.add_flow(priority=3, match='tun_id=42',
+                    actions='mod_vlan_vid:12,output:1',
+                    cookie=ovs_quantum_agent.flow_cookie(10))
+        br.flows = DUMP_FLOWS.splitlines()[2]
+        br.calls = []
+        br.inputs = []
+        self.assertEqual(br.reconcile_flows(), (1, 0))
+        self.assertEqual(br.inputs[1:], [
+            'cookie=0x515400000000000a,priority=3,tun_id=42,'
+            'actions=mod_vlan_vid:12,output:1\n'])
+
+    def test_reconcile_flows_in_sync(self):
+        br = FakeRunCmdBridge("", "")
+        br.add_flow(priority=1, actions='drop')
+        br.flows = DUMP_FLOWS.splitlines()[1]
+        br.calls = []
+        self.assertEqual(br.reconcile_flows(), (0, 0))
+        self.assertEqual(len(br.calls), 1)
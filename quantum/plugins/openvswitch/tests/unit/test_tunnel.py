@@ -42,7 +42,10 @@ VIF_PORT = ovs_quantum_agent.VifPort('port', 'ofport', VIF_ID, VIF_MAC,
 
 class DummyPort:
     def __init__(self, interface_id):
+        self.uuid = 'port-' + interface_id
+        self.network_id = NET_UUID
         self.interface_id = interface_id
+        self.op_status = 'DOWN'
 
 
 class DummyVlanBinding:
@@ -76,6 +79,8 @@ class TunnelTest(unittest.TestCase):
         self.mock_tun_bridge.reset_bridge()
         self.mock_tun_bridge.add_patch_port(
             'patch-int', 'patch-tun').AndReturn(self.INT_OFPORT)
+        self.mock_tun_bridge.defer_apply_on()
+        self.mock_tun_bridge.defer_apply_off()
         self.mock_tun_bridge.remove_all_flows()
         self.mock_tun_bridge.add_flow(priority=1, actions='drop')
 
@@ -96,12 +101,16 @@ class TunnelTest(unittest.TestCase):
         match_string = 'in_port=%s,dl_vlan=%s' % (self.INT_OFPORT, LV_ID)
         action_string = 'set_tunnel:%s,normal' % LS_ID
         self.mock_tun_bridge.add_flow(priority=4, match=match_string,
-                                      actions=action_string)
+                                      actions=action_string,
+                                      cookie=ovs_quantum_agent.flow_cookie(
+                                          LV_ID))
 
         match_string = 'tun_id=%s' % LS_ID
         action_string = 'mod_vlan_vid:%s,output:%s' % (LV_ID, self.INT_OFPORT)
         self.mock_tun_bridge.add_flow(priority=3, match=match_string,
-                                      actions=action_string)
+                                      actions=action_string,
+                                      cookie=ovs_quantum_agent.flow_cookie(
+                                          LV_ID))
 
         self.mox.ReplayAll()
 
@@ -115,11 +124,8 @@ class TunnelTest(unittest.TestCase):
         self.mox.VerifyAll()
 
     def testReclaimLocalVlan(self):
-        match_string = 'tun_id=%s' % LVM.lsw_id
-        self.mock_tun_bridge.delete_flows(match=match_string)
-
-        match_string = 'dl_vlan=%s' % LVM.vlan
-        self.mock_tun_bridge.delete_flows(match=match_string)
+        self.mock_tun_bridge.delete_flows(
+            cookie=ovs_quantum_agent.flow_cookie(LVM.vlan))
 
         self.mox.ReplayAll()
         a = ovs_quantum_agent.OVSQuantumTunnelAgent(self.INT_BRIDGE,
@@ -165,8 +171,10 @@ class TunnelTest(unittest.TestCase):
             'tag', ovs_quantum_agent.DEAD_VLAN_TAG)
 
         match_string = 'in_port=%s' % VIF_PORT.ofport
-        self.mock_int_bridge.add_flow(priority=2, match=match_string,
-                                      actions='drop')
+        self.mock_int_bridge.add_flow(
+            priority=2, match=match_string, actions='drop',
+            cookie=ovs_quantum_agent.flow_cookie(
+                ovs_quantum_agent.DEAD_VLAN_TAG))
 
         self.mox.ReplayAll()
         a = ovs_quantum_agent.OVSQuantumTunnelAgent(self.INT_BRIDGE,
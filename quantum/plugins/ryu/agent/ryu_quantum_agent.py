@@ -21,21 +21,30 @@
 # @author: Isaku Yamahata
 import ConfigParser
 import logging as LOG
-import shlex
 import signal
 import sys
 import time
 from optparse import OptionParser
 from sqlalchemy.ext.sqlsoup import SqlSoup
-from subprocess import PIPE, Popen
 
 from ryu.app import rest_nw_id
-from ryu.app.client import OFPClient
+
+from quantum.agent import database
+from quantum.agent import metrics
+from quantum.agent import notifier
+from quantum.agent import ovsdb
+from quantum.agent import rootwrap
+from quantum.agent import status
+from quantum.plugins.ryu.rest_client import OFPClient
 
 
 OP_STATUS_UP = "UP"
 OP_STATUS_DOWN = "DOWN"
 
+# Interval of the full rescan done even when the ovsdb monitor and the
+# plugin notifications are both available.
+RESYNC_INTERVAL = 60
+
 
 class VifPort:
     """
@@ -63,6 +72,8 @@ class OVSBridge:
         self.br_name = br_name
         self.root_helper = root_helper
         self.datapath_id = None
+        self._interface_names = None
+        self._port_names = None
 
     def find_datapath_id(self):
         # ovs-vsctl get Bridge br-int datapath_id
@@ -73,11 +84,9 @@ class OVSBridge:
         self.datapath_id = dp_id
 
     def run_cmd(self, args):
-        cmd = shlex.split(self.root_helper) + args
-        pipe = Popen(cmd, stdout=PIPE)
-        retval = pipe.communicate()[0]
-        if pipe.returncode == -(signal.SIGALRM):
-            LOG.debug("## timeout running command: " + " ".join(cmd))
+        returncode, retval, stderr = rootwrap.execute(self.root_helper, args)
+        if returncode == -(signal.SIGALRM):
+            LOG.debug("## timeout running command: " + " ".join(args))
         return retval
 
     def run_vsctl(self, args):
@@ -91,24 +100,9 @@ class OVSBridge:
             target = "tcp:" + target
         self.run_vsctl(["set-controller", self.br_name, target])
 
-    def db_get_map(self, table, record, column):
-        str_ = self.run_vsctl(["get", table, record, column]).rstrip("\n\r")
-        return self.db_str_to_map(str_)
-
     def db_get_val(self, table, record, column):
         return self.run_vsctl(["get", table, record, column]).rstrip("\n\r")
 
-    @staticmethod
-    def db_str_to_map(full_str):
-        list = full_str.strip("{}").split(", ")
-        ret = {}
-        for elem in list:
-            if elem.find("=") == -1:
-                continue
-            arr = elem.split("=")
-            ret[arr[0]] = arr[1].strip("\"")
-        return ret
-
     def get_port_name_list(self):
         res = self.run_vsctl(["list-ports", self.br_name])
         return res.split("\n")[:-1]
@@ -121,44 +115,57 @@ class OVSBridge:
                         "param-key=nicira-iface-id",
                         "uuid=%s" % xs_vif_uuid]).strip()
 
-    def _vifport(self, name, external_ids):
-        ofport = self.db_get_val("Interface", name, "ofport")
-        return VifPort(name, ofport, external_ids["iface-id"],
-                       external_ids["attached-mac"], self)
+    def _get_ports(self, get_port, interfaces=None):
+        """Build ports from a single snapshot of the Interface table.
 
-    def _get_ports(self, get_port):
+        get_port is called with the name, external_ids and ofport of every
+        interface attached to this bridge. interfaces may be given as a
+        list of Interface records, e.g. from an ovsdb.InterfaceMonitor, to
+        avoid reading the Interface table.
+        """
         ports = []
-        port_names = self.get_port_name_list()
-        for name in port_names:
-            port = get_port(name)
+        if interfaces is None:
+            port_names = set(self.get_port_name_list())
+            interfaces = ovsdb.db_list(self.run_vsctl, "Interface",
+                                       ovsdb.INTERFACE_COLUMNS)
+        else:
+            # Only list the bridge ports again when interfaces come or go
+            interface_names = set(i["name"] for i in interfaces)
+            if interface_names != self._interface_names:
+                self._port_names = set(self.get_port_name_list())
+                self._interface_names = interface_names
+            port_names = self._port_names
+        for interface in interfaces:
+            name = interface["name"]
+            if name not in port_names:
+                continue
+            port = get_port(name, interface["external_ids"] or {},
+                            str(interface["ofport"]))
             if port:
                 ports.append(port)
 
         return ports
 
-    def _get_vif_port(self, name):
-        external_ids = self.db_get_map("Interface", name, "external_ids")
+    def _get_vif_port(self, name, external_ids, ofport):
         if "iface-id" in external_ids and "attached-mac" in external_ids:
-            return self._vifport(name, external_ids)
+            return VifPort(name, ofport, external_ids["iface-id"],
+                           external_ids["attached-mac"], self)
         elif ("xs-vif-uuid" in external_ids and
               "attached-mac" in external_ids):
             # if this is a xenserver and iface-id is not automatically
             # synced to OVS from XAPI, we grab it from XAPI directly
-            ofport = self.db_get_val("Interface", name, "ofport")
             iface_id = self.get_xapi_iface_id(external_ids["xs-vif-uuid"])
             return VifPort(name, ofport, iface_id,
                            external_ids["attached-mac"], self)
 
-    def get_vif_ports(self):
+    def get_vif_ports(self, interfaces=None):
         "returns a VIF object for each VIF port"
-        return self._get_ports(self._get_vif_port)
+        return self._get_ports(self._get_vif_port, interfaces)
 
-    def _get_external_port(self, name):
-        external_ids = self.db_get_map("Interface", name, "external_ids")
+    def _get_external_port(self, name, external_ids, ofport):
         if external_ids:
             return
 
-        ofport = self.db_get_val("Interface", name, "ofport")
         return VifPort(name, ofport, None, None, self)
 
     def get_external_ports(self):
@@ -193,8 +200,15 @@ def check_ofp_mode(db):
 
 
 class OVSQuantumOFPRyuAgent:
-    def __init__(self, integ_br, db, root_helper):
+    def __init__(self, integ_br, db, root_helper, subscriber=None,
+                 monitor=None):
         self.root_helper = root_helper
+        self.subscriber = subscriber or notifier.NullSubscriber()
+        self.monitor = monitor
+        self.plug_latency = metrics.LatencyTracker("plug_to_up")
+        self.status = status.StatusReporter()
+        # vif id -> (network id, ofport) registered with the REST API
+        self.applied_state = {}
         (ofp_controller_addr, ofp_rest_api_addr) = check_ofp_mode(db)
 
         self.nw_id_external = rest_nw_id.NW_ID_EXTERNAL
@@ -205,73 +219,134 @@ class OVSQuantumOFPRyuAgent:
         self.int_br = OVSBridge(integ_br, self.root_helper)
         self.int_br.find_datapath_id()
         self.int_br.set_controller(ofp_controller_addr)
-        for port in self.int_br.get_external_ports():
-            self._port_update(self.nw_id_external, port)
-
-    def _port_update(self, network_id, port):
-        self.api.update_port(network_id, port.switch.datapath_id, port.ofport)
-
-    def _all_bindings(self, db):
-        """return interface id -> port which include network id bindings"""
-        return dict((port.interface_id, port) for port in db.ports.all())
-
-    def daemon_loop(self, db):
-        # on startup, register all existing ports
-        all_bindings = self._all_bindings(db)
-
-        local_bindings = {}
-        vif_ports = {}
-        for port in self.int_br.get_vif_ports():
-            vif_ports[port.vif_id] = port
-            if port.vif_id in all_bindings:
-                net_id = all_bindings[port.vif_id].network_id
-                local_bindings[port.vif_id] = net_id
-                self._port_update(net_id, port)
-                all_bindings[port.vif_id].op_status = OP_STATUS_UP
-                LOG.info("Updating binding to net-id = %s for %s",
-                         net_id, str(port))
-        db.commit()
-
-        old_vif_ports = vif_ports
-        old_local_bindings = local_bindings
-
-        while True:
-            all_bindings = self._all_bindings(db)
-
-            new_vif_ports = {}
-            new_local_bindings = {}
-            for port in self.int_br.get_vif_ports():
-                new_vif_ports[port.vif_id] = port
-                if port.vif_id in all_bindings:
-                    net_id = all_bindings[port.vif_id].network_id
-                    new_local_bindings[port.vif_id] = net_id
-
-                old_b = old_local_bindings.get(port.vif_id)
-                new_b = new_local_bindings.get(port.vif_id)
-                if old_b == new_b:
-                    continue
-
-                if not old_b:
+        self._ports_update([(self.nw_id_external, port)
+                            for port in self.int_br.get_external_ports()])
+
+    def _ports_update(self, network_ports):
+        """Register a list of (network id, VifPort) tuples at once."""
+        self.api.update_ports([(network_id, port.switch.datapath_id,
+                                port.ofport)
+                               for network_id, port in network_ports])
+
+    def _get_bindings(self, db, vif_ids=None):
+        """return interface id -> port which include network id bindings
+
+        If vif_ids is given, only the ports attached to these interfaces
+        are read.
+        """
+        with metrics.timer("db"):
+            if vif_ids is None:
+                ports = db.ports.all()
+            elif vif_ids:
+                ports = db.ports.filter(
+                    db.ports.interface_id.in_(list(vif_ids))).all()
+            else:
+                ports = []
+        pending = set(port.uuid for port in ports
+                      if port.op_status != OP_STATUS_UP)
+        for port_id in pending:
+            self.plug_latency.start(port_id)
+        if vif_ids is None:
+            self.plug_latency.retain(pending)
+            self.status.retain(set(port.uuid for port in ports))
+        return dict((port.interface_id, port) for port in ports)
+
+    def _changed_vif_ids(self, vif_ports, interface_ids):
+        """Return the local interfaces named in events, or which changed"""
+        vif_ids = set()
+        present = set()
+        for port in vif_ports:
+            present.add(port.vif_id)
+            if port.vif_id in interface_ids or \
+               self.applied_state.get(port.vif_id,
+                                      (None, None))[1] != port.ofport:
+                vif_ids.add(port.vif_id)
+        vif_ids.update(set(self.applied_state) - present)
+        return vif_ids
+
+    def _set_status(self, port, op_status):
+        self.status.update(port.uuid, op_status, port.op_status)
+
+    def _commit(self, db):
+        for port_id, op_status in self.status.flush(db).items():
+            if op_status == OP_STATUS_UP:
+                self.plug_latency.stop(port_id)
+
+    def sync(self, db, full_resync, targets=None):
+        """Register the changed bindings and bring op_status up to date.
+
+        Only ports whose binding or ofport changed since the previous call
+        are sent to the REST API. A full resync also rereads the Interface
+        table instead of relying on the ovsdb monitor. If targets holds the
+        (interface ids, network ids) named in plugin events, only those
+        interfaces and the ones which appeared, moved or vanished on the
+        bridge are read from the database.
+        """
+        vif_ports = ovsdb.scan_vif_ports(self.int_br, self.monitor,
+                                         full_resync)
+        changed = None
+        if targets is not None:
+            changed = self._changed_vif_ids(vif_ports, targets[0])
+        all_bindings = self._get_bindings(db, changed)
+
+        vif_ids = set()
+        network_ports = []
+        for port in vif_ports:
+            vif_ids.add(port.vif_id)
+            if changed is not None and port.vif_id not in changed:
+                continue
+            binding = all_bindings.get(port.vif_id)
+            old_net_id, old_ofport = self.applied_state.get(port.vif_id,
+                                                            (None, None))
+            new_net_id = binding and binding.network_id
+            if (new_net_id, port.ofport) != (old_net_id, old_ofport):
+                if old_net_id is not None:
                     LOG.info("Removing binding to net-id = %s for %s",
-                             old_b, str(port))
-                    if port.vif_id in all_bindings:
-                        all_bindings[port.vif_id].op_status = OP_STATUS_DOWN
-                if not new_b:
-                    if port.vif_id in all_bindings:
-                        all_bindings[port.vif_id].op_status = OP_STATUS_UP
+                             old_net_id, str(port))
+                    self.api.delete_port(old_net_id,
+                                         self.int_br.datapath_id, old_ofport)
+                    metrics.incr("ports_removed")
+                if new_net_id is not None:
                     LOG.info("Adding binding to net-id = %s for %s",
-                             new_b, str(port))
+                             new_net_id, str(port))
+                    network_ports.append((new_net_id, port))
+                    metrics.incr("ports_added")
+                self.applied_state[port.vif_id] = (new_net_id, port.ofport)
+            if binding:
+                self._set_status(binding, OP_STATUS_UP)
+
+        for vif_id in self.applied_state.keys():
+            if vif_id not in vif_ids:
+                # Ryu learns of the deletion from the switch itself
+                LOG.info("Port Disappeared: %s", vif_id)
+                if self.applied_state[vif_id][0] is not None:
+                    metrics.incr("ports_removed")
+                del self.applied_state[vif_id]
+                if vif_id in all_bindings:
+                    self._set_status(all_bindings[vif_id], OP_STATUS_DOWN)
+
+        self._ports_update(network_ports)
+        self._commit(db)
 
-            for vif_id in old_vif_ports:
-                if vif_id not in new_vif_ports:
-                    LOG.info("Port Disappeared: %s", vif_id)
-                    if vif_id in all_bindings:
-                        all_bindings[vif_id].op_status = OP_STATUS_DOWN
+    def daemon_loop(self, db):
+        resync_deadline = 0
+        events = []
 
-            old_vif_ports = new_vif_ports
-            old_local_bindings = new_local_bindings
-            db.commit()
-            time.sleep(2)
+        while True:
+            started = time.time()
+            full_resync = started >= resync_deadline
+            if full_resync:
+                resync_deadline = started + RESYNC_INTERVAL
+            targets = None
+            # without the notification channel, database changes are only
+            # found by reading every port
+            if not full_resync and self.subscriber.connected:
+                targets = notifier.event_targets(events,
+                                                 (ovsdb.INTERFACE_EVENT,))
+            self.sync(db, full_resync, targets)
+            metrics.iteration_done(started)
+            events = ovsdb.wait_for_changes(self.subscriber, self.monitor,
+                                            resync_deadline)
 
 
 def main():
@@ -303,12 +378,47 @@ def main():
 
     root_helper = config.get("AGENT", "root_helper")
 
+    try:
+        use_rootwrap_daemon = config.getboolean("AGENT", "rootwrap_daemon")
+    except ConfigParser.Error:
+        use_rootwrap_daemon = False
+    rootwrap.configure_daemon(root_helper, use_rootwrap_daemon)
+
+    try:
+        stats_socket = config.get("AGENT", "stats_socket")
+    except ConfigParser.Error:
+        stats_socket = None
+    try:
+        stats_interval = config.getint("AGENT", "stats_interval")
+    except ConfigParser.Error:
+        stats_interval = metrics.DEFAULT_STATS_INTERVAL
+    metrics.configure(stats_socket, stats_interval)
+
+    try:
+        notification_address = config.get("NOTIFICATION", "address")
+    except ConfigParser.Error:
+        notification_address = None
+    subscriber = notifier.get_subscriber(notification_address)
+
+    try:
+        use_ovsdb_monitor = config.getboolean("AGENT", "ovsdb_monitor")
+    except ConfigParser.Error:
+        use_ovsdb_monitor = True
+    monitor = None
+    if use_ovsdb_monitor:
+        monitor = ovsdb.InterfaceMonitor(
+            root_helper,
+            on_change=lambda: subscriber.dispatch(
+                {"event": ovsdb.INTERFACE_EVENT}))
+        monitor.start()
+
     options = {"sql_connection": config.get("DATABASE", "sql_connection")}
-    db = SqlSoup(options["sql_connection"])
+    db = SqlSoup(database.get_engine(options["sql_connection"]))
 
     LOG.info("Connecting to database \"%s\" on %s",
              db.engine.url.database, db.engine.url.host)
-    plugin = OVSQuantumOFPRyuAgent(integ_br, db, root_helper)
+    plugin = OVSQuantumOFPRyuAgent(integ_br, db, root_helper, subscriber,
+                                   monitor)
     plugin.daemon_loop(db)
 
     sys.exit(0)
@@ -20,6 +20,7 @@ import logging as LOG
 import os
 from abc import ABCMeta, abstractmethod
 
+from quantum.agent import notifier
 import quantum.db.api as db
 from quantum.api.api_common import OperationalStatus
 from quantum.common import exceptions as q_exc
@@ -72,6 +73,11 @@ class OVSQuantumPluginBase(QuantumPluginBase):
         db.configure_db(options)
 
         self.config = config
+        try:
+            notification_address = config.get("NOTIFICATION", "address")
+        except ConfigParser.Error:
+            notification_address = None
+        self.notifier = notifier.get_publisher(notification_address)
         # Subclass must set self.driver to its own OVSQuantumPluginDriverBase
         self.driver = None
 
@@ -96,6 +102,8 @@ class OVSQuantumPluginBase(QuantumPluginBase):
                                 op_status=OperationalStatus.UP)
         LOG.debug("Created network: %s", net)
         self.driver.create_network(net)
+        self.notifier.publish(notifier.NETWORK_CREATE,
+                              network_id=str(net.uuid))
         return self._make_net_dict(str(net.uuid), net.name, [], net.op_status)
 
     def delete_network(self, tenant_id, net_id):
@@ -108,6 +116,7 @@ class OVSQuantumPluginBase(QuantumPluginBase):
                 raise q_exc.NetworkInUse(net_id=net_id)
         net = db.network_destroy(net_id)
         self.driver.delete_network(net)
+        self.notifier.publish(notifier.NETWORK_DELETE, network_id=net_id)
         return self._make_net_dict(str(net.uuid), net.name, [], net.op_status)
 
     def get_network_details(self, tenant_id, net_id):
@@ -145,11 +154,15 @@ class OVSQuantumPluginBase(QuantumPluginBase):
         LOG.debug("Creating port with network_id: %s", net_id)
         port = db.port_create(net_id, port_state,
                               op_status=OperationalStatus.DOWN)
+        self.notifier.publish(notifier.PORT_CREATE, network_id=net_id,
+                              port_id=str(port.uuid))
         return self._make_port_dict(port)
 
     def delete_port(self, tenant_id, net_id, port_id):
         db.validate_port_ownership(tenant_id, net_id, port_id)
         port = db.port_destroy(port_id, net_id)
+        self.notifier.publish(notifier.PORT_DELETE, network_id=net_id,
+                              port_id=port_id)
         return self._make_port_dict(port)
 
     def update_port(self, tenant_id, net_id, port_id, **kwargs):
@@ -160,6 +173,9 @@ class OVSQuantumPluginBase(QuantumPluginBase):
         db.validate_port_ownership(tenant_id, net_id, port_id)
         port = db.port_get(port_id, net_id)
         db.port_update(port_id, net_id, **kwargs)
+        self.notifier.publish(notifier.PORT_UPDATE, network_id=net_id,
+                              port_id=port_id,
+                              interface_id=port.interface_id)
         return self._make_port_dict(port)
 
     def get_port_details(self, tenant_id, net_id, port_id):
@@ -170,11 +186,16 @@ class OVSQuantumPluginBase(QuantumPluginBase):
     def plug_interface(self, tenant_id, net_id, port_id, remote_iface_id):
         db.validate_port_ownership(tenant_id, net_id, port_id)
         db.port_set_attachment(port_id, net_id, remote_iface_id)
+        self.notifier.publish(notifier.PORT_PLUG, network_id=net_id,
+                              port_id=port_id, interface_id=remote_iface_id)
 
     def unplug_interface(self, tenant_id, net_id, port_id):
         db.validate_port_ownership(tenant_id, net_id, port_id)
+        old_iface_id = db.port_get(port_id, net_id).interface_id
         db.port_set_attachment(port_id, net_id, "")
         db.port_update(port_id, net_id, op_status=OperationalStatus.DOWN)
+        self.notifier.publish(notifier.PORT_UNPLUG, network_id=net_id,
+                              port_id=port_id, interface_id=old_iface_id)
 
     def get_interface_details(self, tenant_id, net_id, port_id):
         db.validate_port_ownership(tenant_id, net_id, port_id)
@@ -0,0 +1,150 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Client of the Ryu REST API for the plugin and the agent.
+
+It has the interface of ryu.app.client.OFPClient, which opens a new
+connection for every request. Here HTTP/1.1 connections are kept open
+between requests instead. The Ryu REST API has no bulk calls, so
+update_networks() and update_ports() send their requests from up to
+`connections` green threads at once, which run concurrently where socket
+is patched by eventlet, as in the quantum server.
+"""
+
+import httplib
+import logging
+import socket
+
+import eventlet
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_CONNECTIONS = 4
+# Seconds to wait for the REST API before giving up on a request
+DEFAULT_TIMEOUT = 30
+SUCCESS_STATUSES = (httplib.OK, httplib.CREATED, httplib.ACCEPTED,
+                    httplib.NO_CONTENT)
+# Requests which may be sent again when the server closed an idle
+# connection before answering, as the server has no way to tell
+IDEMPOTENT_METHODS = ("GET", "PUT", "DELETE")
+
+
+class OFPClient(object):
+
+    version = "v1.0"
+    # /{version}/networks/{network_id}/{dpid}_{port}
+    path_networks = "networks/%s"
+    path_port = path_networks + "/%s_%s"
+
+    def __init__(self, address, connections=DEFAULT_CONNECTIONS,
+                 timeout=DEFAULT_TIMEOUT):
+        self.host = address
+        self.url_prefix = "/%s/" % self.version
+        self.timeout = timeout
+        self.connections = connections
+        # connections open between requests
+        self._idle = []
+
+    def _acquire(self):
+        if self._idle:
+            return self._idle.pop()
+        return httplib.HTTPConnection(self.host, timeout=self.timeout)
+
+    def _release(self, conn):
+        if len(self._idle) < self.connections:
+            self._idle.append(conn)
+        else:
+            conn.close()
+
+    def _do_request(self, method, action):
+        url = self.url_prefix + action
+        conn = self._acquire()
+        # httplib connects on the first request
+        reused = conn.sock is not None
+        sent = False
+        try:
+            conn.request(method, url, "")
+            sent = True
+            res = conn.getresponse()
+            # the whole response must be read to reuse the connection
+            body = res.read()
+        except (socket.error, httplib.HTTPException), e:
+            conn.close()
+            if not reused or (sent and method not in IDEMPOTENT_METHODS):
+                raise
+            # the server closed the connection while it was idle
+            LOG.debug("Reconnecting to %s: %s" % (self.host, e))
+            return self._do_request(method, action)
+        self._release(conn)
+        if res.status not in SUCCESS_STATUSES:
+            raise httplib.HTTPException(
+                res, "code %d reason %s" % (res.status, res.reason),
+                res.getheaders(), body)
+        return body
+
+    def _fan_out(self, requests):
+        """Run (method, action) requests and wait for all of them.
+
+        Raises the error of the first request which failed, if any.
+        """
+        def issue(request):
+            try:
+                self._do_request(*request)
+            except (socket.error, httplib.HTTPException), e:
+                return e
+
+        pool = eventlet.GreenPool(self.connections)
+        errors = [e for e in pool.imap(issue, requests) if e]
+        if errors:
+            LOG.error("%d of %d requests to %s failed" %
+                      (len(errors), len(requests), self.host))
+            raise errors[0]
+
+    def get_networks(self):
+        return self._do_request("GET", "networks")
+
+    def create_network(self, network_id):
+        self._do_request("POST", self.path_networks % network_id)
+
+    def update_network(self, network_id):
+        self._do_request("PUT", self.path_networks % network_id)
+
+    def update_networks(self, network_ids):
+        """Register many networks, as update_network() would."""
+        self._fan_out([("PUT", self.path_networks % network_id)
+                       for network_id in network_ids])
+
+    def delete_network(self, network_id):
+        self._do_request("DELETE", self.path_networks % network_id)
+
+    def get_ports(self, network_id):
+        return self._do_request("GET", self.path_networks % network_id)
+
+    def create_port(self, network_id, dpid, port):
+        self._do_request("POST", self.path_port % (network_id, dpid, port))
+
+    def update_port(self, network_id, dpid, port):
+        self._do_request("PUT", self.path_port % (network_id, dpid, port))
+
+    def update_ports(self, ports):
+        """Register many ports, given as (network_id, dpid, port) tuples."""
+        self._fan_out([("PUT", self.path_port % (network_id, dpid, port))
+                       for network_id, dpid, port in ports])
+
+    def delete_port(self, network_id, dpid, port):
+        self._do_request("DELETE", self.path_port % (network_id, dpid, port))
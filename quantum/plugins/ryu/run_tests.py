@@ -38,6 +38,7 @@ sys.path.append(os.path.dirname(__file__))
 import quantum.tests.unit
 from quantum.api.api_common import OperationalStatus
 from quantum.common.test_lib import run_tests, test_config
+from quantum.plugins.ryu.tests.unit.utils import patch_fake_rest_client
 from quantum.plugins.ryu.tests.unit.utils import patch_fake_ryu_client
 
 
@@ -67,7 +68,8 @@ if __name__ == '__main__':
                           plugins=core.DefaultPluginManager())
         c.configureWhere(quantum.tests.unit.__path__)
 
-        exit_status = run_tests(c)
+        with patch_fake_rest_client():
+            exit_status = run_tests(c)
 
     if invoke_once:
         sys.exit(0)
@@ -16,15 +16,17 @@
 #    under the License.
 # @author: Isaku Yamahata
 
+import ConfigParser
+
 import quantum.db.api as db
 from quantum.common import exceptions as q_exc
 from quantum.common.config import find_config_file
 from quantum.plugins.ryu import ofp_service_type
 from quantum.plugins.ryu import ovs_quantum_plugin_base
+from quantum.plugins.ryu import rest_client
 from quantum.plugins.ryu.db import api as db_api
 
 
-from ryu.app import client
 from ryu.app import rest_nw_id
 
 
@@ -44,7 +46,12 @@ class OFPRyuDriver(ovs_quantum_plugin_base.OVSQuantumPluginDriverBase):
                  (ofp_api_host, ofp_service_type.REST_API)]
         db_api.set_ofp_servers(hosts)
 
-        self.client = client.OFPClient(ofp_api_host)
+        try:
+            connections = config.getint("OVS",
+                                        "openflow-rest-api-connections")
+        except ConfigParser.Error:
+            connections = rest_client.DEFAULT_CONNECTIONS
+        self.client = rest_client.OFPClient(ofp_api_host, connections)
         self.client.update_network(rest_nw_id.NW_ID_EXTERNAL)
 
         # register known all network list on startup
@@ -52,8 +59,7 @@ class OFPRyuDriver(ovs_quantum_plugin_base.OVSQuantumPluginDriverBase):
 
     def _create_all_tenant_network(self):
         networks = db.network_all_tenant_list()
-        for net in networks:
-            self.client.update_network(net.uuid)
+        self.client.update_networks([net.uuid for net in networks])
 
     def create_network(self, net):
         self.client.create_network(net.uuid)
@@ -0,0 +1,99 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import httplib
+import unittest
+
+from quantum.plugins.ryu import rest_client
+from quantum.tests.benchmark import fakes
+from quantum.tests.benchmark import ryu_startup
+
+
+class StaleConnection(object):
+    """Connection which the server closed while it was idle."""
+
+    def __init__(self):
+        self.sock = object()
+
+    def request(self, method, url, body):
+        pass
+
+    def getresponse(self):
+        raise httplib.BadStatusLine("")
+
+    def close(self):
+        self.sock = None
+
+
+class OFPClientTest(unittest.TestCase):
+    """Runs the client against a local fake Ryu REST API"""
+    def setUp(self):
+        self.server = fakes.FakeRyuRESTServer()
+        self.server.start()
+        self.client = rest_client.OFPClient(self.server.address, 4)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connection_reused(self):
+        self.client.update_network("net0")
+        self.client.update_port("net0", "0000000000000001", 1)
+        self.client.delete_network("net0")
+        self.assertEqual(self.server.requests.value, 3)
+        self.assertEqual(self.server.connections.value, 1)
+
+    def test_update_networks(self):
+        network_ids = ["net%d" % i for i in range(20)]
+        self.client.update_networks(network_ids)
+        self.assertEqual(self.server.put_paths,
+                         set("/v1.0/networks/%s" % network_id
+                             for network_id in network_ids))
+        self.assertTrue(self.server.connections.value <= 4)
+
+    def test_update_ports(self):
+        self.client.update_ports([("net0", "0000000000000001", 1),
+                                  ("net1", "0000000000000001", 2)])
+        self.assertEqual(self.server.put_paths,
+                         set(["/v1.0/networks/net0/0000000000000001_1",
+                              "/v1.0/networks/net1/0000000000000001_2"]))
+
+    def test_stale_connection_retried(self):
+        self.client._idle.append(StaleConnection())
+        self.client.update_network("net0")
+        self.assertEqual(self.server.put_paths, set(["/v1.0/networks/net0"]))
+
+    def test_stale_connection_post_not_retried(self):
+        # the server may have created the network before closing
+        self.client._idle.append(StaleConnection())
+        self.assertRaises(httplib.BadStatusLine, self.client.create_network,
+                          "net0")
+        self.client.create_network("net0")
+        self.assertEqual(self.server.requests.value, 1)
+
+    def test_error(self):
+        self.server.status = httplib.INTERNAL_SERVER_ERROR
+        self.assertRaises(httplib.HTTPException,
+                          self.client.update_networks, ["net0", "net1"])
+
+
+class StartupBenchmarkTest(unittest.TestCase):
+
+    def test_startup(self):
+        result = ryu_startup.run_benchmark(20, 4)
+        # the external network and the 20 networks of the database
+        self.assertEqual(result["registered"], 21)
+        self.assertTrue(result["connections"] <= 5)
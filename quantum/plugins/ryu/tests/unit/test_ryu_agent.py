@@ -0,0 +1,241 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import unittest
+
+import stubout
+
+from quantum.plugins.ryu.tests.unit.utils import patch_fake_ryu_client
+
+
+INTERFACES = {
+    'headings': ['name', 'external_ids', 'ofport'],
+    'data': [['tap0', ['map', [['attached-mac', 'fa:16:3e:00:00:01'],
+                               ['iface-id', 'vif-0']]], 1],
+             ['eth0', ['map', []], 2],
+             ['eth1', ['map', []], 3]]}
+
+
+class RyuAgentBridgeTest(unittest.TestCase):
+    """Tests for the Interface table snapshot of the Ryu agent's OVSBridge"""
+    def setUp(self):
+        self.module_patcher = patch_fake_ryu_client()
+        self.module_patcher.start()
+        from quantum.plugins.ryu.agent import ryu_quantum_agent
+
+        self.calls = []
+
+        def fake_run_cmd(args):
+            self.calls.append(args)
+            if 'list-ports' in args:
+                return "tap0\neth0\n"
+            return json.dumps(INTERFACES)
+
+        self.br = ryu_quantum_agent.OVSBridge('br-int', 'sudo')
+        self.br.run_cmd = fake_run_cmd
+
+    def tearDown(self):
+        self.module_patcher.stop()
+
+    def test_get_vif_ports(self):
+        ports = self.br.get_vif_ports()
+        self.assertEqual(len(ports), 1)
+        self.assertEqual(ports[0].port_name, 'tap0')
+        self.assertEqual(ports[0].vif_id, 'vif-0')
+        self.assertEqual(ports[0].ofport, '1')
+        self.assertEqual(len(self.calls), 2)
+
+    def test_get_external_ports(self):
+        ports = self.br.get_external_ports()
+        # eth1 is not attached to br-int
+        self.assertEqual([p.port_name for p in ports], ['eth0'])
+        self.assertEqual(ports[0].ofport, '2')
+        self.assertEqual(len(self.calls), 2)
+
+
+class FakeColumn(object):
+    def __init__(self, name):
+        self.name = name
+
+    def in_(self, values):
+        return lambda row: getattr(row, self.name) in values
+
+
+class FakeRows(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    def __getattr__(self, name):
+        return FakeColumn(name)
+
+    def all(self):
+        self.queries += 1
+        return self.rows
+
+    def filter(self, predicate):
+        self.queries += 1
+        return FakeRows([row for row in self.rows if predicate(row)])
+
+
+class FakePort(object):
+    def __init__(self, uuid, network_id, interface_id, op_status='DOWN'):
+        self.uuid = uuid
+        self.network_id = network_id
+        self.interface_id = interface_id
+        self.op_status = op_status
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.statuses = {}
+
+    def execute(self, statement, params):
+        for key, value in params.items():
+            if key != 'status':
+                self.statuses[value] = params['status']
+
+
+class FakeDB(object):
+    """The tables read by the Ryu agent and the op_status it writes"""
+    bind = None
+
+    def __init__(self):
+        self.ports = FakeRows([])
+        self.ofp_server = FakeRows([])
+        self.session = FakeSession()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+class FakeOFPClient(object):
+    def __init__(self, address):
+        self.calls = []
+
+    def update_ports(self, ports):
+        for network_id, dpid, port in ports:
+            self.calls.append(('PUT', network_id, dpid, port))
+
+    def delete_port(self, network_id, dpid, port):
+        self.calls.append(('DELETE', network_id, dpid, port))
+
+
+class RyuAgentSyncTest(unittest.TestCase):
+    """Tests for the incremental updates of the Ryu agent's daemon loop"""
+    def setUp(self):
+        self.module_patcher = patch_fake_ryu_client()
+        self.module_patcher.start()
+        from quantum.plugins.ryu.agent import ryu_quantum_agent
+        self.mod = ryu_quantum_agent
+
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(ryu_quantum_agent, 'OFPClient', FakeOFPClient)
+        self.stubs.Set(ryu_quantum_agent, 'check_ofp_mode',
+                       lambda db: ('127.0.0.1:6633', '127.0.0.1:8080'))
+        self.stubs.Set(ryu_quantum_agent.OVSBridge, 'run_cmd',
+                       lambda br, args: '')
+        self.stubs.Set(ryu_quantum_agent.OVSBridge, 'find_datapath_id',
+                       lambda br: setattr(br, 'datapath_id', 'dp1'))
+        self.vif_ports = []
+        self.scans = []
+
+        def fake_get_vif_ports(br, interfaces=None):
+            self.scans.append(interfaces)
+            return self.vif_ports
+
+        self.stubs.Set(ryu_quantum_agent.OVSBridge, 'get_vif_ports',
+                       fake_get_vif_ports)
+        self.db = FakeDB()
+        self.agent = ryu_quantum_agent.OVSQuantumOFPRyuAgent(
+            'br-int', self.db, 'sudo')
+        self.api = self.agent.api
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        self.module_patcher.stop()
+
+    def _vif(self, vif_id, ofport):
+        return self.mod.VifPort('tap-' + vif_id, ofport, vif_id,
+                                'fa:16:3e:00:00:01', self.agent.int_br)
+
+    def test_only_changes_registered(self):
+        self.db.ports = FakeRows([FakePort('p0', 'net0', 'vif-0'),
+                                  FakePort('p1', 'net1', 'vif-1')])
+        self.vif_ports = [self._vif('vif-0', '1'), self._vif('vif-1', '2')]
+        self.agent.sync(self.db, True)
+        self.assertEqual(sorted(self.api.calls),
+                         [('PUT', 'net0', 'dp1', '1'),
+                          ('PUT', 'net1', 'dp1', '2')])
+        self.assertEqual(self.db.session.statuses, {'p0': 'UP', 'p1': 'UP'})
+
+        # nothing changed
+        self.api.calls = []
+        self.db.ports = FakeRows([FakePort('p0', 'net0', 'vif-0', 'UP'),
+                                  FakePort('p1', 'net1', 'vif-1', 'UP')])
+        self.agent.sync(self.db, False)
+        self.assertEqual(self.api.calls, [])
+
+        # vif-0 moves to net2 and vif-1 goes away
+        self.db.ports = FakeRows([FakePort('p0', 'net2', 'vif-0', 'UP'),
+                                  FakePort('p1', 'net1', 'vif-1', 'UP')])
+        self.vif_ports = [self._vif('vif-0', '1')]
+        self.agent.sync(self.db, False)
+        self.assertEqual(self.api.calls,
+                         [('DELETE', 'net0', 'dp1', '1'),
+                          ('PUT', 'net2', 'dp1', '1')])
+        self.assertEqual(self.db.session.statuses['p1'], 'DOWN')
+        self.assertEqual(self.agent.applied_state, {'vif-0': ('net2', '1')})
+
+    def test_targeted_sync(self):
+        self.db.ports = FakeRows([FakePort('p0', 'net0', 'vif-0'),
+                                  FakePort('p1', 'net1', 'vif-1')])
+        self.vif_ports = [self._vif('vif-0', '1'), self._vif('vif-1', '2')]
+        self.agent.sync(self.db, True)
+        self.api.calls = []
+        self.db.ports.queries = 0
+
+        # nothing named in the events changed
+        self.agent.sync(self.db, False, (set(), set()))
+        self.assertEqual(self.db.ports.queries, 0)
+
+        # vif-1 is plugged into net2 and vif-2 appears on the bridge
+        self.db.ports.rows[1].network_id = 'net2'
+        self.db.ports.rows.append(FakePort('p2', 'net0', 'vif-2'))
+        self.vif_ports.append(self._vif('vif-2', '3'))
+        self.agent.sync(self.db, False, (set(['vif-1']), set()))
+        self.assertEqual(self.api.calls,
+                         [('DELETE', 'net1', 'dp1', '2'),
+                          ('PUT', 'net2', 'dp1', '2'),
+                          ('PUT', 'net0', 'dp1', '3')])
+        self.assertEqual(self.db.ports.queries, 1)
+        self.assertEqual(self.db.session.statuses['p2'], 'UP')
+
+    def test_scan_uses_monitor(self):
+        class FakeMonitor(object):
+            active = True
+
+            def get_interfaces(self):
+                return ['tap0']
+
+        self.agent.monitor = FakeMonitor()
+        self.agent.sync(self.db, False)
+        self.agent.sync(self.db, True)
+        self.assertEqual(self.scans, [['tap0'], None])
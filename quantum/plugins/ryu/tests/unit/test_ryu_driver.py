@@ -38,13 +38,15 @@ class RyuDriverTest(BaseRyuTest):
         super(RyuDriverTest, self).tearDown()
 
     def test_ryu_driver(self):
-        from ryu.app import client as client_mod
+        from quantum.plugins.ryu import rest_client
         from ryu.app import rest_nw_id as rest_nw_id_mod
 
-        self.mox.StubOutClassWithMocks(client_mod, 'OFPClient')
-        client_mock = client_mod.OFPClient(utils.FAKE_REST_ADDR)
+        self.mox.StubOutClassWithMocks(rest_client, 'OFPClient')
+        client_mock = rest_client.OFPClient(utils.FAKE_REST_ADDR,
+                                            rest_client.DEFAULT_CONNECTIONS)
 
         self.mox.StubOutWithMock(client_mock, 'update_network')
+        self.mox.StubOutWithMock(client_mock, 'update_networks')
         self.mox.StubOutWithMock(client_mock, 'create_network')
         self.mox.StubOutWithMock(client_mock, 'delete_network')
         client_mock.update_network(rest_nw_id_mod.NW_ID_EXTERNAL)
@@ -57,7 +59,7 @@ class RyuDriverTest(BaseRyuTest):
         uuid1 = '12345678-9abc-def0-1234-56789abcdef0'
         net1 = utils.Net(uuid1)
 
-        client_mock.update_network(uuid0)
+        client_mock.update_networks([uuid0])
         client_mock.create_network(uuid1)
         client_mock.delete_network(uuid1)
         self.mox.ReplayAll()
@@ -23,6 +23,7 @@ from StringIO import StringIO
 
 import mock
 
+from quantum.plugins.ryu import rest_client
 from quantum.plugins.ryu.tests.unit import fake_rest_nw_id
 from quantum.plugins.ryu.tests.unit import fake_ryu_client
 
@@ -68,6 +69,22 @@ def patch_fake_ryu_client():
                             'ryu.app.rest_nw_id': fake_rest_nw_id})
 
 
+class FakeRESTClient(fake_ryu_client.OFPClient):
+    def __init__(self, address, connections=None):
+        super(FakeRESTClient, self).__init__(address)
+
+    def update_networks(self, network_ids):
+        pass
+
+    def update_ports(self, ports):
+        pass
+
+
+def patch_fake_rest_client():
+    # the plugin sends its requests through rest_client rather than ryu's
+    return mock.patch.object(rest_client, 'OFPClient', FakeRESTClient)
+
+
 class Net(object):
     def __init__(self, uuid):
         self.uuid = uuid
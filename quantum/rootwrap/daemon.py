@@ -0,0 +1,207 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2012 Openstack, LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Long running mode of quantum-rootwrap.
+
+"quantum-rootwrap --daemon" loads the filters once and then runs the
+commands requested over the Unix socket SOCKET_PATH, so that agents do not pay
+for a sudo and Python interpreter start for every command they run. Each
+command goes through the same filters as with a plain quantum-rootwrap
+call.
+
+Every message is a line of JSON followed by the raw payloads whose sizes
+are listed in its "sizes" member. A request holds the command "args" and
+an optional payload with the command's stdin; the response holds its
+"returncode" and two payloads with its stdout and stderr.
+"""
+
+import errno
+import json
+import logging
+import os
+import socket
+import stat
+import subprocess
+import threading
+
+from quantum.rootwrap import wrapper
+
+
+LOG = logging.getLogger(__name__)
+
+# Same exit codes as quantum-rootwrap
+RC_UNAUTHORIZED = 99
+RC_NOCOMMAND = 98
+
+# The daemon runs as root, so its socket is never taken from the caller.
+SOCKET_PATH = "/var/run/quantum/rootwrap.sock"
+
+
+class UnsafeSocketPath(Exception):
+    pass
+
+
+def send_message(sock, header, payloads=()):
+    """Send a header and its payloads to sock."""
+    payloads = [p.encode("utf-8") if isinstance(p, unicode) else p
+                for p in payloads]
+    header = dict(header, sizes=[len(p) for p in payloads])
+    sock.sendall(json.dumps(header) + "\n" + "".join(payloads))
+
+
+def recv_message(stream):
+    """Read a message sent by send_message() from a file-like stream.
+
+    :returns: a (header, payloads) tuple, or (None, None) once the peer
+        closed the connection.
+    :raises: ValueError if the message is malformed or truncated.
+    """
+    line = stream.readline()
+    if not line:
+        return None, None
+    header = json.loads(line)
+    payloads = []
+    for size in header.pop("sizes", []):
+        payload = stream.read(size)
+        if len(payload) != size:
+            raise ValueError("Truncated message")
+        payloads.append(payload)
+    return header, payloads
+
+
+class RootwrapDaemon(object):
+    """Runs filtered commands on behalf of the clients of a Unix socket.
+
+    The socket is only accessible by root and, when started through sudo,
+    by the user who ran sudo. Its directory must belong to the user running
+    the daemon and must not be writable by anybody else, and an existing
+    file is only replaced if it is a socket.
+    """
+
+    def __init__(self, filters, socket_path=SOCKET_PATH):
+        self.socket_path = socket_path
+        self.filters = filters
+        self._closed = False
+        self._sock = None
+
+    def _check_directory(self):
+        directory = os.path.dirname(self.socket_path)
+        try:
+            os.mkdir(directory, 0755)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        st = os.lstat(directory)
+        if not stat.S_ISDIR(st.st_mode):
+            raise UnsafeSocketPath("%s is not a directory" % directory)
+        if st.st_uid != os.geteuid() or st.st_mode & 022:
+            raise UnsafeSocketPath("%s may be written by other users"
+                                   % directory)
+
+    def _remove_stale_socket(self):
+        try:
+            st = os.lstat(self.socket_path)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        if not stat.S_ISSOCK(st.st_mode):
+            raise UnsafeSocketPath("%s exists and is not a socket"
+                                   % self.socket_path)
+        os.unlink(self.socket_path)
+
+    def listen(self):
+        self._check_directory()
+        self._remove_stale_socket()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0077)
+        try:
+            self._sock.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        if "SUDO_UID" in os.environ:
+            os.chown(self.socket_path, int(os.environ["SUDO_UID"]),
+                     int(os.environ.get("SUDO_GID", -1)))
+        self._sock.listen(16)
+        LOG.info("Serving commands on %s" % self.socket_path)
+
+    def serve_forever(self):
+        if not self._sock:
+            self.listen()
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.error, e:
+                if self._closed:
+                    return
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            thread = threading.Thread(target=self._handle, args=(conn,))
+            thread.setDaemon(True)
+            thread.start()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._sock:
+            self._sock.shutdown(socket.SHUT_RDWR)
+            self._sock.close()
+
+    def _handle(self, conn):
+        stream = conn.makefile("rb")
+        try:
+            while True:
+                header, payloads = recv_message(stream)
+                if header is None:
+                    return
+                userargs = [arg.encode("utf-8") for arg in header["args"]]
+                process_input = payloads[0] if payloads else None
+                returncode, stdout, stderr = self.execute(userargs,
+                                                          process_input)
+                send_message(conn, {"returncode": returncode},
+                             (stdout or "", stderr or ""))
+        except (socket.error, ValueError, KeyError, TypeError,
+                AttributeError), e:
+            LOG.warn("Dropping rootwrap client: %s" % e)
+        finally:
+            stream.close()
+            conn.close()
+
+    def execute(self, userargs, process_input=None):
+        """Run a command if it matches one of the filters.
+
+        :returns: a (returncode, stdout, stderr) tuple.
+        """
+        if not userargs:
+            return RC_NOCOMMAND, "", "No command specified\n"
+        filtermatch = wrapper.match_filter(self.filters, userargs)
+        if not filtermatch:
+            return (RC_UNAUTHORIZED, "",
+                    "Unauthorized command: %s\n" % " ".join(userargs))
+        try:
+            obj = subprocess.Popen(filtermatch.get_command(userargs),
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   close_fds=True,
+                                   env=filtermatch.get_environment(userargs))
+        except OSError, e:
+            return 1, "", "%s\n" % e
+        stdout, stderr = obj.communicate(process_input)
+        return obj.returncode, stdout, stderr
@@ -20,6 +20,10 @@ import os
 import re
 
 
+# Patterns without regexp special characters, which only match themselves
+LITERAL_PATTERN = re.compile(r'[\w=:,/@%-]+$')
+
+
 class CommandFilter(object):
     """Command filter only checking that the 1st argument matches exec_path"""
 
@@ -45,29 +49,48 @@ class CommandFilter(object):
         """Returns specific environment to set, None if none"""
         return None
 
+    def get_command_name(self):
+        """Returns the only command this filter can match, None if several"""
+        return os.path.basename(self.exec_path)
+
+    def get_spec(self):
+        """Returns the arguments this filter was created with"""
+        return [self.exec_path, self.run_as] + list(self.args)
+
 
 class RegExpFilter(CommandFilter):
     """Command filter doing regexp matching for every argument"""
 
+    def __init__(self, exec_path, run_as, *args):
+        super(RegExpFilter, self).__init__(exec_path, run_as, *args)
+        # Anchor patterns explicitly at end of string
+        try:
+            self.regexes = [re.compile('(?:%s)$' % pattern)
+                            for pattern in args]
+        except re.error:
+            # Badly-formed filter, never matches
+            self.regexes = None
+
     def match(self, userargs):
+        if self.regexes is None:
+            # DENY: Badly-formed filter
+            return False
         # Early skip if command or number of args don't match
-        if (len(self.args) != len(userargs)):
+        if (len(self.regexes) != len(userargs)):
             # DENY: argument numbers don't match
             return False
-        # Compare each arg (anchoring pattern explicitly at end of string)
-        for (pattern, arg) in zip(self.args, userargs):
-            try:
-                if not re.match(pattern + '$', arg):
-                    break
-            except re.error:
-                # DENY: Badly-formed filter
+        # Compare each arg
+        for (regex, arg) in zip(self.regexes, userargs):
+            if not regex.match(arg):
+                # DENY: Some arguments did not match
                 return False
-        else:
-            # ALLOW: All arguments matched
-            return True
+        # ALLOW: All arguments matched
+        return True
 
-        # DENY: Some arguments did not match
-        return False
+    def get_command_name(self):
+        if self.args and LITERAL_PATTERN.match(self.args[0]):
+            return self.args[0]
+        return None
 
 
 class DnsmasqFilter(CommandFilter):
@@ -89,6 +112,9 @@ class DnsmasqFilter(CommandFilter):
         env['NETWORK_ID'] = userargs[1].split('=')[-1]
         return env
 
+    def get_command_name(self):
+        return None
+
 
 class KillFilter(CommandFilter):
     """Specific filter for the kill calls.
@@ -125,6 +151,9 @@ class KillFilter(CommandFilter):
             return False
         return True
 
+    def get_command_name(self):
+        return "kill"
+
 
 class ReadFileFilter(CommandFilter):
     """Specific filter for the utils.read_file_as_root call"""
@@ -133,6 +162,9 @@ class ReadFileFilter(CommandFilter):
         self.file_path = file_path
         super(ReadFileFilter, self).__init__("/bin/cat", "root", *args)
 
+    def get_spec(self):
+        return [self.file_path] + list(self.args)
+
     def match(self, userargs):
         if userargs[0] != 'cat':
             return False
@@ -141,3 +173,6 @@ class ReadFileFilter(CommandFilter):
         if len(userargs) != 2:
             return False
         return True
+
+    def get_command_name(self):
+        return "cat"
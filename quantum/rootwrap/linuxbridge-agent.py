@@ -38,9 +38,7 @@ filterlist = [
     #   'ip', 'link', 'set', bridge_name, 'up'
     #   'ip', 'link', 'set', interface, 'down'
     #   'ip', 'link', 'set', interface, 'up'
-    #   'ip', 'link', 'show', 'dev', device
-    #   'ip', 'tuntap'
-    #   'ip', 'tuntap'
+    #   'ip', '-force', '-batch', '-'
     filters.CommandFilter("/usr/sbin/ip", "root"),
     filters.CommandFilter("/sbin/ip", "root"),
     ]
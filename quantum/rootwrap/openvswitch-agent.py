@@ -29,6 +29,11 @@ filterlist = [
     filters.CommandFilter("/usr/bin/ovs-ofctl", "root"),
     filters.CommandFilter("/bin/ovs-ofctl", "root"),
 
+    # quantum/agent/ovsdb.py:
+    #   "ovsdb-client", "--format=json", "monitor", "Interface", columns
+    filters.CommandFilter("/usr/bin/ovsdb-client", "root"),
+    filters.CommandFilter("/bin/ovsdb-client", "root"),
+
     # quantum/plugins/openvswitch/agent/ovs_quantum_agent.py:
     #   "xe", "vif-param-get", ...
     filters.CommandFilter("/usr/bin/xe", "root"),
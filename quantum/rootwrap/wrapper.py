@@ -16,8 +16,14 @@
 #    under the License.
 
 
+import heapq
+import json
 import os
+import stat
 import sys
+import tempfile
+
+from quantum.rootwrap import filters as rootwrap_filters
 
 
 FILTERS_MODULES = ['quantum.rootwrap.linuxbridge-agent',
@@ -25,6 +31,10 @@ FILTERS_MODULES = ['quantum.rootwrap.linuxbridge-agent',
                    'quantum.rootwrap.ryu-agent',
                   ]
 
+# Where quantum-rootwrap keeps its filters between runs, if this directory
+# belongs to root and only root may write to it
+FILTERS_CACHE = '/var/cache/quantum/rootwrap-filters.cache'
+
 
 def load_filters():
     """Load filters from modules present in quantum.rootwrap."""
@@ -41,14 +51,209 @@ def load_filters():
     return filters
 
 
+def _literal_prefix(f):
+    """Returns the leading arguments a RegExpFilter only matches literally"""
+    if not isinstance(f, rootwrap_filters.RegExpFilter) or f.regexes is None:
+        return None
+    prefix = []
+    for pattern in f.args:
+        if not rootwrap_filters.LITERAL_PATTERN.match(pattern):
+            break
+        prefix.append(pattern)
+    return tuple(prefix)
+
+
+class FilterIndex(object):
+    """Filters grouped by the command they match.
+
+    Only the filters for a command, and those which may match any command,
+    are tried against it, in the order of the original filter list.
+    RegExpFilters are further keyed by their number of arguments and their
+    leading literal arguments, so that the filters generated for every
+    bridge or device of a command are not tried one by one. The candidates
+    of every command and key are merged once, when the index is built.
+    """
+
+    def __init__(self, filters, key=None):
+        self.key = key
+        self.filters = filters
+        self.size = len(filters)
+        any_command = []
+        # command -> entries not keyed by their arguments
+        commands = {}
+        # command -> (number of arguments, number of literal arguments) ->
+        # literal arguments -> entries
+        keyed = {}
+        for entry in enumerate(filters):
+            name = entry[1].get_command_name()
+            prefix = _literal_prefix(entry[1])
+            if name is None:
+                any_command.append(entry)
+            elif prefix:
+                shapes = keyed.setdefault(name, {})
+                shape = (len(entry[1].args), len(prefix))
+                shapes.setdefault(shape, {}).setdefault(prefix,
+                                                        []).append(entry)
+            else:
+                commands.setdefault(name, []).append(entry)
+        # Every entry list below is in the order of the filter list. The
+        # filters lists also hold the entries of the command's filters
+        # which are not keyed, and of any_command.
+        self.any_command = (any_command, [f for (_, f) in any_command])
+        self.by_command = {}
+        for name in set(commands) | set(keyed):
+            entries = sorted(commands.get(name, []) + any_command)
+            self.by_command[name] = (entries, [f for (_, f) in entries])
+        self.by_arguments = {}
+        for name, shapes in keyed.iteritems():
+            base = self.by_command[name][0]
+            for shape, cells in shapes.iteritems():
+                for prefix, entries in cells.iteritems():
+                    merged = [f for (_, f) in heapq.merge(entries, base)]
+                    cells[prefix] = (entries, merged)
+            self.by_arguments[name] = shapes
+
+    def candidates(self, userargs):
+        """Returns the filters which may match userargs, in order."""
+        name = userargs[0]
+        cells = []
+        for (nargs, nliterals), table in \
+                self.by_arguments.get(name, {}).iteritems():
+            if nargs == len(userargs):
+                cell = table.get(tuple(userargs[:nliterals]))
+                if cell:
+                    cells.append(cell)
+        if len(cells) == 1:
+            return cells[0][1]
+        base = self.by_command.get(name, self.any_command)
+        if not cells:
+            return base[1]
+        return [f for (_, f) in heapq.merge(base[0],
+                                            *[c[0] for c in cells])]
+
+
+def _filters_key():
+    """Identifies the version of the filter modules present."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    key = []
+    for name in ['filters'] + [m.split('.')[-1] for m in FILTERS_MODULES]:
+        path = os.path.join(directory, name + '.py')
+        try:
+            st = os.stat(path)
+            key.append([path, st.st_mtime, st.st_size])
+        except OSError:
+            key.append([path, None, None])
+    return key
+
+
+def _is_private(st):
+    """Whether nobody but the current user may have written this file"""
+    return st.st_uid == os.getuid() and not st.st_mode & 022
+
+
+def _cache_directory(cache_file):
+    """Returns the directory of cache_file if it is safe to use, else None"""
+    directory = os.path.dirname(os.path.abspath(cache_file))
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return None
+    if not stat.S_ISDIR(st.st_mode) or not _is_private(st):
+        return None
+    return directory
+
+
+def _filter_from_spec(spec):
+    """Rebuilds a filter from the [class name, arguments] saved in a cache"""
+    cls = getattr(rootwrap_filters, spec[0], None)
+    if not isinstance(cls, type) or \
+            not issubclass(cls, rootwrap_filters.CommandFilter):
+        raise ValueError("Unknown filter %s" % spec[0])
+    return cls(*spec[1])
+
+
+def _read_filter_cache(cache_file, key):
+    if not _cache_directory(cache_file):
+        return None
+    try:
+        fd = os.open(cache_file, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    f = os.fdopen(fd, 'rb')
+    try:
+        if not _is_private(os.fstat(fd)):
+            return None
+        cache = json.load(f)
+        if cache['key'] != key:
+            return None
+        return FilterIndex([_filter_from_spec(spec)
+                            for spec in cache['filters']], key)
+    except (ValueError, TypeError, KeyError, IndexError):
+        return None
+    finally:
+        f.close()
+
+
+def _write_filter_cache(cache_file, index):
+    directory = _cache_directory(cache_file)
+    if not directory:
+        return
+    cache = {'key': index.key,
+             'filters': [[f.__class__.__name__, f.get_spec()]
+                         for f in index.filters]}
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=directory,
+                                        prefix='.rootwrap-filters')
+    except OSError:
+        return
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            os.fchmod(fd, 0644)
+            json.dump(cache, f)
+        finally:
+            f.close()
+        os.rename(tmp_file, cache_file)
+    except (IOError, OSError, TypeError, ValueError):
+        # The cache is only an optimization
+        try:
+            os.unlink(tmp_file)
+        except OSError:
+            pass
+
+
+def load_filter_index(cache_file=None):
+    """Load filters as a FilterIndex.
+
+    If cache_file is given, the filters are read from it unless the filter
+    modules changed since it was written, in which case they are loaded
+    again and saved. The cache is only used if its directory belongs to
+    the current user and is not writable by anybody else.
+    """
+    key = _filters_key()
+    if cache_file:
+        index = _read_filter_cache(cache_file, key)
+        if index:
+            return index
+    index = FilterIndex(load_filters(), key)
+    if cache_file:
+        _write_filter_cache(cache_file, index)
+    return index
+
+
 def match_filter(filters, userargs):
     """
     Checks user command and arguments through command filters and
     returns the first matching filter, or None is none matched.
+
+    filters is either a list of filters or a FilterIndex.
     """
 
     found_filter = None
 
+    if isinstance(filters, FilterIndex):
+        filters = filters.candidates(userargs)
+
     for f in filters:
         if f.match(userargs):
             # Try other filters if executable is absent
@@ -0,0 +1,405 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Scale benchmark of the L2 agents.
+
+Runs the daemon loop of the OVS, OVS tunnel, Linux bridge and Ryu agents
+against a simulated datapath (see fakes) and an SQLite database populated
+with networks and ports, a fraction of which is replaced between two
+iterations. The loop time, the number of commands run as root and the
+number of database statements of every iteration are reported, e.g.:
+
+    python -m quantum.tests.benchmark.agents --agents ovs,linuxbridge \\
+        --ports 1000,5000,10000 --churn 0.01 --iterations 5
+
+The first iteration is the agent's cold start.
+"""
+
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from optparse import OptionParser
+
+from sqlalchemy.ext.sqlsoup import SqlSoup
+import stubout
+
+from quantum.agent import database
+from quantum.agent import rootwrap
+from quantum.agent import workers
+from quantum.plugins.linuxbridge.agent import linuxbridge_quantum_agent
+from quantum.plugins.openvswitch.agent import ovs_quantum_agent
+from quantum.tests.benchmark import fakes
+
+
+SCHEMA = [
+    "CREATE TABLE ports (uuid VARCHAR(255) PRIMARY KEY, "
+    "network_id VARCHAR(255), interface_id VARCHAR(255), state VARCHAR(8), "
+    "op_status VARCHAR(16))",
+    "CREATE INDEX ix_ports_state ON ports (state)",
+    "CREATE TABLE vlan_bindings (vlan_id INTEGER PRIMARY KEY, "
+    "network_id VARCHAR(255))",
+    "CREATE TABLE tunnel_endpoints (ip_address VARCHAR(64) PRIMARY KEY)",
+    "CREATE TABLE vif_locations (interface_id VARCHAR(255) PRIMARY KEY, "
+    "ip_address VARCHAR(64), mac_address VARCHAR(32))",
+    "CREATE TABLE ofp_server (id INTEGER PRIMARY KEY, address VARCHAR(255), "
+    "host_type VARCHAR(255))",
+]
+
+ROOT_HELPER = "sudo"
+LOCAL_IP = "10.0.0.1"
+
+
+class StopBenchmark(Exception):
+    pass
+
+
+class IterationSubscriber(object):
+    """Ends every iteration of an agent's daemon loop.
+
+    Agents wait on their notification subscriber once per iteration, so
+    this is where the benchmark records the iteration, applies the churn
+    for the next one, and stops the loop after the last one.
+    """
+
+    connected = False
+
+    def __init__(self, benchmark):
+        self.benchmark = benchmark
+
+    def dispatch(self, event):
+        pass
+
+    def wait(self, timeout):
+        self.benchmark.iteration_done()
+        return True
+
+
+def _uuid(rng):
+    return "%08x-%04x-%04x-%04x-%012x" % tuple(
+        rng.getrandbits(bits) for bits in (32, 16, 16, 16, 48))
+
+
+def _mac(rng):
+    return "fa:16:3e:%02x:%02x:%02x" % tuple(
+        rng.getrandbits(8) for i in range(3))
+
+
+class AgentBenchmark(object):
+    """Runs one agent against a fake datapath and a populated database.
+
+    Subclasses set up the datapath, plug and unplug the ports of this host
+    in it, and create and run the agent.
+    """
+
+    def __init__(self, ports, ports_per_network=10, churn=0.01,
+                 iterations=5, latency=0, workers=1, remote_hosts=10,
+                 l2_population=False, ip_batch=False, seed=0):
+        self.port_count = ports
+        self.network_count = max(1, ports / ports_per_network)
+        self.churn_count = 0
+        if churn:
+            self.churn_count = max(1, int(round(ports * churn)))
+        self.iterations = iterations
+        self.latency = latency
+        self.workers = workers
+        self.remote_hosts = remote_hosts
+        self.l2_population = l2_population
+        self.ip_batch = ip_batch
+        self.rng = random.Random(seed)
+        self.subscriber = IterationSubscriber(self)
+
+    def run(self):
+        """Run the agent for the configured number of iterations.
+
+        :returns: a list with a dict of seconds, commands, queries and api
+            calls per iteration.
+        """
+        self.tempdir = tempfile.mkdtemp()
+        self.stubs = stubout.StubOutForTesting()
+        try:
+            self.setup_db()
+            self.setup_datapath()
+            self.stubs.Set(rootwrap, "_execute", self.datapath.execute)
+            self.stubs.Set(workers, "_pool", workers.WorkerPool(self.workers))
+            self.stubs.Set(fakes.FakeOFPClient, "calls", fakes.Counter())
+            for port in self.ports:
+                self.plug(port)
+            agent = self.create_agent()
+            self.results = []
+            self.start_iteration()
+            try:
+                self.run_agent(agent)
+            except StopBenchmark:
+                pass
+            return self.results
+        finally:
+            self.db.close()
+            self.stubs.UnsetAll()
+            shutil.rmtree(self.tempdir)
+
+    def new_port(self, network_id):
+        return {"uuid": _uuid(self.rng), "network_id": network_id,
+                "interface_id": _uuid(self.rng), "mac": _mac(self.rng)}
+
+    def insert_port(self, port):
+        self.db.execute("INSERT INTO ports VALUES (?, ?, ?, 'ACTIVE', "
+                        "'DOWN')", (port["uuid"], port["network_id"],
+                                    port["interface_id"]))
+
+    def setup_db(self):
+        self.db_path = os.path.join(self.tempdir, "quantum.sqlite")
+        self.db = sqlite3.connect(self.db_path)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.networks = [_uuid(self.rng) for i in range(self.network_count)]
+        for vlan_id, network_id in enumerate(self.networks):
+            self.db.execute("INSERT INTO vlan_bindings VALUES (?, ?)",
+                            (vlan_id + 1, network_id))
+        self.ports = []
+        for i in range(self.port_count):
+            port = self.new_port(self.networks[i % self.network_count])
+            self.insert_port(port)
+            self.ports.append(port)
+        self.db.commit()
+
+    def engine(self):
+        """Return the agent's engine, counting the statements it runs."""
+        return database.get_engine(
+            "sqlite:///%s" % self.db_path,
+            connect_args={"factory": fakes.CountingConnection})
+
+    def sqlsoup(self):
+        return SqlSoup(self.engine())
+
+    def churn(self):
+        """Replace churn_count random ports by new ones."""
+        for port in self.rng.sample(self.ports, self.churn_count):
+            self.ports.remove(port)
+            self.unplug(port)
+            self.db.execute("DELETE FROM ports WHERE uuid = ?",
+                            (port["uuid"],))
+        for i in range(self.churn_count):
+            port = self.new_port(self.rng.choice(self.networks))
+            self.insert_port(port)
+            self.ports.append(port)
+        self.db.commit()
+        # VIFs show up once the port was created through the API
+        for port in self.ports[-self.churn_count:]:
+            self.plug(port)
+
+    def start_iteration(self):
+        self.started = time.time()
+        self.commands = self.datapath.commands.value
+        self.queries = fakes.queries.value
+        self.api_calls = fakes.FakeOFPClient.calls.value
+
+    def iteration_done(self):
+        self.results.append({
+            "seconds": time.time() - self.started,
+            "commands": self.datapath.commands.value - self.commands,
+            "queries": fakes.queries.value - self.queries,
+            "api_calls": fakes.FakeOFPClient.calls.value - self.api_calls})
+        if len(self.results) >= self.iterations:
+            raise StopBenchmark()
+        if self.churn_count:
+            self.churn()
+        self.start_iteration()
+
+    def setup_datapath(self):
+        raise NotImplementedError()
+
+    def plug(self, port):
+        raise NotImplementedError()
+
+    def unplug(self, port):
+        raise NotImplementedError()
+
+    def create_agent(self):
+        raise NotImplementedError()
+
+    def run_agent(self, agent):
+        agent.daemon_loop(self.sqlsoup())
+
+
+class OVSBenchmark(AgentBenchmark):
+
+    bridges = ("br-int",)
+
+    def setup_datapath(self):
+        self.datapath = fakes.FakeOVS(self.latency, self.bridges)
+
+    def plug(self, port):
+        self.datapath.plug_vif("br-int", "tap" + port["interface_id"][:11],
+                               port["interface_id"], port["mac"])
+
+    def unplug(self, port):
+        self.datapath.unplug_vif("tap" + port["interface_id"][:11])
+
+    def create_agent(self):
+        return ovs_quantum_agent.OVSQuantumAgent("br-int", ROOT_HELPER,
+                                                 self.subscriber)
+
+
+class TunnelBenchmark(OVSBenchmark):
+    """The tunnel agent with on-demand tunnels.
+
+    Every network also has a port on one of remote_hosts other
+    hypervisors.
+    """
+
+    bridges = ("br-int", "br-tun")
+
+    def setup_db(self):
+        super(TunnelBenchmark, self).setup_db()
+        hosts = ["10.0.1.%d" % (i + 1) for i in range(self.remote_hosts)]
+        for host in hosts:
+            self.db.execute("INSERT INTO tunnel_endpoints VALUES (?)",
+                            (host,))
+        for i, network_id in enumerate(self.networks):
+            port = self.new_port(network_id)
+            self.insert_port(port)
+            self.db.execute("INSERT INTO vif_locations VALUES (?, ?, ?)",
+                            (port["interface_id"], hosts[i % len(hosts)],
+                             port["mac"]))
+        self.db.commit()
+
+    def create_agent(self):
+        return ovs_quantum_agent.OVSQuantumTunnelAgent(
+            "br-int", "br-tun", None, LOCAL_IP, ROOT_HELPER, self.subscriber,
+            l2_population=self.l2_population)
+
+
+class LinuxBridgeBenchmark(AgentBenchmark):
+
+    def setup_datapath(self):
+        sysfs = os.path.join(self.tempdir, "sys")
+        os.mkdir(sysfs)
+        self.datapath = fakes.FakeLinuxHost(sysfs, self.latency, "eth1")
+        # the agent reads the devices from sysfs directly
+        self.stubs.Set(linuxbridge_quantum_agent, "NET_FS", sysfs + os.sep)
+
+    def plug(self, port):
+        self.datapath.plug_tap("tap" + port["interface_id"][:11])
+
+    def unplug(self, port):
+        self.datapath.unplug_tap("tap" + port["interface_id"][:11])
+
+    def create_agent(self):
+        return linuxbridge_quantum_agent.LinuxBridgeQuantumAgent(
+            "brq", "eth1", 2, ROOT_HELPER, self.subscriber,
+            ip_batch=self.ip_batch)
+
+    def run_agent(self, agent):
+        db = database.AgentDB(self.engine())
+        try:
+            agent.daemon_loop(db)
+        finally:
+            db.close()
+
+
+class RyuBenchmark(OVSBenchmark):
+
+    def setup_db(self):
+        super(RyuBenchmark, self).setup_db()
+        self.db.execute("INSERT INTO ofp_server VALUES "
+                        "(1, '127.0.0.1:6633', 'controller')")
+        self.db.execute("INSERT INTO ofp_server VALUES "
+                        "(2, '127.0.0.1:8080', 'REST_API')")
+        self.db.commit()
+
+    def create_agent(self):
+        if "ryu" in sys.modules:
+            from quantum.plugins.ryu.agent import ryu_quantum_agent
+        else:
+            from quantum.plugins.ryu.tests.unit import utils
+            with utils.patch_fake_ryu_client():
+                from quantum.plugins.ryu.agent import ryu_quantum_agent
+        self.stubs.Set(ryu_quantum_agent, "OFPClient", fakes.FakeOFPClient)
+        self.agent_db = self.sqlsoup()
+        # the interfaces come from a monitor after the first, full scan
+        return ryu_quantum_agent.OVSQuantumOFPRyuAgent(
+            "br-int", self.agent_db, ROOT_HELPER, self.subscriber,
+            fakes.FakeInterfaceMonitor(self.datapath))
+
+    def run_agent(self, agent):
+        agent.daemon_loop(self.agent_db)
+
+
+BENCHMARKS = {"ovs": OVSBenchmark,
+              "tunnel": TunnelBenchmark,
+              "linuxbridge": LinuxBridgeBenchmark,
+              "ryu": RyuBenchmark}
+
+
+def run_benchmark(agent, ports, **kwargs):
+    """Benchmark an agent, one of BENCHMARKS, with ports local ports.
+
+    kwargs are passed to AgentBenchmark.
+    """
+    return BENCHMARKS[agent](ports, **kwargs).run()
+
+
+def main():
+    parser = OptionParser(usage="%prog [OPTIONS]")
+    parser.add_option("--agents", default="ovs,tunnel,linuxbridge,ryu",
+                      help="comma separated agents to run, among %s"
+                      % ", ".join(sorted(BENCHMARKS)))
+    parser.add_option("--ports", default="1000,5000,10000",
+                      help="comma separated numbers of ports on the host")
+    parser.add_option("--ports-per-network", type="int", default=10)
+    parser.add_option("--churn", type="float", default=0.01,
+                      help="fraction of the ports replaced between two "
+                      "iterations")
+    parser.add_option("--iterations", type="int", default=5)
+    parser.add_option("--latency", type="float", default=0,
+                      help="simulated duration of every command, in ms")
+    parser.add_option("--workers", type="int", default=1,
+                      help="command_workers of the agents")
+    parser.add_option("--remote-hosts", type="int", default=10,
+                      help="other hypervisors, for the tunnel agent")
+    parser.add_option("--l2-population", action="store_true",
+                      default=False, help="for the tunnel agent")
+    parser.add_option("--ip-batch", action="store_true", default=False,
+                      help="for the linuxbridge agent")
+    options, args = parser.parse_args()
+
+    print "%-12s %6s %4s %10s %9s %8s %6s" % (
+        "agent", "ports", "iter", "loop (ms)", "commands", "queries", "api")
+    for agent in options.agents.split(","):
+        for ports in options.ports.split(","):
+            results = run_benchmark(
+                agent, int(ports),
+                ports_per_network=options.ports_per_network,
+                churn=options.churn, iterations=options.iterations,
+                latency=options.latency / 1000, workers=options.workers,
+                remote_hosts=options.remote_hosts,
+                l2_population=options.l2_population,
+                ip_batch=options.ip_batch)
+            for i, result in enumerate(results):
+                print "%-12s %6s %4d %10.1f %9d %8d %6d" % (
+                    agent, ports, i + 1, result["seconds"] * 1000,
+                    result["commands"], result["queries"],
+                    result["api_calls"])
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,628 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Simulated datapaths and database connections for the agent benchmark.
+
+The fake datapaths answer the commands the agents run as root from an
+in-memory model, after a configurable latency, so the real OVSBridge and
+LinuxBridge classes can be driven at any scale without Open vSwitch, Linux
+bridges or root privileges. FakeRyuRESTServer stands for the Ryu REST API
+on a local port.
+"""
+
+import BaseHTTPServer
+import json
+import os
+import shutil
+import SocketServer
+import sqlite3
+import threading
+import time
+
+from eventlet import patcher
+
+from quantum.plugins.openvswitch.agent import ovs_quantum_agent
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def incr(self):
+        self._lock.acquire()
+        try:
+            self.value += 1
+        finally:
+            self._lock.release()
+
+
+# statements run through a CountingConnection
+queries = Counter()
+
+
+class CountingCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        queries.incr()
+        return sqlite3.Cursor.execute(self, *args)
+
+    def executemany(self, *args):
+        queries.incr()
+        return sqlite3.Cursor.executemany(self, *args)
+
+
+class CountingConnection(sqlite3.Connection):
+    """SQLite connection counting the statements run by the agents.
+
+    Use it as the factory of sqlite3.connect(), e.g. through the
+    connect_args of an SQLAlchemy engine.
+    """
+
+    def cursor(self, factory=CountingCursor):
+        return sqlite3.Connection.cursor(self, factory)
+
+
+class FakeDatapath(object):
+    """Base class of the fake datapaths.
+
+    execute() has the signature of quantum.agent.rootwrap._execute, which
+    the benchmark replaces with it. Commands are dispatched to the
+    handlers of the subclass, keyed by executable name.
+    """
+
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.commands = Counter()
+        # executable -> number of calls
+        self.calls = {}
+        self._lock = threading.Lock()
+        self.handlers = {}
+
+    def execute(self, root_helper, args, process_input=None):
+        self.commands.incr()
+        if self.latency:
+            time.sleep(self.latency)
+        self._lock.acquire()
+        try:
+            self.calls[args[0]] = self.calls.get(args[0], 0) + 1
+            handler = self.handlers.get(args[0])
+            if not handler:
+                return 1, "", "%s: command not found" % args[0]
+            return handler(args[1:], process_input)
+        finally:
+            self._lock.release()
+
+
+class DatapathError(Exception):
+    pass
+
+
+def _split_commands(args):
+    """Split ovs-vsctl arguments into (global options, commands)."""
+    options = []
+    while args and args[0].startswith("--") and args[0] != "--":
+        options.append(args.pop(0))
+    commands = [[]]
+    for arg in args:
+        if arg == "--":
+            commands.append([])
+        else:
+            commands[-1].append(arg)
+    return options, [command for command in commands if command]
+
+
+def _parse_flow_mod(flow_str):
+    """Return (cookie, priority, match, actions) of an ovs-ofctl flow."""
+    fields, _, actions = flow_str.partition("actions=")
+    cookie = None
+    priority = 32768
+    match = []
+    for field in fields.strip(",").split(","):
+        key, _, value = field.partition("=")
+        if key == "cookie":
+            cookie = int(value.split("/")[0], 0)
+        elif key == "priority":
+            priority = int(value)
+        elif field:
+            match.append(field)
+    return cookie, priority, ",".join(match), actions
+
+
+class FakeOVS(FakeDatapath):
+    """Open vSwitch bridges, ports, interfaces and flow tables.
+
+    Supports the ovs-vsctl and ovs-ofctl commands used by the OVS and Ryu
+    agents.
+    """
+
+    def __init__(self, latency=0, bridges=("br-int",)):
+        super(FakeOVS, self).__init__(latency)
+        self.handlers = {"ovs-vsctl": self.vsctl, "ovs-ofctl": self.ofctl}
+        # bridge -> set of port names
+        self.bridges = {}
+        # interface name -> {"ofport", "external_ids", "type", "options"}
+        self.interfaces = {}
+        # port name -> tag
+        self.tags = {}
+        # bridge -> (priority, parsed match) -> (cookie, match, actions)
+        self.flows = {}
+        self.next_ofport = 1
+        for bridge in bridges:
+            self._add_br(bridge)
+
+    def _add_br(self, bridge):
+        self.bridges.setdefault(bridge, set())
+        self.flows.setdefault(bridge, {})
+
+    def _add_port(self, bridge, name, external_ids=None):
+        self.bridges[bridge].add(name)
+        self.interfaces[name] = {"ofport": self.next_ofport,
+                                 "external_ids": external_ids or {},
+                                 "type": "", "options": {}}
+        self.tags[name] = None
+        self.next_ofport += 1
+
+    def _del_port(self, name):
+        for ports in self.bridges.values():
+            ports.discard(name)
+        self.interfaces.pop(name, None)
+        self.tags.pop(name, None)
+
+    def plug_vif(self, bridge, name, iface_id, mac):
+        """Attach a VIF the way the compute driver does."""
+        self._lock.acquire()
+        try:
+            self._add_port(bridge, name, {"iface-id": iface_id,
+                                          "attached-mac": mac})
+        finally:
+            self._lock.release()
+
+    def unplug_vif(self, name):
+        self._lock.acquire()
+        try:
+            self._del_port(name)
+        finally:
+            self._lock.release()
+
+    def vsctl(self, args, process_input):
+        options, commands = _split_commands(list(args))
+        output = []
+        try:
+            for command in commands:
+                flags = []
+                while command[0].startswith("--"):
+                    flags.append(command.pop(0))
+                handler = getattr(self, "_vsctl_%s" %
+                                  command[0].replace("-", "_"), None)
+                if handler is None:
+                    raise DatapathError("unknown command '%s'" % command[0])
+                result = handler(options, flags, *command[1:])
+                if result is not None:
+                    output.append(result)
+        except DatapathError, e:
+            return 1, "", "ovs-vsctl: %s\n" % e
+        return 0, "".join(output), ""
+
+    def _check_port(self, name):
+        if name not in self.interfaces:
+            raise DatapathError("no row \"%s\"" % name)
+
+    def _vsctl_add_br(self, options, flags, bridge):
+        self._add_br(bridge)
+
+    def _vsctl_del_br(self, options, flags, bridge):
+        if bridge not in self.bridges:
+            if "--if-exists" in flags:
+                return
+            raise DatapathError("no bridge named %s" % bridge)
+        for name in list(self.bridges.pop(bridge)):
+            self._del_port(name)
+        del self.flows[bridge]
+
+    def _vsctl_add_port(self, options, flags, bridge, name, *columns):
+        if name in self.interfaces:
+            if "--may-exist" in flags:
+                return
+            raise DatapathError("cannot create a port named %s because a "
+                                "port named %s already exists" % (name, name))
+        self._add_port(bridge, name)
+
+    def _vsctl_del_port(self, options, flags, bridge, name):
+        if name not in self.interfaces:
+            if "--if-exists" in flags:
+                return
+            raise DatapathError("no port named %s" % name)
+        self._del_port(name)
+
+    def _vsctl_set(self, options, flags, table, record, *values):
+        if table == "Bridge":
+            return
+        self._check_port(record)
+        for value in values:
+            column, _, value = value.partition("=")
+            if table == "Port" and column == "tag":
+                self.tags[record] = int(value)
+            elif column.startswith("options:"):
+                self.interfaces[record]["options"][column[8:]] = value
+            else:
+                self.interfaces[record][column] = value
+
+    def _vsctl_clear(self, options, flags, table, record, column):
+        self._check_port(record)
+        if table == "Port" and column == "tag":
+            self.tags[record] = None
+
+    def _vsctl_get(self, options, flags, table, record, column):
+        if table == "Bridge":
+            return '"%016x"\n' % (sorted(self.bridges).index(record) + 1)
+        self._check_port(record)
+        if table == "Port":
+            return "%s\n" % (self.tags[record] or "[]")
+        return "%s\n" % self.interfaces[record][column]
+
+    def _vsctl_list_ports(self, options, flags, bridge):
+        return "".join(name + "\n" for name in sorted(self.bridges[bridge]))
+
+    def _vsctl_set_controller(self, options, flags, bridge, target):
+        pass
+
+    def _vsctl_list(self, options, flags, table, record=None):
+        columns = None
+        for option in options:
+            if option.startswith("--columns="):
+                columns = option[10:].split(",")
+        names = sorted(self.interfaces)
+        if record:
+            self._check_port(record)
+            names = [record]
+        data = []
+        for name in names:
+            interface = self.interfaces[name]
+            values = {"name": name,
+                      "ofport": interface["ofport"],
+                      "external_ids": [
+                          "map", sorted(interface["external_ids"].items())],
+                      "tag": self.tags[name] or ["set", []]}
+            data.append([values[column] for column in columns])
+        return json.dumps({"headings": columns, "data": data}) + "\n"
+
+    def ofctl(self, args, process_input):
+        command, bridge = args[0], args[1]
+        args = list(args[2:])
+        if bridge not in self.flows:
+            return 1, "", ("ovs-ofctl: %s is not a bridge or a socket\n"
+                           % bridge)
+        flows = self.flows[bridge]
+        strict = "--strict" in args
+        if strict:
+            args.remove("--strict")
+        if args == ["-"]:
+            mods = process_input.splitlines()
+        else:
+            mods = args
+        if command in ("add-flow", "add-flows"):
+            for mod in mods:
+                cookie, priority, match, actions = _parse_flow_mod(mod)
+                key = (priority, ovs_quantum_agent.parse_match(match))
+                flows[key] = (cookie or 0, match, actions)
+        elif command == "del-flows":
+            if not mods:
+                flows.clear()
+            for mod in mods:
+                self._del_flows(flows, strict, mod)
+        elif command == "dump-flows":
+            lines = ["NXST_FLOW reply (xid=0x4):\n"]
+            for key, (cookie, match, actions) in flows.items():
+                fields = "priority=%s" % key[0]
+                if match:
+                    fields += "," + match
+                lines.append(" cookie=0x%x, duration=1.0s, table=0, "
+                             "n_packets=0, n_bytes=0, %s actions=%s\n"
+                             % (cookie, fields, actions))
+            return 0, "".join(lines), ""
+        else:
+            return 1, "", "ovs-ofctl: unknown command '%s'\n" % command
+        return 0, "", ""
+
+    def _del_flows(self, flows, strict, mod):
+        cookie, priority, match, _ = _parse_flow_mod(mod)
+        match = ovs_quantum_agent.parse_match(match)
+        for key, flow in flows.items():
+            if cookie is not None and flow[0] != cookie:
+                continue
+            if strict:
+                if key == (priority, match):
+                    del flows[key]
+            elif match <= key[1]:
+                del flows[key]
+
+
+class FakeLinuxHost(FakeDatapath):
+    """Network devices and Linux bridges of a host.
+
+    Supports the ip and brctl commands used by the Linux bridge agent, and
+    mirrors the devices into a directory laid out like /sys/class/net,
+    which the agent reads directly.
+    """
+
+    def __init__(self, sysfs, latency=0, physical_interface="eth1"):
+        super(FakeLinuxHost, self).__init__(latency)
+        self.handlers = {"ip": self.ip, "brctl": self.brctl}
+        self.sysfs = sysfs
+        # device name -> bridge it is attached to, or None
+        self.devices = {}
+        self.taps = set()
+        self.bridges = set()
+        self._add_device(physical_interface)
+
+    def _path(self, *names):
+        return os.path.join(self.sysfs, *names)
+
+    def _add_device(self, name, devtype=None):
+        self.devices[name] = None
+        os.mkdir(self._path(name))
+        uevent = open(self._path(name, "uevent"), "w")
+        if devtype:
+            uevent.write("DEVTYPE=%s\n" % devtype)
+        uevent.write("INTERFACE=%s\n" % name)
+        uevent.close()
+
+    def _del_device(self, name):
+        bridge = self.devices.pop(name)
+        if bridge:
+            os.unlink(self._path(bridge, "brif", name))
+        if name in self.bridges:
+            self.bridges.remove(name)
+            for device, master in self.devices.items():
+                if master == name:
+                    self._delif(name, device)
+        self.taps.discard(name)
+        shutil.rmtree(self._path(name), True)
+
+    def _addif(self, bridge, name):
+        self.devices[name] = bridge
+        open(self._path(bridge, "brif", name), "w").close()
+        os.mkdir(self._path(name, "brport"))
+
+    def _delif(self, bridge, name):
+        self.devices[name] = None
+        os.unlink(self._path(bridge, "brif", name))
+        os.rmdir(self._path(name, "brport"))
+
+    def plug_tap(self, name):
+        """Create a tap device the way the compute driver does."""
+        self._lock.acquire()
+        try:
+            self._add_device(name)
+            open(self._path(name, "tun_flags"), "w").close()
+            self.taps.add(name)
+        finally:
+            self._lock.release()
+
+    def unplug_tap(self, name):
+        self._lock.acquire()
+        try:
+            self._del_device(name)
+        finally:
+            self._lock.release()
+
+    def _no_device(self, name):
+        return 1, "", "Cannot find device \"%s\"\n" % name
+
+    def ip(self, args, process_input):
+        force = args[0] == "-force"
+        if force:
+            args = args[1:]
+        if args[0] == "-batch":
+            return self._ip_batch(process_input, force)
+        if args[0] == "tuntap":
+            return 0, "".join("%s: tap\n" % tap
+                              for tap in sorted(self.taps)), ""
+        action = args[1]
+        if action == "show":
+            name = args[-1]
+            if name not in self.devices:
+                return self._no_device(name)
+            return 0, "1: %s: <BROADCAST,MULTICAST,UP>\n" % name, ""
+        if action == "add":
+            # ip link add link <dev> name <name> type vlan id <id>
+            # ip link add name <name> type bridge ...
+            name = args[args.index("name") + 1]
+            if name in self.devices:
+                return 2, "", "RTNETLINK answers: File exists\n"
+            if "bridge" in args:
+                return self.brctl(["addbr", name], None)
+            self._add_device(name, "vlan")
+            return 0, "", ""
+        if args[2] == "dev":
+            args = args[:2] + args[3:]
+        name = args[2]
+        if name not in self.devices:
+            return self._no_device(name)
+        if action == "delete":
+            self._del_device(name)
+        elif "master" in args:
+            bridge = args[args.index("master") + 1]
+            if bridge not in self.bridges:
+                return 2, "", "Device does not exist\n"
+            if self.devices[name]:
+                self._delif(self.devices[name], name)
+            self._addif(bridge, name)
+        elif "nomaster" in args and self.devices[name]:
+            self._delif(self.devices[name], name)
+        return 0, "", ""
+
+    def _ip_batch(self, process_input, force):
+        """Run the commands of "ip [-force] -batch -"."""
+        returncode = 0
+        errors = []
+        for number, line in enumerate(process_input.splitlines()):
+            code, stdout, stderr = self.ip(line.split(), None)
+            if code:
+                returncode = 1
+                errors.append("%sCommand failed -:%d\n" % (stderr,
+                                                           number + 1))
+                if not force:
+                    break
+        return returncode, "", "".join(errors)
+
+    def brctl(self, args, process_input):
+        command, bridge = args[0], args[1]
+        if command == "addbr":
+            if bridge in self.devices:
+                return 1, "", "device %s already exists\n" % bridge
+            self._add_device(bridge, "bridge")
+            os.mkdir(self._path(bridge, "brif"))
+            self.bridges.add(bridge)
+        elif command == "delbr":
+            if bridge not in self.bridges:
+                return 1, "", "bridge %s doesn't exist\n" % bridge
+            self._del_device(bridge)
+        elif bridge not in self.bridges:
+            return 1, "", "bridge %s doesn't exist\n" % bridge
+        elif command == "addif":
+            name = args[2]
+            if name not in self.devices:
+                return 1, "", "interface %s does not exist!\n" % name
+            if self.devices[name]:
+                return 1, "", ("device %s is already a member of a bridge\n"
+                               % name)
+            self._addif(bridge, name)
+        elif command == "delif":
+            name = args[2]
+            if self.devices.get(name) != bridge:
+                return 1, "", ("device %s is not a slave of %s\n"
+                               % (name, bridge))
+            self._delif(bridge, name)
+        return 0, "", ""
+
+
+class FakeInterfaceMonitor(object):
+    """An ovsdb.InterfaceMonitor replicating the Interface table of a
+    FakeOVS without running any command."""
+
+    active = True
+
+    def __init__(self, datapath):
+        self.datapath = datapath
+
+    def get_interfaces(self):
+        self.datapath._lock.acquire()
+        try:
+            return [{"name": name, "ofport": interface["ofport"],
+                     "external_ids": dict(interface["external_ids"])}
+                    for name, interface in self.datapath.interfaces.items()]
+        finally:
+            self.datapath._lock.release()
+
+
+class FakeOFPClient(object):
+    """Records the calls of the Ryu agent to the Ryu REST API."""
+
+    calls = Counter()
+
+    def __init__(self, address):
+        self.address = address
+
+    def update_port(self, network_id, dpid, port):
+        FakeOFPClient.calls.incr()
+
+    def update_ports(self, ports):
+        for network_id, dpid, port in ports:
+            self.update_port(network_id, dpid, port)
+
+    def delete_port(self, network_id, dpid, port):
+        FakeOFPClient.calls.incr()
+
+
+class FakeRyuRESTHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # keeps the connection open between requests
+    protocol_version = "HTTP/1.1"
+    # sends each response at once
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections.incr()
+
+    def handle_request(self):
+        length = int(self.headers.getheader("content-length") or 0)
+        if length:
+            self.rfile.read(length)
+        self.server.record(self.command, self.path)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(self.server.status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = do_PUT = do_POST = do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeRyuRESTServer(SocketServer.ThreadingMixIn,
+                        BaseHTTPServer.HTTPServer):
+    """Ryu REST API answering every request after a latency.
+
+    Counts the requests and the connections opened by the clients, and
+    records the paths which were PUT.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           FakeRyuRESTHandler,
+                                           bind_and_activate=False)
+        # The quantum server patches socket with eventlet, whose sockets
+        # are only really closed by the hub of the thread which used them,
+        # and every connection is handled by a new thread here.
+        self.socket.close()
+        self.socket = patcher.original("socket").socket(self.address_family,
+                                                        self.socket_type)
+        self.server_bind()
+        self.server_activate()
+        self.address = "%s:%d" % self.server_address
+        self.latency = latency
+        # of every response
+        self.status = 200
+        self.requests = Counter()
+        self.connections = Counter()
+        self.put_paths = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, method, path):
+        self.requests.incr()
+        if method == "PUT":
+            self._lock.acquire()
+            try:
+                self.put_paths.add(path)
+            finally:
+                self._lock.release()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,174 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark of the rootwrap command authorization and daemon.
+
+Authorizes commands against filters generated for every bridge of a
+large host, as deployments do for ovs-vsctl and ip, once by trying the
+filter list in order and once through a FilterIndex. The time per
+command and the number of filters tried are reported.
+
+The round trip to a rootwrap daemon is then timed with a command it
+refuses, which is the overhead added to every command, and with a
+command it runs, next to running that command directly, e.g.:
+
+    python -m quantum.tests.benchmark.rootwrap --bridges 1000,2500
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from optparse import OptionParser
+
+from quantum.agent import rootwrap
+from quantum.rootwrap import daemon
+from quantum.rootwrap import filters
+from quantum.rootwrap import wrapper
+
+
+def bridge_filters(bridges):
+    """Filters for the ovs-vsctl and ip commands run on every bridge.
+
+    There are two ovs-vsctl RegExpFilters and one ip RegExpFilter per
+    bridge.
+    """
+    entries = [filters.CommandFilter("/sbin/brctl", "root")]
+    for i in range(bridges):
+        entries.append(filters.RegExpFilter(
+            "/usr/bin/ovs-vsctl", "root", "ovs-vsctl", "--timeout=2",
+            "add-port", "br%d" % i, "tap[0-9a-f-]+"))
+        entries.append(filters.RegExpFilter(
+            "/usr/bin/ovs-vsctl", "root", "ovs-vsctl", "--timeout=2",
+            "del-port", "br%d" % i, "tap[0-9a-f-]+"))
+        entries.append(filters.RegExpFilter(
+            "/sbin/ip", "root", "ip", "link", "set", "br%d" % i, "up|down"))
+    return entries
+
+
+def _authorize(filter_list, commands, repeat):
+    """Returns the seconds per command and the filters tried per command"""
+    tried = 0
+    started = time.time()
+    for i in range(repeat):
+        for userargs in commands:
+            if isinstance(filter_list, wrapper.FilterIndex):
+                candidates = filter_list.candidates(userargs)
+            else:
+                candidates = filter_list
+            for f in candidates:
+                tried += 1
+                if f.match(userargs):
+                    break
+    count = repeat * len(commands)
+    return (time.time() - started) / count, tried / count
+
+
+def run_benchmark(bridges, repeat=100):
+    """Authorize commands on the last bridges against bridge_filters().
+
+    :returns: a dict with the milliseconds per command and the number of
+        filters tried per command, with a linear scan and with the index.
+    """
+    filter_list = bridge_filters(bridges)
+    index = wrapper.FilterIndex(filter_list)
+    bridge = "br%d" % (bridges - 1)
+    commands = [["ovs-vsctl", "--timeout=2", "del-port", bridge, "tap0"],
+                ["ip", "link", "set", bridge, "down"]]
+    for userargs in commands:
+        assert (wrapper.match_filter(filter_list, userargs) is
+                wrapper.match_filter(index, userargs))
+    linear, linear_tried = _authorize(filter_list, commands,
+                                      max(1, repeat / 100))
+    indexed, indexed_tried = _authorize(index, commands, repeat)
+    return {"filters": len(filter_list),
+            "linear_ms": linear * 1000,
+            "linear_tried": linear_tried,
+            "indexed_ms": indexed * 1000,
+            "indexed_tried": indexed_tried}
+
+
+def _time_calls(func, calls):
+    started = time.time()
+    for i in range(calls):
+        func()
+    return (time.time() - started) / calls
+
+
+def run_daemon_benchmark(round_trips=1000):
+    """Time commands sent to a rootwrap daemon serving in this process.
+
+    :returns: a dict with the milliseconds per round trip of a refused
+        command, of /bin/true run by the daemon and of /bin/true run
+        directly.
+    """
+    tempdir = tempfile.mkdtemp()
+    server = daemon.RootwrapDaemon(
+        [filters.CommandFilter("/bin/true", "root")],
+        os.path.join(tempdir, "run", "rootwrap.sock"))
+    server.listen()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    client = rootwrap.DaemonClient(server.socket_path, ["false"])
+    try:
+        assert client.execute(["ls"])[0] == daemon.RC_UNAUTHORIZED
+        assert client.execute(["true"]) == (0, "", "")
+        refused = _time_calls(lambda: client.execute(["ls"]), round_trips)
+        executed = _time_calls(lambda: client.execute(["true"]),
+                               max(1, round_trips / 10))
+        direct = _time_calls(lambda: subprocess.call(["/bin/true"]),
+                             max(1, round_trips / 10))
+    finally:
+        client.close()
+        server.close()
+        # let serve_forever() return before the interpreter exits
+        thread.join(1)
+        shutil.rmtree(tempdir)
+    return {"round_trip_ms": refused * 1000,
+            "daemon_execute_ms": executed * 1000,
+            "direct_execute_ms": direct * 1000}
+
+
+def main():
+    parser = OptionParser(usage="%prog [OPTIONS]")
+    parser.add_option("--bridges", default="100,1000,2500",
+                      help="comma separated numbers of bridges")
+    parser.add_option("--round-trips", type="int", default=1000,
+                      help="number of commands sent to the daemon")
+    options, args = parser.parse_args()
+
+    print "%8s %8s %11s %8s %11s %8s" % (
+        "bridges", "filters", "linear (ms)", "tried", "index (ms)", "tried")
+    for bridges in options.bridges.split(","):
+        result = run_benchmark(int(bridges), repeat=1000)
+        print "%8s %8d %11.3f %8d %11.4f %8d" % (
+            bridges, result["filters"], result["linear_ms"],
+            result["linear_tried"], result["indexed_ms"],
+            result["indexed_tried"])
+
+    result = run_daemon_benchmark(options.round_trips)
+    print
+    print "daemon round trip: %.3f ms" % result["round_trip_ms"]
+    print "/bin/true through the daemon: %.3f ms, directly: %.3f ms" % (
+        result["daemon_execute_ms"], result["direct_execute_ms"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Startup benchmark of the Ryu plugin.
+
+Starts the plugin's OFPRyuDriver, which registers every network with the
+Ryu REST API, against a local fake REST API (see fakes) answering after a
+configurable latency. The startup time, the number of requests and the
+number of connections opened are reported, e.g.:
+
+    python -m quantum.tests.benchmark.ryu_startup --networks 1000,10000 \\
+        --connections 1,4,16 --latency 1
+
+With --one-shot, every request opens its own connection, as with
+ryu.app.client.OFPClient.
+"""
+
+import ConfigParser
+import sys
+import time
+from optparse import OptionParser
+
+import stubout
+
+import quantum.db.api as db
+from quantum.plugins.ryu import rest_client
+from quantum.plugins.ryu.tests.unit import utils
+from quantum.tests.benchmark import fakes
+
+
+class OneShotClient(rest_client.OFPClient):
+    """Opens a new connection for every request."""
+
+    def _do_request(self, method, action):
+        try:
+            return super(OneShotClient, self)._do_request(method, action)
+        finally:
+            while self._idle:
+                self._idle.pop().close()
+
+
+def _config(address, connections):
+    config = ConfigParser.ConfigParser()
+    config.add_section("OVS")
+    config.set("OVS", "openflow-controller", utils.FAKE_CONTROLLER_ADDR)
+    config.set("OVS", "openflow-rest-api", address)
+    config.set("OVS", "openflow-rest-api-connections", str(connections))
+    return config
+
+
+def run_benchmark(networks, connections=rest_client.DEFAULT_CONNECTIONS,
+                  latency=0, one_shot=False):
+    """Start the driver with networks networks in the database.
+
+    :param latency: seconds the REST API takes to answer a request.
+    :returns: a dict with the seconds taken, the requests received and the
+        connections opened by the REST API.
+    """
+    # for the ryu specific tables
+    import quantum.plugins.ryu.db.models
+    db.configure_db({"sql_connection": "sqlite://"})
+    server = fakes.FakeRyuRESTServer(latency)
+    server.start()
+    patcher = utils.patch_fake_ryu_client()
+    patcher.start()
+    try:
+        from quantum.plugins.ryu import ryu_quantum_plugin
+        for i in range(networks):
+            db.network_create("tenant", "net%d" % i)
+        config = _config(server.address, connections)
+        stubs = stubout.StubOutForTesting()
+        if one_shot:
+            stubs.Set(rest_client, "OFPClient", OneShotClient)
+        try:
+            started = time.time()
+            ryu_quantum_plugin.OFPRyuDriver(config)
+            seconds = time.time() - started
+        finally:
+            stubs.UnsetAll()
+        return {"seconds": seconds,
+                "requests": server.requests.value,
+                "connections": server.connections.value,
+                "registered": len(server.put_paths)}
+    finally:
+        patcher.stop()
+        server.stop()
+        db.clear_db()
+
+
+def main():
+    parser = OptionParser(usage="%prog [OPTIONS]")
+    parser.add_option("--networks", default="1000,10000",
+                      help="comma separated numbers of networks")
+    parser.add_option("--connections", default="1,4,16",
+                      help="comma separated numbers of connections to the "
+                      "REST API")
+    parser.add_option("--latency", type="float", default=1,
+                      help="simulated duration of every request, in ms")
+    parser.add_option("--one-shot", action="store_true", default=False,
+                      help="open a connection for every request")
+    options, args = parser.parse_args()
+
+    print "%8s %11s %12s %8s %11s" % (
+        "networks", "connections", "startup (s)", "requests", "opened")
+    for networks in options.networks.split(","):
+        for connections in options.connections.split(","):
+            result = run_benchmark(int(networks), int(connections),
+                                   latency=options.latency / 1000,
+                                   one_shot=options.one_shot)
+            print "%8s %11s %12.2f %8d %11d" % (
+                networks, connections, result["seconds"],
+                result["requests"], result["connections"])
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from quantum.tests.benchmark import agents
+
+
+class AgentBenchmarkTest(unittest.TestCase):
+    """Runs every agent of the benchmark at a small scale."""
+
+    def _run(self, agent, **kwargs):
+        results = agents.run_benchmark(agent, 20, churn=0.1, iterations=3,
+                                       **kwargs)
+        self.assertEqual(len(results), 3)
+        for result in results:
+            self.assertTrue(result["commands"] > 0)
+            self.assertTrue(result["queries"] > 0)
+        # only the churned ports are processed after the cold start
+        self.assertTrue(results[2]["commands"] < results[0]["commands"])
+        self.assertTrue(results[2]["queries"] <= results[0]["queries"])
+        return results
+
+    def test_ovs(self):
+        self._run("ovs")
+
+    def test_tunnel(self):
+        self._run("tunnel", remote_hosts=3, l2_population=True)
+
+    def test_tunnel_steady_state(self):
+        queries = []
+        for ports in (20, 40):
+            results = agents.run_benchmark("tunnel", ports, churn=0,
+                                           iterations=2, remote_hosts=3,
+                                           l2_population=True)
+            queries.append(results[1]["queries"])
+        # the ports are not loaded again one by one
+        self.assertEqual(queries[0], queries[1])
+
+    def test_linuxbridge(self):
+        self._run("linuxbridge", workers=4)
+
+    def test_linuxbridge_ip_batch(self):
+        results = agents.run_benchmark("linuxbridge", 20, churn=0.1,
+                                       iterations=2, ip_batch=True)
+        # every network and port is set up by a single ip -batch
+        self.assertEqual([result["commands"] for result in results], [1, 1])
+
+    def test_linuxbridge_steady_state(self):
+        results = agents.run_benchmark("linuxbridge", 20, churn=0,
+                                       iterations=2)
+        # the devices are read from sysfs
+        self.assertEqual(results[1]["commands"], 0)
+
+    def test_ryu(self):
+        results = self._run("ryu")
+        self.assertEqual(results[0]["api_calls"], 20)
+        # then only the new ports are registered
+        self.assertEqual(results[1]["api_calls"], 2)
@@ -0,0 +1,117 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import event
+from sqlalchemy import exc
+from sqlalchemy import pool
+import stubout
+
+from quantum.agent import database
+
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, statement):
+        if self.connection.closed:
+            raise Exception("MySQL server has gone away")
+        self.connection.statements.append(statement)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+
+    def __init__(self, closed=False):
+        self.closed = closed
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeRecord(object):
+
+    def __init__(self, checked_in=None):
+        self.info = {}
+        if checked_in is not None:
+            self.info["checked_in"] = checked_in
+
+
+class CheckoutTest(unittest.TestCase):
+
+    def test_idle_connection_pinged(self):
+        conn = FakeConnection()
+        database._on_checkout(conn, FakeRecord(time.time() - 60), None)
+        self.assertEqual(conn.statements, ["SELECT 1"])
+
+    def test_recent_connection_not_pinged(self):
+        conn = FakeConnection()
+        database._on_checkout(conn, FakeRecord(time.time()), None)
+        database._on_checkout(conn, FakeRecord(), None)
+        self.assertEqual(conn.statements, [])
+
+    def test_dead_connection(self):
+        self.assertRaises(exc.DisconnectionError, database._on_checkout,
+                          FakeConnection(closed=True),
+                          FakeRecord(time.time() - 60), None)
+
+
+class AgentDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.tempdir = tempfile.mkdtemp()
+        self.engine = database.get_engine(
+            "sqlite:///%s" % os.path.join(self.tempdir, "quantum.sqlite"),
+            poolclass=pool.QueuePool)
+        self.connections = []
+        event.listen(self.engine, "connect",
+                     lambda conn, record: self.connections.append(conn))
+        self.db = database.AgentDB(self.engine)
+        self.db.execute("CREATE TABLE ports (uuid VARCHAR(36), "
+                        "state VARCHAR(8))")
+        self.db.execute("INSERT INTO ports VALUES ('a', 'ACTIVE')")
+        self.db.execute("INSERT INTO ports VALUES ('b', 'DOWN')")
+        self.db.commit()
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_fetch(self):
+        rows = self.db.fetch("SELECT uuid FROM ports WHERE state = :state",
+                             state="ACTIVE")
+        self.assertEqual([row["uuid"] for row in rows], ["a"])
+
+    def test_reconnect(self):
+        # the server closed the connection while it was in the pool
+        self.connections[0].close()
+        self.stubs.Set(database, "IDLE_PING_INTERVAL", 0)
+        rows = self.db.fetch("SELECT uuid FROM ports")
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(len(self.connections), 2)
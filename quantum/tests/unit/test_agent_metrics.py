@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import stubout
+
+from quantum.agent import metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.registry = metrics.Registry()
+        self.stubs.Set(metrics, "_registry", self.registry)
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+
+    def test_snapshot(self):
+        metrics.observe("db", 0.5)
+        metrics.observe("db", 1.5)
+        metrics.incr("ports_added")
+        metrics.incr("ports_added", 2)
+        metrics.gauge("tunnels", 3)
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot["timers"]["db"],
+                         {"count": 2, "total": 2.0, "max": 1.5, "avg": 1.0})
+        self.assertEqual(snapshot["counters"], {"ports_added": 3})
+        self.assertEqual(snapshot["gauges"], {"tunnels": 3})
+        self.assertEqual(self.registry.summary(),
+                         "db=2 avg=1000.0ms max=1500.0ms, ports_added=3, "
+                         "tunnels=3")
+
+    def test_timer(self):
+        try:
+            with metrics.timer("command"):
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(self.registry.snapshot()["timers"]["command"]
+                         ["count"], 1)
+
+    def test_latency_tracker(self):
+        tracker = metrics.LatencyTracker("plug_to_up")
+        tracker.start("a")
+        tracker.start("b")
+        tracker.start("c")
+        tracker.stop("a")
+        tracker.stop("a")
+        tracker.discard("b")
+        tracker.stop("b")
+        tracker.retain(set())
+        tracker.stop("c")
+        self.assertEqual(self.registry.snapshot()["timers"]["plug_to_up"]
+                         ["count"], 1)
+
+    def test_stats_server(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            socket_path = os.path.join(tempdir, "stats.sock")
+            server = metrics.StatsServer(socket_path)
+            metrics.incr("command_errors")
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(socket_path)
+            data = sock.makefile().read()
+            sock.close()
+            server.close()
+            self.assertEqual(json.loads(data)["counters"],
+                             {"command_errors": 1})
+        finally:
+            shutil.rmtree(tempdir)
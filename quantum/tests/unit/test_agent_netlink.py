@@ -0,0 +1,86 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import socket
+import unittest
+
+from quantum.agent import netlink
+
+
+def link_message(msg_type, index, name=None, family=0):
+    attrs = ""
+    if name:
+        value = name + "\0"
+        attrs = netlink.RTATTR.pack(netlink.RTATTR.size + len(value),
+                                    netlink.IFLA_IFNAME) + value
+        attrs += "\0" * (netlink._align(len(attrs)) - len(attrs))
+    # an attribute other than the name
+    attrs += netlink.RTATTR.pack(8, 4) + "\xdc\x05\0\0"
+    body = netlink.IFINFOMSG.pack(family, 1, index, 0, 0) + attrs
+    return netlink.NLMSGHDR.pack(netlink.NLMSGHDR.size + len(body),
+                                 msg_type, 0, 0, 0) + body
+
+
+class ParseTest(unittest.TestCase):
+
+    def test_parse(self):
+        data = (link_message(netlink.RTM_NEWLINK, 7, "tap0") +
+                link_message(netlink.RTM_DELLINK, 8, "eth1.10",
+                             socket.AF_BRIDGE) +
+                netlink.NLMSGHDR.pack(20, netlink.NLMSG_DONE, 2, 1, 0) +
+                "\0" * 4)
+        self.assertEqual(netlink.parse_link_messages(data),
+                         [(netlink.RTM_NEWLINK, 0, 7, "tap0"),
+                          (netlink.RTM_DELLINK, socket.AF_BRIDGE, 8,
+                           "eth1.10"),
+                          (netlink.NLMSG_DONE, None, None, None)])
+
+    def test_truncated(self):
+        data = link_message(netlink.RTM_NEWLINK, 7, "tap0")
+        self.assertEqual(netlink.parse_link_messages(data[:10]), [])
+
+
+class LinkMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.monitor = netlink.LinkMonitor(on_event=self.events.append)
+
+    def test_events(self):
+        self.monitor.apply_message(netlink.RTM_NEWLINK, 0, 1, "eth1", False)
+        self.monitor.apply_message(netlink.RTM_NEWLINK, 0, 7, "tap0")
+        # the tap is added to a bridge
+        self.monitor.apply_message(netlink.RTM_NEWLINK, 0, 7, "tap0")
+        self.monitor.apply_message(netlink.RTM_NEWLINK, 0, 7, "tap1")
+        self.monitor.apply_message(netlink.RTM_DELLINK, 0, 7, "tap1")
+        self.monitor.apply_message(netlink.RTM_DELLINK, 0, 9, "tap2")
+        self.assertEqual(self.events,
+                         [{"event": netlink.LINK_ADD, "device": "tap0"},
+                          {"event": netlink.LINK_DELETE, "device": "tap0"},
+                          {"event": netlink.LINK_ADD, "device": "tap1"},
+                          {"event": netlink.LINK_DELETE, "device": "tap1"}])
+
+    def test_bridge_port_messages_ignored(self):
+        self.monitor.apply_message(netlink.RTM_NEWLINK, 0, 7, "tap0")
+        # brctl addif, then brctl delif
+        self.monitor.apply_message(netlink.RTM_NEWLINK, socket.AF_BRIDGE, 7,
+                                   "tap0")
+        self.monitor.apply_message(netlink.RTM_DELLINK, socket.AF_BRIDGE, 7,
+                                   "tap0")
+        self.monitor.apply_message(netlink.RTM_NEWLINK, 0, 7, "tap0")
+        self.assertEqual(self.events,
+                         [{"event": netlink.LINK_ADD, "device": "tap0"}])
@@ -0,0 +1,101 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+import unittest
+
+import eventlet
+
+from quantum.agent import notifier
+
+
+def _poll(subscriber, expected_count, timeout=5):
+    """Collect events while letting the publisher's green threads run."""
+    events = []
+    deadline = time.time() + timeout
+    while len(events) < expected_count and time.time() < deadline:
+        eventlet.sleep(0.01)
+        events.extend(subscriber.wait(0.01))
+    return events
+
+
+class NotifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.publisher = notifier.NotificationPublisher("127.0.0.1:0")
+        address = "%s:%s" % self.publisher.address
+        self.subscriber = notifier.NotificationSubscriber(address,
+                                                          retry_interval=0.1)
+
+    def tearDown(self):
+        self.subscriber.close()
+        self.publisher.close()
+
+    def test_parse_address(self):
+        self.assertEqual(notifier.parse_address("10.0.0.1:1234"),
+                         ("10.0.0.1", 1234))
+        self.assertEqual(notifier.parse_address("10.0.0.1"),
+                         ("10.0.0.1", notifier.DEFAULT_PORT))
+
+    def test_resync_on_connect(self):
+        events = _poll(self.subscriber, 1)
+        self.assertEqual([e["event"] for e in events], [notifier.RESYNC])
+
+    def test_publish(self):
+        _poll(self.subscriber, 1)
+        # The subscriber is only registered once the publisher accepted it
+        deadline = time.time() + 5
+        while not self.publisher._subscribers and time.time() < deadline:
+            eventlet.sleep(0.01)
+        self.publisher.publish(notifier.PORT_PLUG, network_id="net1",
+                               port_id="port1", interface_id="vif1")
+        self.publisher.publish(notifier.PORT_UNPLUG, network_id="net1",
+                               port_id="port1", interface_id="vif1")
+        events = _poll(self.subscriber, 2)
+        self.assertEqual([e["event"] for e in events],
+                         [notifier.PORT_PLUG, notifier.PORT_UNPLUG])
+        self.assertEqual(events[0]["interface_id"], "vif1")
+        self.assertEqual(events[0]["network_id"], "net1")
+
+    def test_null_subscriber_sleeps(self):
+        start = time.time()
+        self.assertEqual(notifier.get_subscriber(None).wait(0.05), [])
+        self.assertTrue(time.time() - start >= 0.05)
+
+    def test_null_publisher(self):
+        notifier.get_publisher("").publish(notifier.NETWORK_CREATE,
+                                           network_id="net1")
+
+
+class EventTargetsTest(unittest.TestCase):
+
+    def test_targets(self):
+        events = [{"event": notifier.PORT_PLUG, "interface_id": "vif1"},
+                  {"event": notifier.PORT_UNPLUG, "interface_id": "vif2"},
+                  {"event": notifier.PORT_UPDATE, "interface_id": None},
+                  {"event": notifier.PORT_CREATE, "port_id": "port3"},
+                  {"event": notifier.NETWORK_CREATE, "network_id": "net1"},
+                  {"event": "ovsdb"}]
+        self.assertEqual(notifier.event_targets(events, ("ovsdb",)),
+                         (set(["vif1", "vif2"]), set(["net1"])))
+
+    def test_full_sync(self):
+        self.assertEqual(notifier.event_targets([]), None)
+        self.assertEqual(notifier.event_targets([{"event": "ovsdb"}]), None)
+        self.assertEqual(notifier.event_targets(
+            [{"event": notifier.PORT_PLUG, "interface_id": "vif1"},
+             {"event": notifier.RESYNC}]), None)
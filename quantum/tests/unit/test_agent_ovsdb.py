@@ -0,0 +1,166 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import time
+import unittest
+from StringIO import StringIO
+
+from quantum.agent import notifier
+from quantum.agent import ovsdb
+
+
+HEADINGS = ["row", "action", "name", "ofport", "external_ids"]
+
+
+def _update(*rows):
+    return {"headings": HEADINGS, "data": list(rows)}
+
+
+def _ids(iface_id):
+    return ["map", [["attached-mac", "fa:16:3e:00:00:01"],
+                    ["iface-id", iface_id]]]
+
+
+class JsonToPythonTest(unittest.TestCase):
+
+    def test_map(self):
+        self.assertEqual(ovsdb.json_to_python(["map", [["a", "b"],
+                                                       ["c", "d=e, f"]]]),
+                         {"a": "b", "c": "d=e, f"})
+
+    def test_set(self):
+        self.assertEqual(ovsdb.json_to_python(["set", []]), [])
+        self.assertEqual(ovsdb.json_to_python(["set", [1, 2]]), [1, 2])
+
+    def test_uuid(self):
+        self.assertEqual(ovsdb.json_to_python(["uuid", "abc"]), "abc")
+
+    def test_atom(self):
+        self.assertEqual(ovsdb.json_to_python(5), 5)
+        self.assertEqual(ovsdb.json_to_python("tap0"), "tap0")
+
+
+class InterfaceMonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.changes = []
+        self.monitor = ovsdb.InterfaceMonitor(
+            "sudo", on_change=lambda: self.changes.append(True))
+
+    def _names(self):
+        return sorted(i["name"] for i in self.monitor.get_interfaces())
+
+    def test_initial(self):
+        self.assertFalse(self.monitor.active)
+        self.monitor.apply_update(_update(
+            ["u1", "initial", "tap0", 1, _ids("vif-0")],
+            ["u2", "initial", "br-int", 65534, ["map", []]]))
+        self.assertTrue(self.monitor.active)
+        self.assertEqual(self._names(), ["br-int", "tap0"])
+        self.assertEqual(len(self.changes), 1)
+
+    def test_insert_modify_delete(self):
+        self.monitor.apply_update(_update(
+            ["u1", "insert", "tap0", ["set", []], _ids("vif-0")]))
+        self.monitor.apply_update(_update(
+            ["u1", "old", None, ["set", []], None],
+            ["u1", "new", "tap0", 3, _ids("vif-0")]))
+        interfaces = self.monitor.get_interfaces()
+        self.assertEqual(len(interfaces), 1)
+        self.assertEqual(interfaces[0]["ofport"], 3)
+        self.assertEqual(interfaces[0]["external_ids"]["iface-id"], "vif-0")
+        self.monitor.apply_update(_update(
+            ["u1", "delete", "tap0", 3, _ids("vif-0")]))
+        self.assertEqual(self.monitor.get_interfaces(), [])
+        self.assertEqual(len(self.changes), 3)
+
+    def test_read_updates(self):
+        stream = StringIO(
+            json.dumps(_update(["u1", "initial", "tap0", 1, _ids("v0")])) +
+            "\nnot json\n" +
+            json.dumps(_update(["u2", "insert", "tap1", 2, _ids("v1")])) +
+            "\n")
+        self.monitor._read_updates(stream)
+        self.assertEqual(self._names(), ["tap0", "tap1"])
+
+    def test_command(self):
+        self.assertEqual(self.monitor._command(),
+                         ["sudo", "ovsdb-client", "--format=json", "monitor",
+                          "Interface", "name,ofport,external_ids"])
+
+
+class FakeMonitor(object):
+    def __init__(self, active):
+        self.active = active
+
+
+class WaitForChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.subscriber = notifier.NullSubscriber()
+        self.old_interval = ovsdb.REFRESH_INTERVAL
+        ovsdb.REFRESH_INTERVAL = 0.01
+
+    def tearDown(self):
+        ovsdb.REFRESH_INTERVAL = self.old_interval
+
+    def test_polls_without_monitor(self):
+        start = time.time()
+        ovsdb.wait_for_changes(self.subscriber, None, time.time() + 60)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_waits_for_resync_deadline(self):
+        self.subscriber.connected = True
+        start = time.time()
+        ovsdb.wait_for_changes(self.subscriber, FakeMonitor(True),
+                               time.time() + 0.1)
+        self.assertTrue(time.time() - start >= 0.1)
+
+    def test_wakes_up_on_event(self):
+        self.subscriber.connected = True
+        self.subscriber.dispatch({"event": "ovsdb"})
+        start = time.time()
+        ovsdb.wait_for_changes(self.subscriber, FakeMonitor(True),
+                               time.time() + 60)
+        self.assertTrue(time.time() - start < 1)
+
+
+class DbListTest(unittest.TestCase):
+
+    def test_db_list(self):
+        calls = []
+
+        def run_vsctl(args):
+            calls.append(args)
+            return json.dumps({"headings": ["name", "external_ids"],
+                               "data": [["tap0", _ids("vif0")]]})
+        self.assertEqual(ovsdb.db_list(run_vsctl, "Interface",
+                                       ["name", "external_ids"], "tap0"),
+                         [{"name": "tap0",
+                           "external_ids": {"attached-mac":
+                                            "fa:16:3e:00:00:01",
+                                            "iface-id": "vif0"}}])
+        self.assertEqual(calls, [["--format=json",
+                                  "--columns=name,external_ids", "list",
+                                  "Interface", "tap0"]])
+
+    def test_bad_output(self):
+        self.assertEqual(ovsdb.db_list(lambda args: "ovs-vsctl: error",
+                                       "Interface", ["name"]), [])
+        self.assertEqual(ovsdb.db_get_map(lambda args: "", "Interface",
+                                          "tap0", "statistics"), {})
@@ -0,0 +1,155 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from quantum.agent import rootwrap
+from quantum.rootwrap import daemon
+from quantum.rootwrap import filters
+from quantum.tests.benchmark import rootwrap as rootwrap_benchmark
+
+LOG = logging.getLogger("quantum.tests.unit.test_agent_rootwrap")
+
+FILTERS = [filters.CommandFilter("/bin/echo", "root"),
+           filters.CommandFilter("/bin/cat", "root")]
+
+
+class RootwrapDaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tempdir, "run", "rootwrap.sock")
+        self.daemon = daemon.RootwrapDaemon(FILTERS, self.socket_path)
+        self.daemon.listen()
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        # the daemon is already running, so it is never started
+        self.client = rootwrap.DaemonClient(self.socket_path, ["false"],
+                                            pool_size=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.daemon.close()
+        rootwrap.configure_daemon("", False)
+        shutil.rmtree(self.tempdir)
+
+    def test_socket_mode(self):
+        mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+        self.assertEqual(mode & 0077, 0)
+
+    def test_stale_socket_replaced(self):
+        self.daemon.close()
+        server = daemon.RootwrapDaemon(FILTERS, self.socket_path)
+        server.listen()
+        server.close()
+
+    def test_execute(self):
+        self.assertEqual(self.client.execute(["echo", "hello"]),
+                         (0, "hello\n", ""))
+
+    def test_process_input(self):
+        data = "".join(chr(i) for i in range(256)) * 100
+        self.assertEqual(self.client.execute(["cat"], data), (0, data, ""))
+
+    def test_unauthorized(self):
+        returncode, stdout, stderr = self.client.execute(["ls", "/"])
+        self.assertEqual(returncode, daemon.RC_UNAUTHORIZED)
+        self.assertEqual(stdout, "")
+
+    def test_connections_reused(self):
+        for i in range(5):
+            self.client.execute(["echo", str(i)])
+        self.assertEqual(len(self.client._pool), 1)
+
+    def test_round_trips(self):
+        # round trips without a command, timed by the rootwrap benchmark
+        self.client.execute(["ls"])
+        pool = list(self.client._pool)
+        for i in range(100):
+            returncode, stdout, stderr = self.client.execute(["ls"])
+            self.assertEqual(returncode, daemon.RC_UNAUTHORIZED)
+        self.assertEqual(self.client._pool, pool)
+        self.assertEqual(self.client.execute(["echo", "done"]),
+                         (0, "done\n", ""))
+
+    def test_benchmark(self):
+        result = rootwrap_benchmark.run_daemon_benchmark(round_trips=100)
+        LOG.info("rootwrap daemon round trip: %.3fms, /bin/true: %.3fms "
+                 "through the daemon, %.3fms directly"
+                 % (result["round_trip_ms"], result["daemon_execute_ms"],
+                    result["direct_execute_ms"]))
+
+    def test_configured_execute(self):
+        rootwrap.configure_daemon("false", True, socket_path=self.socket_path)
+        self.assertEqual(rootwrap.execute("false", ["echo", "hello"]),
+                         (0, "hello\n", ""))
+
+    def test_fallback_to_root_helper(self):
+        self.daemon.close()
+        os.unlink(self.socket_path)
+        # starting the daemon through "false" fails right away
+        rootwrap.configure_daemon("false", True, socket_path=self.socket_path)
+        self.assertEqual(rootwrap.execute("env", ["echo", "hello"]),
+                         (0, "hello\n", ""))
+        self.assertTrue(rootwrap._retry_time > time.time())
+
+
+class RootwrapDaemonPathTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.tempdir, "run")
+        self.socket_path = os.path.join(self.directory, "rootwrap.sock")
+        self.daemon = daemon.RootwrapDaemon(FILTERS, self.socket_path)
+
+    def tearDown(self):
+        self.daemon.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_default_path(self):
+        self.assertEqual(daemon.RootwrapDaemon(FILTERS).socket_path,
+                         daemon.SOCKET_PATH)
+
+    def test_file_not_replaced(self):
+        os.mkdir(self.directory, 0755)
+        open(self.socket_path, "w").close()
+        self.assertRaises(daemon.UnsafeSocketPath, self.daemon.listen)
+        self.assertTrue(os.path.isfile(self.socket_path))
+
+    def test_writable_directory_refused(self):
+        os.mkdir(self.directory)
+        os.chmod(self.directory, 0777)
+        self.assertRaises(daemon.UnsafeSocketPath, self.daemon.listen)
+
+    def test_symlinked_directory_refused(self):
+        target = os.path.join(self.tempdir, "target")
+        os.mkdir(target, 0755)
+        os.symlink(target, self.directory)
+        self.assertRaises(daemon.UnsafeSocketPath, self.daemon.listen)
+        self.assertEqual(os.listdir(target), [])
+
+    def test_missing_parent(self):
+        self.daemon.socket_path = os.path.join(self.tempdir, "a", "b", "sock")
+        self.assertRaises(OSError, self.daemon.listen)
@@ -0,0 +1,114 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+import stubout
+
+from quantum.agent import status
+
+
+class FakeDB(object):
+
+    bind = None
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    @property
+    def session(self):
+        return self
+
+    def execute(self, statement, params):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.statements.append((str(statement), params))
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.statements = []
+
+
+class StatusReporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(status.time, "sleep", lambda seconds: None)
+        self.reporter = status.StatusReporter()
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+
+    def test_only_changes_written(self):
+        self.reporter.update("a", "UP", "DOWN")
+        self.reporter.update("b", "UP", "UP")
+        self.reporter.update("c", "DOWN")
+        db = FakeDB()
+        self.assertEqual(self.reporter.flush(db), {"a": "UP", "c": "DOWN"})
+        self.assertEqual(db.statements,
+                         [("UPDATE ports SET op_status = :status "
+                           "WHERE uuid IN (:p0)", {"status": "DOWN",
+                                                   "p0": "c"}),
+                          ("UPDATE ports SET op_status = :status "
+                           "WHERE uuid IN (:p0)", {"status": "UP",
+                                                   "p0": "a"})])
+        self.reporter.update("a", "UP")
+        self.reporter.update("c", "DOWN")
+        db = FakeDB()
+        self.assertEqual(self.reporter.flush(db), {})
+        self.assertEqual(db.statements, [])
+        # the transaction is committed anyway
+        self.assertEqual(db.commits, 1)
+
+    def test_statements_chunked(self):
+        self.stubs.Set(status, "MAX_PORTS_PER_STATEMENT", 2)
+        for port_id in ("e", "d", "c", "b", "a"):
+            self.reporter.update(port_id, "UP")
+        statements = self.reporter.statements()
+        self.assertEqual([sorted(params.values()) for _, params in statements],
+                         [["UP", "a", "b"], ["UP", "c", "d"], ["UP", "e"]])
+
+    def test_retain(self):
+        self.reporter.update("a", "UP", "DOWN")
+        self.reporter.update("b", "UP", "UP")
+        self.reporter.retain(set())
+        self.assertEqual(self.reporter.statements(), [])
+        # a port created again with the same uuid is written
+        self.reporter.update("b", "UP")
+        self.assertEqual(len(self.reporter.statements()), 1)
+
+    def test_deadlock_retried(self):
+        self.reporter.update("a", "UP")
+        db = FakeDB([Exception(1213, "Deadlock found when trying to get "
+                               "lock; try restarting transaction")])
+        self.assertEqual(self.reporter.flush(db), {"a": "UP"})
+        self.assertEqual(db.rollbacks, 1)
+        self.assertEqual(len(db.statements), 1)
+
+    def test_failure_keeps_changes(self):
+        self.reporter.update("a", "UP")
+        db = FakeDB([Exception(2006, "MySQL server has gone away")])
+        self.assertEqual(self.reporter.flush(db), {})
+        self.assertEqual(db.rollbacks, 1)
+        db = FakeDB()
+        self.assertEqual(self.reporter.flush(db), {"a": "UP"})
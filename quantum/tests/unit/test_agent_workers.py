@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import unittest
+
+from quantum.agent import workers
+
+
+def _fail(message):
+    raise ValueError(message)
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_inline(self):
+        pool = workers.WorkerPool(1)
+        calls = []
+        pool.submit("a", calls.append, 1)
+        self.assertEqual(calls, [1])
+        tasks = pool.wait()
+        self.assertEqual(len(tasks), 1)
+        self.assertEqual(pool.wait(), [])
+
+    def test_results_in_order(self):
+        pool = workers.WorkerPool(4)
+        for i in range(20):
+            pool.submit(i, lambda x: x * 2, i)
+        self.assertEqual([t.result for t in pool.wait()],
+                         [i * 2 for i in range(20)])
+
+    def test_same_key_in_order(self):
+        pool = workers.WorkerPool(4)
+        calls = []
+        for i in range(20):
+            pool.submit("port%d" % (i % 2), calls.append, i)
+        pool.wait()
+        self.assertEqual([i for i in calls if i % 2], range(1, 20, 2))
+        self.assertEqual([i for i in calls if not i % 2], range(0, 20, 2))
+
+    def test_concurrency(self):
+        pool = workers.WorkerPool(4)
+        threads = set()
+        running = [0, 0]
+        lock = threading.Lock()
+        all_running = threading.Event()
+
+        def action():
+            lock.acquire()
+            try:
+                threads.add(threading.currentThread())
+                running[0] += 1
+                running[1] = max(running)
+                if running[0] == pool.size:
+                    all_running.set()
+            finally:
+                lock.release()
+            # the first actions of every worker wait for each other
+            all_running.wait(5)
+            lock.acquire()
+            try:
+                running[0] -= 1
+            finally:
+                lock.release()
+        for i in range(8):
+            pool.submit(i, action)
+        pool.wait()
+        self.assertEqual(len(threads), pool.size)
+        self.assertFalse(threading.currentThread() in threads)
+        # the peak number of actions running at once
+        self.assertEqual(running[1], pool.size)
+
+    def test_errors_collected(self):
+        pool = workers.WorkerPool(4)
+        pool.submit("a", _fail, "boom")
+        pool.submit("b", lambda: "ok")
+        pool.submit("c", _fail, "bang")
+        tasks = pool.wait()
+        self.assertEqual([str(t.error) for t in tasks],
+                         ["boom", "None", "bang"])
+        self.assertEqual(tasks[1].result, "ok")
+
+    def test_configure(self):
+        original = workers.get_pool()
+        try:
+            workers.configure(3)
+            self.assertEqual(workers.get_pool().size, 3)
+        finally:
+            workers._pool = original
@@ -0,0 +1,205 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2012 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import stubout
+
+from quantum.rootwrap import filters
+from quantum.rootwrap import wrapper
+from quantum.tests.benchmark import rootwrap as rootwrap_benchmark
+
+
+LOG = logging.getLogger("quantum.tests.test_rootwrap")
+
+
+def _bridge_filters(count):
+    """Per bridge filters, as generated for large hosts."""
+    entries = []
+    for i in range(count):
+        entries.append(filters.RegExpFilter(
+            "/usr/bin/ovs-vsctl", "root", "ovs-vsctl", "--timeout=2",
+            "add-port", "br%d" % i, "tap[0-9a-f-]+"))
+        entries.append(filters.RegExpFilter(
+            "/sbin/ip", "root", "ip", "link", "set", "qvb%d" % i, "up|down"))
+        entries.append(filters.CommandFilter("/sbin/tool%d" % i, "root"))
+    return entries
+
+
+class RegExpFilterTest(unittest.TestCase):
+
+    def test_match(self):
+        f = filters.RegExpFilter("/sbin/ip", "root", "ip", "link", "set",
+                                 "tap.*", "up|down")
+        self.assertTrue(f.match(["ip", "link", "set", "tap0", "up"]))
+        self.assertFalse(f.match(["ip", "link", "set", "tap0", "upx"]))
+        self.assertFalse(f.match(["ip", "link", "set", "tap0"]))
+        self.assertEqual(f.get_command_name(), "ip")
+
+    def test_bad_pattern(self):
+        f = filters.RegExpFilter("/sbin/ip", "root", "ip", "(")
+        self.assertFalse(f.match(["ip", "("]))
+
+    def test_pattern_command(self):
+        f = filters.RegExpFilter("/sbin/ip", "root", "i.", "link")
+        self.assertEqual(f.get_command_name(), None)
+
+
+class FilterIndexTest(unittest.TestCase):
+
+    def test_order_preserved(self):
+        any_ip = filters.RegExpFilter("/sbin/ip", "root", "i.", "link")
+        ip = filters.CommandFilter("/sbin/ip", "root")
+        cat = filters.CommandFilter("/bin/cat", "root")
+        index = wrapper.FilterIndex([cat, any_ip, ip])
+        self.assertEqual(index.candidates(["ip", "link"]), [any_ip, ip])
+        self.assertEqual(index.candidates(["cat"]), [cat, any_ip])
+        self.assertEqual(index.candidates(["ls"]), [any_ip])
+
+    def test_match_filter(self):
+        missing = filters.CommandFilter("/nonexistent/cat", "root")
+        cat = filters.CommandFilter("/bin/cat", "root")
+        echo = filters.CommandFilter("/bin/echo", "root")
+        index = wrapper.FilterIndex([missing, echo, cat])
+        # filters with an existing executable come first
+        self.assertEqual(wrapper.match_filter(index, ["cat"]), cat)
+        self.assertEqual(wrapper.match_filter(index, ["echo", "a"]), echo)
+        self.assertEqual(wrapper.match_filter(index, ["ls"]), None)
+
+    def test_same_match_as_list(self):
+        entries = _bridge_filters(100)
+        index = wrapper.FilterIndex(entries)
+        for userargs in (["ip", "link", "set", "qvb42", "up"],
+                         ["ovs-vsctl", "--timeout=2", "add-port", "br7",
+                          "tap0"],
+                         ["tool9"], ["ls"]):
+            self.assertEqual(wrapper.match_filter(entries, userargs),
+                             wrapper.match_filter(index, userargs))
+
+    def test_literal_arguments(self):
+        add = filters.RegExpFilter("/sbin/ip", "root", "ip", "link", "add",
+                                   ".*")
+        any_set = filters.RegExpFilter("/sbin/ip", "root", "ip", "link",
+                                       "set", ".*")
+        set_tap = filters.RegExpFilter("/sbin/ip", "root", "ip", "link",
+                                       "set", "tap0")
+        ip = filters.CommandFilter("/sbin/ip", "root")
+        index = wrapper.FilterIndex([set_tap, add, ip, any_set])
+        self.assertEqual(index.candidates(["ip", "link", "set", "tap0"]),
+                         [set_tap, ip, any_set])
+        self.assertEqual(index.candidates(["ip", "link", "set", "tap1"]),
+                         [ip, any_set])
+        self.assertEqual(index.candidates(["ip", "link", "add", "tap1"]),
+                         [add, ip])
+        self.assertEqual(index.candidates(["ip", "addr"]), [ip])
+
+    def test_benchmark(self):
+        # 5000 ovs-vsctl filters and 2500 ip filters
+        result = rootwrap_benchmark.run_benchmark(2500, repeat=10)
+        LOG.info("Authorization with %d filters: %.3fms linear, %.4fms "
+                 "indexed" % (result["filters"], result["linear_ms"],
+                              result["indexed_ms"]))
+        # only the filters of the bridge are tried
+        self.assertEqual(result["indexed_tried"], 1)
+        self.assertTrue(result["linear_tried"] > 3000)
+
+
+class FilterCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stubs = stubout.StubOutForTesting()
+        self.tempdir = tempfile.mkdtemp()
+        os.chmod(self.tempdir, 0755)
+        self.cache_file = os.path.join(self.tempdir, "filters.cache")
+        self.loads = 0
+
+        def load_filters():
+            self.loads += 1
+            return _bridge_filters(10)
+        self.stubs.Set(wrapper, "load_filters", load_filters)
+
+    def tearDown(self):
+        self.stubs.UnsetAll()
+        shutil.rmtree(self.tempdir)
+
+    def test_cached(self):
+        index = wrapper.load_filter_index(self.cache_file)
+        self.assertTrue(os.path.exists(self.cache_file))
+        cached = wrapper.load_filter_index(self.cache_file)
+        self.assertEqual(self.loads, 1)
+        self.assertEqual(cached.size, index.size)
+        self.assertTrue(wrapper.match_filter(
+            cached, ["ip", "link", "set", "qvb3", "down"]))
+        self.assertEqual(os.listdir(self.tempdir), ["filters.cache"])
+
+    def test_cache_is_json(self):
+        read_file = filters.ReadFileFilter("/etc/hosts")
+        self.stubs.Set(wrapper, "load_filters", lambda: [read_file])
+        wrapper.load_filter_index(self.cache_file)
+        with open(self.cache_file) as f:
+            self.assertEqual(json.load(f)["filters"],
+                             [["ReadFileFilter", ["/etc/hosts"]]])
+        cached = wrapper.load_filter_index(self.cache_file)
+        self.assertTrue(cached.filters[0].match(["cat", "/etc/hosts"]))
+
+    def test_unknown_filter_ignored(self):
+        wrapper.load_filter_index(self.cache_file)
+        with open(self.cache_file) as f:
+            cache = json.load(f)
+        cache["filters"][0][0] = "FilterIndex"
+        with open(self.cache_file, "w") as f:
+            json.dump(cache, f)
+        wrapper.load_filter_index(self.cache_file)
+        self.assertEqual(self.loads, 2)
+
+    def test_rebuilt_when_modules_change(self):
+        wrapper.load_filter_index(self.cache_file)
+        key = wrapper._filters_key() + [["new", 0, 0]]
+        self.stubs.Set(wrapper, "_filters_key", lambda: key)
+        self.assertEqual(wrapper.load_filter_index(self.cache_file).key, key)
+        self.assertEqual(self.loads, 2)
+        wrapper.load_filter_index(self.cache_file)
+        self.assertEqual(self.loads, 2)
+
+    def test_writable_cache_ignored(self):
+        wrapper.load_filter_index(self.cache_file)
+        os.chmod(self.cache_file, 0666)
+        wrapper.load_filter_index(self.cache_file)
+        self.assertEqual(self.loads, 2)
+
+    def test_writable_directory_ignored(self):
+        os.chmod(self.tempdir, 0777)
+        wrapper.load_filter_index(self.cache_file)
+        self.assertFalse(os.path.exists(self.cache_file))
+
+    def test_symlinked_cache_not_followed(self):
+        target = os.path.join(self.tempdir, "target")
+        open(target, "w").close()
+        os.symlink(target, self.cache_file)
+        wrapper.load_filter_index(self.cache_file)
+        wrapper.load_filter_index(self.cache_file)
+        self.assertEqual(os.path.getsize(target), 0)
+        self.assertEqual(self.loads, 1)
+
+    def test_unwritable_cache(self):
+        cache_file = os.path.join(self.tempdir, "missing", "filters.cache")
+        self.assertTrue(wrapper.load_filter_index(cache_file))